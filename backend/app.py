@@ -15,6 +15,7 @@ from routes.checkout import checkout_bp
 from routes.user import user_bp
 from routes.products import products_bp
 from database.models import init_db
+from services.autocomplete import get_autocomplete_index
 
 app = Flask(__name__, static_folder='static')
 CORS(app, resources={r"/api/*": {"origins": "*"}})
@@ -34,6 +35,13 @@ app.register_blueprint(products_bp, url_prefix='/api/products')
 # Initialize database
 init_db(app)
 
+# Build the autocomplete index up front so the first keystroke doesn't pay for it
+with app.app_context():
+    try:
+        get_autocomplete_index()
+    except Exception as e:
+        print(f"Autocomplete index will be built on first use: {e}")
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     return jsonify({"status": "healthy", "version": "1.0.0"})
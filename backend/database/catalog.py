@@ -0,0 +1,129 @@
+"""
+Catalog change tracking.
+
+Two mechanisms, for two kinds of consumers:
+
+- catalog_state.version is bumped by SQL triggers on every product write, so
+  any process (or a bulk loader bypassing the ORM) invalidates caches built
+  from the catalog. get_catalog_version() reads it, throttled.
+- on_product_change() listeners receive row snapshots after each committed
+  ORM flush that touched products, for in-process incremental updates.
+"""
+import time
+import traceback
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+from database.models import db, Product
+
+# How long a read of catalog_state.version is trusted before re-querying
+CATALOG_VERSION_TTL = 1.0
+
+CATALOG_VERSION_TRIGGERS = {
+    f'catalog_version_after_{action.lower()}': f"""
+CREATE TRIGGER IF NOT EXISTS catalog_version_after_{action.lower()} AFTER {action} ON product BEGIN
+    UPDATE catalog_state SET version = version + 1 WHERE id = 1;
+END
+"""
+    for action in ('INSERT', 'UPDATE', 'DELETE')
+}
+
+_product_listeners = []
+_version_cache = {'version': None, 'checked_at': 0.0}
+
+def create_catalog_state(connection):
+    """Create the single-row catalog_state table and its version triggers"""
+    connection.execute(text(
+        "CREATE TABLE IF NOT EXISTS catalog_state ("
+        "id INTEGER PRIMARY KEY CHECK (id = 1), "
+        "version INTEGER NOT NULL DEFAULT 0)"
+    ))
+    connection.execute(text("INSERT OR IGNORE INTO catalog_state (id, version) VALUES (1, 0)"))
+    create_catalog_version_triggers(connection)
+
+def create_catalog_version_triggers(connection):
+    for ddl in CATALOG_VERSION_TRIGGERS.values():
+        connection.execute(text(ddl))
+
+def drop_catalog_version_triggers(connection):
+    for name in CATALOG_VERSION_TRIGGERS:
+        connection.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+
+def bump_catalog_version(connection):
+    """Bump the version explicitly (for writes made with the triggers dropped)"""
+    connection.execute(text("UPDATE catalog_state SET version = version + 1 WHERE id = 1"))
+    _version_cache['checked_at'] = 0.0
+
+def get_catalog_version(force=False):
+    """
+    Current catalog version, re-read at most once per CATALOG_VERSION_TTL
+    
+    Args:
+        force: Skip the throttle and read the table now
+    
+    Returns:
+        Integer version, or 0 if the catalog_state table is missing
+    """
+    now = time.monotonic()
+    if force or _version_cache['version'] is None or now - _version_cache['checked_at'] > CATALOG_VERSION_TTL:
+        try:
+            with db.engine.connect() as connection:
+                version = connection.execute(text("SELECT version FROM catalog_state WHERE id = 1")).scalar()
+            _version_cache['version'] = version or 0
+        except Exception as e:
+            print(f"Error reading catalog version: {e}")
+            _version_cache['version'] = 0
+        _version_cache['checked_at'] = now
+    
+    return _version_cache['version']
+
+def product_snapshot(product):
+    """Plain-dict copy of the product columns listeners care about"""
+    return {
+        'id': product.id,
+        'name': product.name,
+        'category': product.category,
+        'subcategory': product.subcategory,
+        'price': product.price
+    }
+
+def on_product_change(listener):
+    """
+    Register a listener for committed product changes
+    
+    The listener is called as listener(changes) where changes is a list of
+    (change_type, snapshot) tuples and change_type is 'insert', 'update' or 'delete'.
+    """
+    if listener not in _product_listeners:
+        _product_listeners.append(listener)
+    return listener
+
+@event.listens_for(Session, 'after_flush')
+def _collect_product_changes(session, flush_context):
+    changes = session.info.setdefault('product_changes', [])
+    for obj in session.new:
+        if isinstance(obj, Product):
+            changes.append(('insert', product_snapshot(obj)))
+    for obj in session.dirty:
+        if isinstance(obj, Product) and session.is_modified(obj, include_collections=False):
+            changes.append(('update', product_snapshot(obj)))
+    for obj in session.deleted:
+        if isinstance(obj, Product):
+            changes.append(('delete', product_snapshot(obj)))
+
+@event.listens_for(Session, 'after_commit')
+def _dispatch_product_changes(session):
+    changes = session.info.pop('product_changes', None)
+    if not changes:
+        return
+    
+    _version_cache['checked_at'] = 0.0
+    for listener in list(_product_listeners):
+        try:
+            listener(changes)
+        except Exception as e:
+            print(f"Error in product change listener {getattr(listener, '__name__', listener)}: {e}")
+            traceback.print_exc()
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_product_changes(session):
+    session.info.pop('product_changes', None)
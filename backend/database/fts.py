@@ -0,0 +1,83 @@
+"""
+SQLite FTS5 full-text index over the product catalog.
+
+product_fts is an external-content table: it stores only the inverted index
+and reads column values back from product, so triggers keep it in sync with
+every insert, update and delete.
+"""
+from sqlalchemy import text
+
+PRODUCT_FTS_TABLE = 'product_fts'
+PRODUCT_FTS_COLUMNS = ('name', 'description', 'category', 'subcategory')
+
+CREATE_PRODUCT_FTS = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS {PRODUCT_FTS_TABLE} USING fts5(
+    name, description, category, subcategory,
+    content='product',
+    content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2',
+    prefix='2 3'
+)
+"""
+
+_columns = ', '.join(PRODUCT_FTS_COLUMNS)
+_new_values = ', '.join(f'new.{col}' for col in PRODUCT_FTS_COLUMNS)
+_old_values = ', '.join(f'old.{col}' for col in PRODUCT_FTS_COLUMNS)
+
+PRODUCT_FTS_TRIGGERS = {
+    'product_fts_after_insert': f"""
+CREATE TRIGGER IF NOT EXISTS product_fts_after_insert AFTER INSERT ON product BEGIN
+    INSERT INTO {PRODUCT_FTS_TABLE}(rowid, {_columns}) VALUES (new.id, {_new_values});
+END
+""",
+    'product_fts_after_delete': f"""
+CREATE TRIGGER IF NOT EXISTS product_fts_after_delete AFTER DELETE ON product BEGIN
+    INSERT INTO {PRODUCT_FTS_TABLE}({PRODUCT_FTS_TABLE}, rowid, {_columns}) VALUES ('delete', old.id, {_old_values});
+END
+""",
+    'product_fts_after_update': f"""
+CREATE TRIGGER IF NOT EXISTS product_fts_after_update AFTER UPDATE ON product BEGIN
+    INSERT INTO {PRODUCT_FTS_TABLE}({PRODUCT_FTS_TABLE}, rowid, {_columns}) VALUES ('delete', old.id, {_old_values});
+    INSERT INTO {PRODUCT_FTS_TABLE}(rowid, {_columns}) VALUES (new.id, {_new_values});
+END
+"""
+}
+
+def product_fts_exists(connection):
+    """Check whether the product_fts virtual table has been created"""
+    row = connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {'name': PRODUCT_FTS_TABLE}
+    ).first()
+    return row is not None
+
+def create_product_fts_triggers(connection):
+    """Create the triggers that keep product_fts in sync with product"""
+    for ddl in PRODUCT_FTS_TRIGGERS.values():
+        connection.execute(text(ddl))
+
+def drop_product_fts_triggers(connection):
+    """Drop the sync triggers (used by bulk loads, which rebuild afterwards)"""
+    for name in PRODUCT_FTS_TRIGGERS:
+        connection.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+
+def rebuild_product_fts(connection):
+    """Re-index every product row from scratch"""
+    connection.execute(text(f"INSERT INTO {PRODUCT_FTS_TABLE}({PRODUCT_FTS_TABLE}) VALUES ('rebuild')"))
+
+def create_product_fts(connection):
+    """
+    Create the FTS5 table and its triggers, then index the existing catalog
+    
+    Returns:
+        False if this SQLite build was compiled without FTS5
+    """
+    try:
+        connection.execute(text(CREATE_PRODUCT_FTS))
+    except Exception as e:
+        print(f"FTS5 unavailable, product search will use LIKE matching: {e}")
+        return False
+    
+    create_product_fts_triggers(connection)
+    rebuild_product_fts(connection)
+    return True
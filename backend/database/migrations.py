@@ -0,0 +1,93 @@
+"""
+Versioned schema migrations for the SQLite database.
+
+db.create_all() only creates tables that do not exist yet, so anything added
+to an existing table (indexes, columns, virtual tables, triggers) is applied
+here. Each migration runs once and is recorded in schema_migrations.
+"""
+from sqlalchemy import text
+from database.models import Product, UserHistory, PopularityBucket, ProductInventory
+from database.fts import create_product_fts
+from database.catalog import create_catalog_state
+
+MIGRATIONS = []
+
+def migration(version, description):
+    """Register a migration function under a version number"""
+    def register(func):
+        MIGRATIONS.append((version, description, func))
+        return func
+    return register
+
+@migration(1, 'secondary indexes for product and user_history access patterns')
+def add_secondary_indexes(connection):
+    for table in (Product.__table__, UserHistory.__table__):
+        for index in table.indexes:
+            index.create(bind=connection, checkfirst=True)
+
+@migration(2, 'product.subcategory column backfilled from features')
+def add_product_subcategory(connection):
+    columns = {row[1] for row in connection.execute(text("PRAGMA table_info(product)"))}
+    if 'subcategory' not in columns:
+        connection.execute(text("ALTER TABLE product ADD COLUMN subcategory VARCHAR(100)"))
+    
+    # features may be stored as an object or (older loads) as a JSON-encoded string
+    connection.execute(text("""
+        UPDATE product SET subcategory = CASE json_type(features)
+            WHEN 'object' THEN json_extract(features, '$.subcategory')
+            WHEN 'text' THEN CASE WHEN json_valid(json_extract(features, '$'))
+                THEN json_extract(json_extract(features, '$'), '$.subcategory') END
+        END
+        WHERE subcategory IS NULL AND json_valid(features)
+    """))
+
+@migration(3, 'product_fts full-text index with sync triggers')
+def add_product_fts(connection):
+    create_product_fts(connection)
+
+@migration(4, 'catalog_state version counter bumped by product triggers')
+def add_catalog_state(connection):
+    create_catalog_state(connection)
+
+@migration(5, 'popularity_bucket summary table backfilled from recent user_history')
+def add_popularity_buckets(connection):
+    from services.popularity import backfill_popularity_buckets
+    
+    PopularityBucket.__table__.create(bind=connection, checkfirst=True)
+    backfill_popularity_buckets(connection)
+
+@migration(6, 'product_inventory stock levels for the local inventory provider')
+def add_product_inventory(connection):
+    ProductInventory.__table__.create(bind=connection, checkfirst=True)
+
+def get_applied_versions(connection):
+    """Return the set of migration versions already applied"""
+    connection.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version INTEGER PRIMARY KEY, "
+        "description TEXT, "
+        "applied_at DATETIME DEFAULT CURRENT_TIMESTAMP)"
+    ))
+    return {row[0] for row in connection.execute(text("SELECT version FROM schema_migrations"))}
+
+def run_migrations(engine):
+    """
+    Apply all pending migrations in version order, one transaction each
+    
+    Args:
+        engine: SQLAlchemy engine to migrate
+    """
+    with engine.begin() as connection:
+        applied = get_applied_versions(connection)
+    
+    for version, description, func in sorted(MIGRATIONS, key=lambda m: m[0]):
+        if version in applied:
+            continue
+        
+        print(f"Applying migration {version}: {description}")
+        with engine.begin() as connection:
+            func(connection)
+            connection.execute(
+                text("INSERT INTO schema_migrations (version, description) VALUES (:version, :description)"),
+                {'version': version, 'description': description}
+            )
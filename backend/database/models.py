@@ -9,7 +9,13 @@ def init_db(app):
     db.init_app(app)
     
     with app.app_context():
+        from database.sqlite_tuning import configure_sqlite_engine
+        from database.migrations import run_migrations
+        
+        # Tune every connection (WAL, cache, mmap) before the first one is opened
+        configure_sqlite_engine(db.engine)
         db.create_all()
+        run_migrations(db.engine)
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -27,10 +33,16 @@ class User(db.Model):
         }
 
 class Product(db.Model):
+    __table_args__ = (
+        db.Index('ix_product_category_price', 'category', 'price'),
+        db.Index('ix_product_price', 'price'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text, nullable=True)
     category = db.Column(db.String(100), nullable=False)
+    subcategory = db.Column(db.String(100), nullable=True)
     price = db.Column(db.Float, nullable=False)
     image_url = db.Column(db.String(500), nullable=False)
     features = db.Column(db.JSON, nullable=True)  # Store extracted features
@@ -41,13 +53,36 @@ class Product(db.Model):
             'name': self.name,
             'description': self.description,
             'category': self.category,
+            'subcategory': self.subcategory,
             'price': self.price,
             'image_url': self.image_url
         }
 
 class UserHistory(db.Model):
+    __table_args__ = (
+        db.Index('ix_user_history_user_id_timestamp', 'user_id', 'timestamp'),
+        db.Index('ix_user_history_product_id_timestamp', 'product_id', 'timestamp'),
+        db.Index('ix_user_history_timestamp', 'timestamp'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
     interaction_type = db.Column(db.String(50), nullable=False)  # view, search, purchase
     timestamp = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
+class PopularityBucket(db.Model):
+    """Interaction weight per product per time bucket (rolling popularity summary)"""
+    __tablename__ = 'popularity_bucket'
+    
+    bucket_start = db.Column(db.Integer, primary_key=True)  # epoch seconds, aligned to the bucket size
+    product_id = db.Column(db.Integer, primary_key=True)
+    weight = db.Column(db.Float, nullable=False, default=0.0)
+
+class ProductInventory(db.Model):
+    """Stock level per product, read by the local inventory provider"""
+    __tablename__ = 'product_inventory'
+    
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    stock_level = db.Column(db.Integer, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
@@ -0,0 +1,135 @@
+import sys
+from sqlalchemy import create_engine, event, text
+
+# Pragmas applied to every new SQLite connection.
+# WAL lets readers run while a writer is active, NORMAL sync is safe under WAL,
+# and the cache/mmap sizes keep the hot product + history pages in memory.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -64000,        # negative value = KiB, i.e. ~64 MB page cache
+    'mmap_size': 268435456,      # 256 MB of memory-mapped I/O
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000         # wait up to 5s on a locked database instead of failing
+}
+
+# Hot queries issued by the routes, with the index SQLite is expected to pick.
+# Used by check_query_plans() to catch regressions (dropped/renamed indexes,
+# queries rewritten so they can no longer use them).
+EXPECTED_QUERY_PLANS = [
+    {
+        'name': 'user_history_recent_for_user',
+        'sql': 'SELECT id, product_id, interaction_type, timestamp FROM user_history '
+               'WHERE user_id = 1 ORDER BY timestamp DESC LIMIT 20',
+        'index': 'ix_user_history_user_id_timestamp'
+    },
+    {
+        'name': 'user_history_count_for_user',
+        'sql': 'SELECT count(*) FROM user_history WHERE user_id = 1',
+        'index': 'ix_user_history_user_id_timestamp'
+    },
+    {
+        'name': 'user_history_for_product',
+        'sql': 'SELECT count(*) FROM user_history WHERE product_id = 1',
+        'index': 'ix_user_history_product_id_timestamp'
+    },
+    {
+        'name': 'user_history_since',
+        'sql': "SELECT product_id FROM user_history WHERE timestamp >= '2025-01-01'",
+        'index': 'ix_user_history_timestamp'
+    },
+    {
+        'name': 'products_in_category_by_price',
+        'sql': "SELECT id FROM product WHERE category = 'Apparel' ORDER BY price LIMIT 20",
+        'index': 'ix_product_category_price'
+    },
+    {
+        'name': 'products_in_price_range',
+        'sql': 'SELECT id FROM product WHERE price BETWEEN 10 AND 50',
+        'index': 'ix_product_price'
+    },
+    {
+        'name': 'category_counts',
+        'sql': 'SELECT category, count(id) FROM product GROUP BY category',
+        'index': 'ix_product_category_price'
+    }
+]
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record=None):
+    """Apply SQLITE_PRAGMAS to a raw DBAPI connection"""
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {pragma}={value}")
+    finally:
+        cursor.close()
+
+def configure_sqlite_engine(engine):
+    """
+    Register the pragma hook on an engine so every pooled connection is tuned
+
+    Args:
+        engine: SQLAlchemy engine (non-SQLite engines are left untouched)
+    """
+    if engine.dialect.name != 'sqlite':
+        return
+
+    if not event.contains(engine, 'connect', apply_sqlite_pragmas):
+        event.listen(engine, 'connect', apply_sqlite_pragmas)
+
+def explain_query_plan(connection, sql):
+    """Return the EXPLAIN QUERY PLAN detail lines for a SQL statement"""
+    rows = connection.execute(text(f"EXPLAIN QUERY PLAN {sql}")).fetchall()
+    return [row[-1] for row in rows]
+
+def check_query_plans(engine):
+    """
+    Run EXPLAIN QUERY PLAN for every entry in EXPECTED_QUERY_PLANS
+
+    Args:
+        engine: SQLAlchemy engine with the ShopSmarter schema
+
+    Returns:
+        List of dicts with the plan and whether the expected index was used
+    """
+    results = []
+    with engine.connect() as connection:
+        for expected in EXPECTED_QUERY_PLANS:
+            plan = explain_query_plan(connection, expected['sql'])
+            results.append({
+                'name': expected['name'],
+                'expected_index': expected['index'],
+                'plan': plan,
+                'uses_index': any(expected['index'] in line for line in plan)
+            })
+    return results
+
+def main():
+    """
+    Query plan regression check against a fresh in-memory schema.
+
+    Usage (from backend/): python -m database.sqlite_tuning
+    Exits with status 1 if any hot query stops using its index.
+    """
+    from database.models import db
+    from database.migrations import run_migrations
+
+    engine = create_engine('sqlite://')
+    configure_sqlite_engine(engine)
+    db.metadata.create_all(engine)
+    run_migrations(engine)
+
+    failures = 0
+    for result in check_query_plans(engine):
+        status = 'OK  ' if result['uses_index'] else 'FAIL'
+        print(f"{status} {result['name']}: {' | '.join(result['plan'])}")
+        if not result['uses_index']:
+            failures += 1
+
+    if failures:
+        print(f"{failures} queries no longer use their expected index")
+        sys.exit(1)
+    print("All hot queries use their expected indexes")
+
+if __name__ == '__main__':
+    main()
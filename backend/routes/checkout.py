@@ -2,7 +2,10 @@ from flask import Blueprint, request, jsonify
 import stripe
 import os
 from database.models import db, Product, User, UserHistory
-from services.cart_ai import CartAI
+from services.cart_ai import CartAI, CART_ANALYSIS_BUDGET_MS
+from services.quotes import redeem_quote, quoted_final_total, to_cents, InvalidQuote
+from services.response_cache import cached_response
+from services.inventory import INVENTORY_CACHE_TTL
 import uuid
 import traceback
 
@@ -28,10 +31,15 @@ def analyze_cart():
         cart_items = data['cart_items']
         user_id = data.get('user_id')
         
+        try:
+            budget_ms = int(data.get('budget_ms', CART_ANALYSIS_BUDGET_MS))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'budget_ms must be an integer'}), 400
+        
         print(f"Analyzing cart with {len(cart_items)} items for user {user_id}")
         
-        # Perform comprehensive AI analysis
-        analysis = cart_ai.analyze_cart(cart_items, user_id)
+        # Perform comprehensive AI analysis (components run concurrently within budget_ms)
+        analysis = cart_ai.analyze_cart(cart_items, user_id, budget_ms=budget_ms)
         
         return jsonify({
             'success': True,
@@ -85,8 +93,8 @@ def calculate_smart_pricing():
         cart_items = data['cart_items']
         user_id = data.get('user_id')
         
-        # Calculate dynamic pricing
-        pricing = cart_ai.calculate_dynamic_pricing(cart_items, user_id)
+        # Calculate dynamic pricing (reused from a live quote for the same cart)
+        pricing = cart_ai.quote_dynamic_pricing(cart_items, user_id)
         
         return jsonify({
             'success': True,
@@ -98,6 +106,7 @@ def calculate_smart_pricing():
         return jsonify({'error': 'Failed to calculate pricing', 'details': str(e)}), 500
 
 @checkout_bp.route('/smart-behaviors', methods=['POST'])
+@cached_response('smart_behaviors', ttl=INVENTORY_CACHE_TTL)
 def get_smart_behaviors():
     """
     Get smart cart behaviors and alerts
@@ -160,10 +169,26 @@ def create_checkout_session():
         products = data['products']
         user_id = data.get('user_id')
         cart_items = data.get('cart_items', [])
+        quote_id = data.get('quote_id')
         
-        # Calculate AI-enhanced pricing
+        # Charge the quoted price if the client was shown one, otherwise price (or reuse a live quote)
         if cart_items:
-            pricing = cart_ai.calculate_dynamic_pricing(cart_items, user_id)
+            if quote_id:
+                try:
+                    pricing = redeem_quote(quote_id, cart_items, user_id)
+                except InvalidQuote as e:
+                    # Expired, or issued by another worker: price again, and only ask the
+                    # shopper to confirm if the total they were shown has changed
+                    pricing = cart_ai.quote_dynamic_pricing(cart_items, user_id)
+                    if to_cents(pricing['final_total']) != quoted_final_total(quote_id):
+                        return jsonify({
+                            'error': 'Your total has changed. Please review it and place your order again.',
+                            'details': str(e),
+                            'repriced': True,
+                            'pricing': pricing
+                        }), 409
+            else:
+                pricing = cart_ai.quote_dynamic_pricing(cart_items, user_id)
             final_total = pricing['final_total']
             
             # Record the discounts applied
@@ -175,7 +200,9 @@ def create_checkout_session():
         return jsonify({
             'id': fake_session_id,
             'ai_pricing_applied': bool(cart_items),
-            'total_savings': pricing.get('savings', 0) if cart_items else 0
+            'total_savings': pricing.get('savings', 0) if cart_items else 0,
+            'final_total': pricing['final_total'] if cart_items else None,
+            'quote_id': pricing.get('quote_id') if cart_items else None
         })
         
     except Exception as e:
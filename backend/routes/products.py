@@ -1,75 +1,56 @@
 from flask import Blueprint, request, jsonify
 from database.models import db, Product
 from sqlalchemy import desc, func, or_, and_, case, text
+from services.search_index import fts_available, build_match_expression, fts_rank_subquery, fts_suggestions
+from services.autocomplete import get_autocomplete_index
+from services.neighbors import get_neighbor_ids
+from services.db_service import get_products_by_ids
+from services.popularity import get_trending, TRENDING_WINDOWS, POPULARITY_FLUSH_SECONDS
+from services.facets import get_facet_index
+from services.query_understanding import understand_query, analyze_query
+from services.hybrid_search import hybrid_search, HYBRID_BUDGET_MS
+from services.response_cache import cached_response
+from utils.pagination import KeysetPage, Page, SortedListPage, InvalidCursor, encode_cursor, decode_cursor, page_response
 import traceback
-import re
+import time
 
 products_bp = Blueprint('products', __name__)
 
+# Orderings applied to the fused candidates when hybrid search is not sorted by relevance;
+# each key ends on the product ID so a cursor names exactly one position
+HYBRID_SORTS = {
+    'price_low': lambda product: (product.price, product.id),
+    'price_high': lambda product: (-product.price, -product.id),
+    'newest': lambda product: (-product.id,),
+    'name': lambda product: (product.name, product.price, product.id)
+}
+
 def clean_search_query(query):
     """Clean and preprocess search query from voice or text input"""
     if not query:
         return ""
     
-    # Remove extra punctuation and normalize
-    cleaned = re.sub(r'[^\w\s-]', '', query.strip())  # Remove punctuation except hyphens
-    cleaned = re.sub(r'\s+', ' ', cleaned)  # Normalize whitespace
-    cleaned = cleaned.lower().strip()
-    
-    # Handle common voice recognition issues
-    voice_corrections = {
-        'tshirts': 't-shirts',
-        'tshirt': 't-shirt',
-        'jense': 'jeans',
-        'red tshirts': 'red t-shirts',
-        'blue jense': 'blue jeans'
-    }
-    
-    for incorrect, correct in voice_corrections.items():
-        cleaned = cleaned.replace(incorrect, correct)
+    cleaned, _ = understand_query(query)
     
     print(f"Query cleaned: '{query}' -> '{cleaned}'")
     return cleaned
 
 def detect_clothing_search(query):
     """Detect if the search query is for clothing items"""
-    clothing_keywords = [
-        'shirt', 't-shirt', 'tshirt', 'top', 'blouse', 'sweater', 'hoodie',
-        'dress', 'skirt', 'pants', 'jeans', 'trousers', 'shorts',
-        'jacket', 'coat', 'blazer', 'vest', 'cardigan',
-        'underwear', 'bra', 'socks', 'clothing', 'apparel', 'fashion',
-        'outfit', 'wear', 'garment'
-    ]
-    
-    color_keywords = [
-        'red', 'blue', 'green', 'yellow', 'black', 'white', 'pink',
-        'purple', 'orange', 'brown', 'gray', 'grey', 'navy', 'maroon'
-    ]
-    
-    query_lower = query.lower()
-    
-    # Check for clothing keywords
-    has_clothing = any(keyword in query_lower for keyword in clothing_keywords)
-    
-    # Check for color + clothing combination
-    has_color = any(color in query_lower for color in color_keywords)
-    
-    return has_clothing or (has_color and any(term in query_lower for term in ['shirt', 'dress', 'pants', 'top']))
+    return analyze_query(query).is_clothing_search
 
 def extract_search_components(query):
-    """Extract colors, clothing types, and other components from search query"""
-    colors = ['red', 'blue', 'green', 'yellow', 'black', 'white', 'pink', 'purple', 'orange', 'brown', 'gray', 'grey', 'navy', 'maroon', 'beige', 'cream']
-    clothing_types = ['shirt', 't-shirt', 'tshirt', 'top', 'blouse', 'dress', 'pants', 'jeans', 'jacket', 'hoodie', 'sweater', 'shorts']
-    
-    query_lower = query.lower()
-    
-    found_colors = [color for color in colors if color in query_lower]
-    found_clothing = [item for item in clothing_types if item in query_lower or item.replace('-', '') in query_lower]
+    """Extract colors, clothing types, gender and price hints from search query"""
+    analysis = analyze_query(query)
     
     return {
-        'colors': found_colors,
-        'clothing_types': found_clothing,
-        'is_multi_item': 'and' in query_lower or 'with' in query_lower,
+        'colors': list(analysis.colors),
+        'clothing_types': list(analysis.clothing_types),
+        'gender': analysis.gender,
+        'min_price': analysis.min_price,
+        'max_price': analysis.max_price,
+        'search_text': analysis.text,
+        'is_multi_item': analysis.is_multi_item,
         'original_query': query
     }
 
@@ -145,12 +126,142 @@ def build_enhanced_relevance_score(query, search_components):
     
     return case(*conditions, else_=999) if conditions else text('999')
 
+def apply_like_text_filter(search_query, query, search_components):
+    """Fallback text matching with LIKE chains when the FTS index is unavailable"""
+    if search_components['is_multi_item']:
+        print("Processing multi-item search with enhanced logic")
+        # For "red t-shirt with jeans" - comprehensive search
+        multi_item_conditions = []
+        
+        # EXACT COLOR+CLOTHING COMBINATIONS (highest priority)
+        for color in search_components['colors']:
+            for clothing_type in search_components['clothing_types']:
+                if clothing_type in ['t-shirt', 'tshirt']:
+                    multi_item_conditions.append(
+                        and_(
+                            Product.name.ilike(f'%{color}%'),
+                            or_(
+                                Product.name.ilike('%t-shirt%'),
+                                Product.name.ilike('%tshirt%')
+                            )
+                        )
+                    )
+                else:
+                    multi_item_conditions.append(
+                        and_(
+                            Product.name.ilike(f'%{color}%'),
+                            Product.name.ilike(f'%{clothing_type}%')
+                        )
+                    )
+        
+        # INDIVIDUAL CLOTHING ITEMS (for complete outfit)
+        for clothing_type in search_components['clothing_types']:
+            if clothing_type in ['t-shirt', 'tshirt']:
+                multi_item_conditions.append(
+                    or_(
+                        Product.name.ilike('%t-shirt%'),
+                        Product.name.ilike('%tshirt%')
+                    )
+                )
+            else:
+                multi_item_conditions.append(Product.name.ilike(f'%{clothing_type}%'))
+        
+        # COLORS WITH CLOTHING CONTEXT
+        for color in search_components['colors']:
+            multi_item_conditions.append(
+                and_(
+                    Product.name.ilike(f'%{color}%'),
+                    or_(
+                        Product.category.ilike('%clothing%'),
+                        Product.name.ilike('%shirt%'),
+                        Product.name.ilike('%top%'),
+                        Product.name.ilike('%pants%'),
+                        Product.name.ilike('%jeans%')
+                    )
+                )
+            )
+        
+        if multi_item_conditions:
+            search_query = search_query.filter(or_(*multi_item_conditions))
+            print(f"Applied {len(multi_item_conditions)} multi-item conditions")
+    else:
+        # Single item search
+        search_terms = [term.strip() for term in query.split() if term.strip()]
+        search_conditions = []
+        
+        for term in search_terms:
+            if term.lower() in ['and', 'with', 'or', 'the', 'a', 'an', 'some']:
+                continue
+            
+            term_conditions = or_(
+                Product.name.ilike(f'%{term}%'),
+                Product.description.ilike(f'%{term}%'),
+                Product.category.ilike(f'%{term}%')
+            )
+            search_conditions.append(term_conditions)
+        
+        if search_conditions:
+            search_query = search_query.filter(and_(*search_conditions))
+    
+    return search_query
+
+def describe_search_result(product, query, search_components):
+    """Product dict with the relevance_info explaining why it matched"""
+    product_dict = product.to_dict()
+    
+    # Enhanced relevance calculation
+    name_match = query.lower() in product_dict.get('name', '').lower()
+    is_clothing = any(term in product_dict.get('category', '').lower() for term in ['clothing', 'fashion', 'apparel'])
+    
+    color_matches = [color for color in search_components['colors'] 
+                   if color in product_dict.get('name', '').lower()]
+    
+    clothing_matches = [item for item in search_components['clothing_types'] 
+                      if item in product_dict.get('name', '').lower() or 
+                         item.replace('-', '') in product_dict.get('name', '').lower()]
+    
+    # Enhanced relevance scoring
+    relevance_score = 0
+    product_name_lower = product_dict.get('name', '').lower()
+    
+    # Boost for exact color+clothing combinations
+    for color in search_components['colors']:
+        for clothing_type in search_components['clothing_types']:
+            if color in product_name_lower and clothing_type.replace('-', '') in product_name_lower:
+                relevance_score += 50  # High boost for exact combinations
+    
+    # Individual component matches
+    if name_match: relevance_score += 30
+    relevance_score += len(color_matches) * 15
+    relevance_score += len(clothing_matches) * 20
+    
+    # Special boost for red t-shirts when searching "red t-shirt with jeans"
+    if 'red' in search_components['colors'] and any(t in search_components['clothing_types'] for t in ['t-shirt', 'tshirt']):
+        if 'red' in product_name_lower and ('t-shirt' in product_name_lower or 'tshirt' in product_name_lower):
+            relevance_score += 100  # Massive boost for perfect matches
+    
+    product_dict['relevance_info'] = {
+        'name_match': name_match,
+        'is_clothing': is_clothing,
+        'color_matches': color_matches,
+        'clothing_matches': clothing_matches,
+        'search_components': search_components,
+        'relevance_score': relevance_score,
+        'is_exact_match': relevance_score >= 50,
+        'is_perfect_match': relevance_score >= 100,
+        'cleaned_query': query
+    }
+    
+    return product_dict
+
 @products_bp.route('/search', methods=['GET'])
 def search_products():
     """FIXED: Enhanced search with proper multi-item prioritization"""
     try:
         raw_query = request.args.get('q', '').strip()
-        limit = request.args.get('limit', 50, type=int)
+        limit = max(1, request.args.get('limit', 50, type=int))
+        cursor = request.args.get('cursor')
+        stream = request.args.get('stream', 'false').lower() == 'true'
         category = request.args.get('category', None)
         color = request.args.get('color', None)
         min_price = request.args.get('min_price', type=float)
@@ -158,9 +269,17 @@ def search_products():
         clothing_only = request.args.get('clothing_only', 'false').lower() == 'true'
         exclude_electronics = request.args.get('exclude_electronics', 'false').lower() == 'true'
         sort_by = request.args.get('sort_by', 'relevance')
+        mode = request.args.get('mode', 'lexical')
+        budget_ms = request.args.get('budget_ms', HYBRID_BUDGET_MS, type=int)
+        debug = request.args.get('debug', '0').lower() in ('1', 'true')
         
         if not raw_query:
             return jsonify({'error': 'Search query is required'}), 400
+        if mode not in ('lexical', 'hybrid'):
+            return jsonify({'error': f"Unknown mode '{mode}'", 'modes': ['lexical', 'hybrid']}), 400
+        
+        request_start = time.perf_counter()
+        timings = {}
         
         # Clean the query for consistent processing
         query = clean_search_query(raw_query)
@@ -172,6 +291,15 @@ def search_products():
         is_clothing_search = detect_clothing_search(query)
         
         print(f"Search components: {search_components}")
+        timings['analysis_ms'] = round((time.perf_counter() - request_start) * 1000, 2)
+        
+        # Price phrases in the query ("shirts under 50") act as filters unless
+        # given explicitly, and are left out of the text that has to match
+        if min_price is None:
+            min_price = search_components['min_price']
+        if max_price is None:
+            max_price = search_components['max_price']
+        text_query = search_components['search_text'] or query
         
         # Build base query
         search_query = Product.query
@@ -209,82 +337,6 @@ def search_products():
             if exclusion_conditions:
                 search_query = search_query.filter(and_(*exclusion_conditions))
         
-        # FIXED: Enhanced text search logic
-        if search_components['is_multi_item']:
-            print("Processing multi-item search with enhanced logic")
-            # For "red t-shirt with jeans" - comprehensive search
-            multi_item_conditions = []
-            
-            # EXACT COLOR+CLOTHING COMBINATIONS (highest priority)
-            for color in search_components['colors']:
-                for clothing_type in search_components['clothing_types']:
-                    if clothing_type in ['t-shirt', 'tshirt']:
-                        multi_item_conditions.append(
-                            and_(
-                                Product.name.ilike(f'%{color}%'),
-                                or_(
-                                    Product.name.ilike('%t-shirt%'),
-                                    Product.name.ilike('%tshirt%')
-                                )
-                            )
-                        )
-                    else:
-                        multi_item_conditions.append(
-                            and_(
-                                Product.name.ilike(f'%{color}%'),
-                                Product.name.ilike(f'%{clothing_type}%')
-                            )
-                        )
-            
-            # INDIVIDUAL CLOTHING ITEMS (for complete outfit)
-            for clothing_type in search_components['clothing_types']:
-                if clothing_type in ['t-shirt', 'tshirt']:
-                    multi_item_conditions.append(
-                        or_(
-                            Product.name.ilike('%t-shirt%'),
-                            Product.name.ilike('%tshirt%')
-                        )
-                    )
-                else:
-                    multi_item_conditions.append(Product.name.ilike(f'%{clothing_type}%'))
-            
-            # COLORS WITH CLOTHING CONTEXT
-            for color in search_components['colors']:
-                multi_item_conditions.append(
-                    and_(
-                        Product.name.ilike(f'%{color}%'),
-                        or_(
-                            Product.category.ilike('%clothing%'),
-                            Product.name.ilike('%shirt%'),
-                            Product.name.ilike('%top%'),
-                            Product.name.ilike('%pants%'),
-                            Product.name.ilike('%jeans%')
-                        )
-                    )
-                )
-            
-            if multi_item_conditions:
-                search_query = search_query.filter(or_(*multi_item_conditions))
-                print(f"Applied {len(multi_item_conditions)} multi-item conditions")
-        else:
-            # Single item search
-            search_terms = [term.strip() for term in query.split() if term.strip()]
-            search_conditions = []
-            
-            for term in search_terms:
-                if term.lower() in ['and', 'with', 'or', 'the', 'a', 'an', 'some']:
-                    continue
-                
-                term_conditions = or_(
-                    Product.name.ilike(f'%{term}%'),
-                    Product.description.ilike(f'%{term}%'),
-                    Product.category.ilike(f'%{term}%')
-                )
-                search_conditions.append(term_conditions)
-            
-            if search_conditions:
-                search_query = search_query.filter(and_(*search_conditions))
-        
         # Exclude irrelevant items for specific searches
         if any(term in query for term in ['t-shirt', 'tshirt', 'shirt']):
             irrelevant_items = ['brief', 'boxer', 'underwear', 'bra', 'panty', 'robe', 'nightwear', 'sleepwear', 'kurta', 'saree', 'camisole']
@@ -292,93 +344,66 @@ def search_products():
             if exclusion_conditions:
                 search_query = search_query.filter(and_(*exclusion_conditions))
         
-        # FIXED: Build order clauses based on sort_by
-        order_clauses = []
-        
-        if sort_by == 'relevance':
-            # Use enhanced relevance scoring
-            relevance_case = build_enhanced_relevance_score(query, search_components)
-            order_clauses.append(relevance_case)
-        elif sort_by == 'price_low':
-            order_clauses.append(Product.price.asc())
-        elif sort_by == 'price_high':
-            order_clauses.append(Product.price.desc())
-        elif sort_by == 'newest':
-            order_clauses.append(Product.id.desc())
-        elif sort_by == 'name':
-            order_clauses.append(Product.name.asc())
-        else:
-            # Default to relevance
-            relevance_case = build_enhanced_relevance_score(query, search_components)
-            order_clauses.append(relevance_case)
-        
-        # Secondary sorts for consistency
-        if sort_by == 'relevance':
-            order_clauses.append(Product.price.asc())  # Then by price
-            order_clauses.append(Product.id.desc())    # Then by newest
-        elif sort_by not in ['price_low', 'price_high']:
-            order_clauses.append(Product.price.asc())
-        
-        # Execute query
-        products = search_query.order_by(*order_clauses).limit(limit).all()
-        
-        print(f"Found {len(products)} products. First 5 product names:")
-        for i, product in enumerate(products[:5]):
-            print(f"  {i+1}. {product.name} - ${product.price}")
-        
-        # Enhanced product processing
-        result_products = []
-        for product in products:
-            product_dict = product.to_dict()
-            
-            # Enhanced relevance calculation
-            name_match = query.lower() in product_dict.get('name', '').lower()
-            is_clothing = any(term in product_dict.get('category', '').lower() for term in ['clothing', 'fashion', 'apparel'])
-            
-            color_matches = [color for color in search_components['colors'] 
-                           if color in product_dict.get('name', '').lower()]
-            
-            clothing_matches = [item for item in search_components['clothing_types'] 
-                              if item in product_dict.get('name', '').lower() or 
-                                 item.replace('-', '') in product_dict.get('name', '').lower()]
+        hybrid_info = {}
+        if mode == 'hybrid':
+            # Fused FTS + CLIP candidates, then the filters above on just those rows
+            hybrid = hybrid_search(text_query, budget_ms=budget_ms)
+            ranking = 'hybrid'
+            hybrid_info = {product_id: {'rrf_score': round(score, 5), 'ranks': ranks} for product_id, score, ranks in hybrid['results']}
             
-            # Enhanced relevance scoring
-            relevance_score = 0
-            product_name_lower = product_dict.get('name', '').lower()
+            hydrate_start = time.perf_counter()
+            candidates = search_query.filter(Product.id.in_(list(hybrid_info))).all() if hybrid_info else []
+            hybrid['timings']['hydrate_ms'] = round((time.perf_counter() - hydrate_start) * 1000, 2)
             
-            # Boost for exact color+clothing combinations
-            for color in search_components['colors']:
-                for clothing_type in search_components['clothing_types']:
-                    if color in product_name_lower and clothing_type.replace('-', '') in product_name_lower:
-                        relevance_score += 50  # High boost for exact combinations
-            
-            # Individual component matches
-            if name_match: relevance_score += 30
-            relevance_score += len(color_matches) * 15
-            relevance_score += len(clothing_matches) * 20
-            
-            # Special boost for red t-shirts when searching "red t-shirt with jeans"
-            if 'red' in search_components['colors'] and any(t in search_components['clothing_types'] for t in ['t-shirt', 'tshirt']):
-                if 'red' in product_name_lower and ('t-shirt' in product_name_lower or 'tshirt' in product_name_lower):
-                    relevance_score += 100  # Massive boost for perfect matches
+            if sort_by in HYBRID_SORTS:
+                sort_key = HYBRID_SORTS[sort_by]
+            else:
+                sort_key = lambda product: (-hybrid_info[product.id]['rrf_score'], product.id)
+            page = SortedListPage(candidates, sort_key, f"search:{sort_by}:hybrid:{query}", cursor=cursor, limit=limit)
+        else:
+            # Full-text matching through the FTS5 index (BM25 ranked); the LIKE
+            # chains are only used when this SQLite build has no FTS5
+            fts_rank = None
+            match_expression = build_match_expression(text_query, search_components) if fts_available() else None
+            if match_expression:
+                fts_match = fts_rank_subquery(match_expression)
+                search_query = search_query.join(fts_match, Product.id == fts_match.c.product_id)
+                fts_rank = fts_match.c.rank
+                print(f"FTS match expression: {match_expression}")
+            else:
+                search_query = apply_like_text_filter(search_query, text_query, search_components)
             
-            product_dict['relevance_info'] = {
-                'name_match': name_match,
-                'is_clothing': is_clothing,
-                'color_matches': color_matches,
-                'clothing_matches': clothing_matches,
-                'search_components': search_components,
-                'relevance_score': relevance_score,
-                'is_exact_match': relevance_score >= 50,
-                'is_perfect_match': relevance_score >= 100,
-                'cleaned_query': query
-            }
+            # FIXED: Sort keys based on sort_by; each order ends on the primary key
+            # so a cursor names exactly one position in it
+            if sort_by not in ('price_low', 'price_high', 'newest', 'name'):
+                # Default to relevance: BM25 rank from the FTS index, hand-built
+                # CASE score for the LIKE fallback, then by price, then by newest
+                if fts_rank is not None:
+                    relevance = fts_rank
+                else:
+                    relevance = build_enhanced_relevance_score(text_query, search_components)
+                sort_keys = [(relevance, 'asc'), (Product.price, 'asc'), (Product.id, 'desc')]
+            elif sort_by == 'price_low':
+                sort_keys = [(Product.price, 'asc'), (Product.id, 'asc')]
+            elif sort_by == 'price_high':
+                sort_keys = [(Product.price, 'desc'), (Product.id, 'desc')]
+            elif sort_by == 'newest':
+                sort_keys = [(Product.id, 'desc')]
+            else:
+                sort_keys = [(Product.name, 'asc'), (Product.price, 'asc'), (Product.id, 'asc')]
             
-            result_products.append(product_dict)
-        
-        return jsonify({
-            'products': result_products,
-            'total': len(result_products),
+            # Relevance values are only comparable within one query and ranking
+            ranking = 'bm25' if fts_rank is not None else 'like'
+            page = KeysetPage(search_query, sort_keys, f"search:{sort_by}:{ranking}:{query}", cursor=cursor, limit=limit)
+        
+        if debug:
+            # Run the page query now so its cost shows up in the timings
+            query_start = time.perf_counter()
+            items = list(page)
+            page = Page(items, page.next_cursor)
+            timings['query_ms'] = round((time.perf_counter() - query_start) * 1000, 2)
+        
+        payload = {
             'query': query,
             'original_query': raw_query,
             'limit': limit,
@@ -388,7 +413,8 @@ def search_products():
                 'components': search_components,
                 'auto_filtered_clothing': (is_clothing_search or clothing_only) and not category,
                 'excluded_electronics': is_clothing_search or exclude_electronics,
-                'query_cleaned': query != raw_query
+                'query_cleaned': query != raw_query,
+                'ranking': ranking
             },
             'filters': {
                 'category': category,
@@ -398,17 +424,33 @@ def search_products():
                 'clothing_only': clothing_only,
                 'exclude_electronics': exclude_electronics
             }
-        })
+        }
+        if mode == 'hybrid':
+            payload['search_analysis']['degraded'] = hybrid['degraded']
+            timings.update(hybrid['timings'])
+        if debug:
+            timings['total_ms'] = round((time.perf_counter() - request_start) * 1000, 2)
+            payload['timings'] = timings
+        
+        def serialize(product):
+            product_dict = describe_search_result(product, text_query, search_components)
+            if product.id in hybrid_info:
+                product_dict['relevance_info']['hybrid'] = hybrid_info[product.id]
+            return product_dict
+        
+        return page_response(page, payload, serialize, stream=stream)
+        
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
         
     except Exception as e:
         print(f"Error in enhanced search: {e}")
         traceback.print_exc()
         return jsonify({'error': 'Failed to search products', 'details': str(e)}), 500
 
-# Keep suggestions route the same but with cleaning
 @products_bp.route('/suggestions', methods=['GET'])
 def get_search_suggestions():
-    """Enhanced search suggestions with text cleaning"""
+    """Autocomplete suggestions from the in-memory index, with FTS/LIKE fallback"""
     try:
         raw_query = request.args.get('q', '').strip()
         limit = request.args.get('limit', 10, type=int)
@@ -419,56 +461,154 @@ def get_search_suggestions():
         query = clean_search_query(raw_query)
         is_clothing_search = detect_clothing_search(query)
         
-        # Build base query for suggestions
-        suggestion_query = Product.query
+        clothing_categories = ['clothing', 'fashion', 'apparel', 'mens', 'womens'] if is_clothing_search else None
         
-        if is_clothing_search:
-            clothing_categories = ['clothing', 'fashion', 'apparel', 'mens', 'womens']
-            clothing_conditions = [Product.category.ilike(f'%{cat}%') for cat in clothing_categories]
-            suggestion_query = suggestion_query.filter(or_(*clothing_conditions))
-        
-        # Get suggestions
-        name_suggestions = suggestion_query.filter(
-            Product.name.ilike(f'%{query}%')
-        ).with_entities(Product.name).distinct().limit(limit // 2).all()
-        
-        category_suggestions = db.session.query(Product.category).filter(
-            Product.category.ilike(f'%{query}%')
-        ).distinct().limit(limit // 2).all()
+        try:
+            index = get_autocomplete_index()
+            completions = index.complete(query, limit // 2, ('product',), clothing_categories)
+            completions += index.complete(query, limit - len(completions), ('category', 'subcategory'))
+            source = 'autocomplete'
+        except Exception as e:
+            print(f"Autocomplete index unavailable, falling back to database: {e}")
+            completions = get_database_suggestions(query, limit, clothing_categories)
+            source = 'database'
         
         suggestions = []
+        seen = set()
         
-        for (name,) in name_suggestions:
-            if name and name not in [s['text'] for s in suggestions]:
+        for completion in completions:
+            if completion['text'] in seen:
+                continue
+            seen.add(completion['text'])
+            
+            if completion['type'] == 'product':
                 suggestions.append({
-                    'text': name,
+                    'text': completion['text'],
                     'type': 'product',
                     'category': 'Product',
                     'is_clothing': is_clothing_search
                 })
-        
-        for (category,) in category_suggestions:
-            if category and category not in [s['text'] for s in suggestions]:
+            else:
                 suggestions.append({
-                    'text': category,
-                    'type': 'category', 
-                    'category': 'Category',
-                    'is_clothing': 'clothing' in category.lower()
+                    'text': completion['text'],
+                    'type': completion['type'],
+                    'category': completion['type'].capitalize(),
+                    'is_clothing': 'clothing' in completion['text'].lower()
                 })
         
         return jsonify({
             'suggestions': suggestions[:limit],
             'query': query,
             'original_query': raw_query,
-            'is_clothing_search': is_clothing_search
+            'is_clothing_search': is_clothing_search,
+            'source': source
         })
         
     except Exception as e:
         print(f"Error getting suggestions: {e}")
         return jsonify({'suggestions': []})
 
+def get_database_suggestions(query, limit, clothing_categories=None):
+    """Name and category suggestions straight from SQLite (FTS prefix match, else LIKE)"""
+    if fts_available():
+        name_suggestions = fts_suggestions(query, 'name', limit // 2, clothing_categories)
+        category_suggestions = fts_suggestions(query, 'category', limit // 2)
+    else:
+        suggestion_query = Product.query
+        
+        if clothing_categories:
+            clothing_conditions = [Product.category.ilike(f'%{cat}%') for cat in clothing_categories]
+            suggestion_query = suggestion_query.filter(or_(*clothing_conditions))
+        
+        name_suggestions = [name for (name,) in suggestion_query.filter(
+            Product.name.ilike(f'%{query}%')
+        ).with_entities(Product.name).distinct().limit(limit // 2).all()]
+        
+        category_suggestions = [category for (category,) in db.session.query(Product.category).filter(
+            Product.category.ilike(f'%{query}%')
+        ).distinct().limit(limit // 2).all()]
+    
+    return (
+        [{'text': name, 'type': 'product'} for name in name_suggestions if name] +
+        [{'text': category, 'type': 'category'} for category in category_suggestions if category]
+    )
+
 
 
+def build_filter_query(filters):
+    """SQL version of the /filter query (used when the facet index is unavailable)"""
+    category = filters.get('category')
+    min_price = filters.get('min_price')
+    max_price = filters.get('max_price')
+    color = filters.get('color')
+    style = filters.get('style')
+    brand = filters.get('brand')
+    exclude_electronics = filters.get('exclude_electronics')
+    clothing_only = filters.get('clothing_only')
+    
+    # Build query with filters
+    query = Product.query
+    
+    # Apply category filter OR clothing filter
+    if category:
+        query = query.filter(Product.category.ilike(f'%{category}%'))
+    elif clothing_only:
+        clothing_categories = ['clothing', 'fashion', 'apparel', 'mens', 'womens', 'kids']
+        clothing_conditions = [Product.category.ilike(f'%{cat}%') for cat in clothing_categories]
+        if clothing_conditions:
+            query = query.filter(or_(*clothing_conditions))
+    
+    # Exclude electronics if requested
+    if exclude_electronics or clothing_only:
+        electronics_keywords = ['electronics', 'phone', 'computer', 'laptop', 'tablet', 'gadget', 'device']
+        exclusion_conditions = []
+        for keyword in electronics_keywords:
+            exclusion_conditions.append(~Product.category.ilike(f'%{keyword}%'))
+            exclusion_conditions.append(~Product.name.ilike(f'%{keyword}%'))
+        if exclusion_conditions:
+            query = query.filter(and_(*exclusion_conditions))
+    
+    # Apply price filters
+    if min_price is not None:
+        query = query.filter(Product.price >= min_price)
+    
+    if max_price is not None:
+        query = query.filter(Product.price <= max_price)
+    
+    # Apply color filter
+    if color:
+        query = query.filter(or_(
+            Product.name.ilike(f'%{color}%'),
+            Product.description.ilike(f'%{color}%')
+        ))
+    
+    # Apply style filter
+    if style:
+        query = query.filter(or_(
+            Product.name.ilike(f'%{style}%'),
+            Product.description.ilike(f'%{style}%')
+        ))
+    
+    # Apply brand filter
+    if brand:
+        query = query.filter(Product.name.ilike(f'%{brand}%'))
+    
+    # Intelligent ordering, ending on the primary key so it is resumable by cursor
+    sort_keys = [(Product.price, 'asc'), (Product.id, 'asc')]
+    
+    # Prioritize clothing items if clothing_only is true
+    if clothing_only:
+        sort_keys.insert(0, (
+            case(
+                (Product.category.ilike('%clothing%'), 1),
+                (Product.category.ilike('%fashion%'), 2),
+                else_=3
+            ),
+            'asc'
+        ))
+    
+    return query, sort_keys
+
 @products_bp.route('/filter', methods=['GET'])
 def filter_products():
     """Enhanced product filtering with automatic clothing detection"""
@@ -482,77 +622,49 @@ def filter_products():
         brand = request.args.get('brand', None)
         exclude_electronics = request.args.get('exclude_electronics', 'false').lower() == 'true'
         clothing_only = request.args.get('clothing_only', 'false').lower() == 'true'
-        limit = request.args.get('limit', 20, type=int)
-        
-        print(f"Filtering products with: category={category}, price=${min_price}-${max_price}, color={color}, clothing_only={clothing_only}")
-        
-        # Build query with filters
-        query = Product.query
-        
-        # Apply category filter OR clothing filter
-        if category:
-            query = query.filter(Product.category.ilike(f'%{category}%'))
-        elif clothing_only:
-            clothing_categories = ['clothing', 'fashion', 'apparel', 'mens', 'womens', 'kids']
-            clothing_conditions = [Product.category.ilike(f'%{cat}%') for cat in clothing_categories]
-            if clothing_conditions:
-                query = query.filter(or_(*clothing_conditions))
+        limit = max(1, request.args.get('limit', 20, type=int))
+        cursor = request.args.get('cursor')
+        stream = request.args.get('stream', 'false').lower() == 'true'
         
-        # Exclude electronics if requested
-        if exclude_electronics or clothing_only:
-            electronics_keywords = ['electronics', 'phone', 'computer', 'laptop', 'tablet', 'gadget', 'device']
-            exclusion_conditions = []
-            for keyword in electronics_keywords:
-                exclusion_conditions.append(~Product.category.ilike(f'%{keyword}%'))
-                exclusion_conditions.append(~Product.name.ilike(f'%{keyword}%'))
-            if exclusion_conditions:
-                query = query.filter(and_(*exclusion_conditions))
-        
-        # Apply price filters
-        if min_price is not None:
-            query = query.filter(Product.price >= min_price)
-        
-        if max_price is not None:
-            query = query.filter(Product.price <= max_price)
+        include_facets = request.args.get('include_facets', 'false').lower() == 'true'
         
-        # Apply color filter
-        if color:
-            query = query.filter(or_(
-                Product.name.ilike(f'%{color}%'),
-                Product.description.ilike(f'%{color}%')
-            ))
-        
-        # Apply style filter
-        if style:
-            query = query.filter(or_(
-                Product.name.ilike(f'%{style}%'),
-                Product.description.ilike(f'%{style}%')
-            ))
+        print(f"Filtering products with: category={category}, price=${min_price}-${max_price}, color={color}, clothing_only={clothing_only}")
         
-        # Apply brand filter
-        if brand:
-            query = query.filter(Product.name.ilike(f'%{brand}%'))
+        filters = {
+            'category': category,
+            'min_price': min_price,
+            'max_price': max_price,
+            'color': color,
+            'style': style,
+            'brand': brand,
+            'exclude_electronics': exclude_electronics,
+            'clothing_only': clothing_only
+        }
+        facets = None
         
-        # Execute query with intelligent ordering
-        order_clauses = []
+        # Both paths share one sort order, so a cursor from either resumes the other
+        sort_name = 'filter:clothing' if clothing_only else 'filter'
+        after = decode_cursor(cursor, sort_name, 3 if clothing_only else 2) if cursor else None
         
-        # Prioritize clothing items if clothing_only is true
-        if clothing_only:
-            order_clauses.append(
-                case(
-                    (Product.category.ilike('%clothing%'), 1),
-                    (Product.category.ilike('%fashion%'), 2),
-                    else_=3
-                )
+        try:
+            # Masks over the cached catalog arrays, then one IN query for the page
+            index = get_facet_index()
+            product_ids, total_matches, next_after = index.filter_ids(filters, limit, after)
+            page = Page(
+                get_products_by_ids(product_ids),
+                encode_cursor(sort_name, next_after) if next_after is not None else None
             )
-        
-        order_clauses.append(Product.price.asc())
-        
-        products = query.order_by(*order_clauses).limit(limit).all()
-        
-        return jsonify({
-            'products': [product.to_dict() for product in products],
-            'total': len(products),
+            if include_facets:
+                facets = index.facet_counts(filters)
+        except Exception as e:
+            print(f"Facet index unavailable, filtering in SQL: {e}")
+            query, sort_keys = build_filter_query(filters)
+            page = KeysetPage(query, sort_keys, sort_name, cursor=cursor, limit=limit)
+            total_matches = None
+        
+        return page_response(page, {
+            'total_matches': total_matches,
+            'facets': facets,
             'filters_applied': {
                 'category': category,
                 'min_price': min_price,
@@ -563,7 +675,10 @@ def filter_products():
                 'exclude_electronics': exclude_electronics,
                 'clothing_only': clothing_only
             }
-        })
+        }, lambda product: product.to_dict(), stream=stream)
+        
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
         
     except Exception as e:
         print(f"Error in filter_products: {e}")
@@ -574,7 +689,9 @@ def filter_products():
 def get_latest_products():
     """Get latest products with optional filtering"""
     try:
-        limit = request.args.get('limit', 12, type=int)
+        limit = max(1, request.args.get('limit', 12, type=int))
+        cursor = request.args.get('cursor')
+        stream = request.args.get('stream', 'false').lower() == 'true'
         category = request.args.get('category', None)
         max_price = request.args.get('max_price', type=float)
         clothing_only = request.args.get('clothing_only', 'false').lower() == 'true'
@@ -594,17 +711,18 @@ def get_latest_products():
         if max_price is not None:
             query = query.filter(Product.price <= max_price)
         
-        # Order by ID descending (latest first) and apply limit
-        products = query.order_by(desc(Product.id)).limit(limit).all()
+        # Order by ID descending (latest first), one page after the cursor
+        page = KeysetPage(query, [(Product.id, 'desc')], 'latest', cursor=cursor, limit=limit)
         
-        return jsonify({
-            'products': [product.to_dict() for product in products],
-            'total': len(products),
+        return page_response(page, {
             'limit': limit,
             'category': category,
             'max_price': max_price,
             'clothing_only': clothing_only
-        })
+        }, lambda product: product.to_dict(), stream=stream)
+        
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
         
     except Exception as e:
         print(f"Error in get_latest_products: {e}")
@@ -612,25 +730,33 @@ def get_latest_products():
         return jsonify({'error': 'Failed to fetch latest products', 'details': str(e)}), 500
 
 @products_bp.route('/categories', methods=['GET'])
+@cached_response('categories')
 def get_categories():
     """Get all unique product categories with enhanced filtering"""
     try:
         exclude_electronics = request.args.get('exclude_electronics', 'false').lower() == 'true'
         
-        # Build base query
-        categories_query = db.session.query(
-            Product.category,
-            func.count(Product.id).label('count')
-        ).group_by(Product.category)
-        
-        # Exclude electronics if requested
-        if exclude_electronics:
-            electronics_keywords = ['electronics', 'phone', 'computer', 'laptop', 'tablet']
-            exclusion_conditions = [~Product.category.ilike(f'%{keyword}%') for keyword in electronics_keywords]
-            if exclusion_conditions:
-                categories_query = categories_query.filter(and_(*exclusion_conditions))
-        
-        categories_with_counts = categories_query.all()
+        try:
+            index = get_facet_index()
+            mask = ~index.category_contains(['electronics', 'phone', 'computer', 'laptop', 'tablet']) if exclude_electronics else None
+            categories_with_counts = [(facet['value'], facet['count']) for facet in index.counts('category', mask)]
+        except Exception as e:
+            print(f"Facet index unavailable, counting categories in SQL: {e}")
+            
+            # Build base query
+            categories_query = db.session.query(
+                Product.category,
+                func.count(Product.id).label('count')
+            ).group_by(Product.category)
+            
+            # Exclude electronics if requested
+            if exclude_electronics:
+                electronics_keywords = ['electronics', 'phone', 'computer', 'laptop', 'tablet']
+                exclusion_conditions = [~Product.category.ilike(f'%{keyword}%') for keyword in electronics_keywords]
+                if exclusion_conditions:
+                    categories_query = categories_query.filter(and_(*exclusion_conditions))
+            
+            categories_with_counts = categories_query.all()
         
         category_list = []
         for category, count in categories_with_counts:
@@ -654,7 +780,42 @@ def get_categories():
     except Exception as e:
         print(f"Error in get_categories: {e}")
         return jsonify({'error': 'Failed to fetch categories', 'details': str(e)}), 500
+
+@products_bp.route('/facets', methods=['GET'])
+def get_facets():
+    """Category, subcategory, gender, color and price-range counts conditioned on the given filters"""
+    try:
+        filters = {
+            'category': request.args.get('category', None),
+            'subcategory': request.args.get('subcategory', None),
+            'gender': request.args.get('gender', None),
+            'price_range': request.args.get('price_range', None),
+            'min_price': request.args.get('min_price', type=float),
+            'max_price': request.args.get('max_price', type=float),
+            'color': request.args.get('color', None),
+            'style': request.args.get('style', None),
+            'brand': request.args.get('brand', None),
+            'exclude_electronics': request.args.get('exclude_electronics', 'false').lower() == 'true',
+            'clothing_only': request.args.get('clothing_only', 'false').lower() == 'true'
+        }
+        
+        index = get_facet_index()
+        masks = index.filter_masks(filters)
+        
+        return jsonify({
+            'facets': index.facet_counts(filters),
+            'total_matches': int(index.combine(masks, len(index)).sum()),
+            'filters_applied': filters,
+            'catalog_version': index.catalog_version
+        })
+        
+    except Exception as e:
+        print(f"Error in get_facets: {e}")
+        traceback.print_exc()
+        return jsonify({'error': 'Failed to compute facets', 'details': str(e)}), 500
+
 @products_bp.route('/related/<product_id>', methods=['GET'])
+@cached_response('related')
 def get_related_products(product_id):
     """Get related products based on category and other factors"""
     try:
@@ -667,16 +828,22 @@ def get_related_products(product_id):
         
         print(f"Finding related products for: {current_product.name} (Category: {current_product.category})")
         
-        # Build related products query
-        related_query = Product.query.filter(Product.id != product_id)
+        # Strategy 0: Precomputed visual neighbours (single array lookup)
+        category_products = get_products_by_ids(get_neighbor_ids(product_id, limit))
+        strategy = 'visual_neighbors' if category_products else 'category'
+        print(f"Found {len(category_products)} precomputed visual neighbours")
+        
+        # Build related products query for the fallback strategies
+        exclude_ids = [product_id] + [product.id for product in category_products]
+        related_query = Product.query.filter(~Product.id.in_(exclude_ids))
         
         # Strategy 1: Same category first
-        category_products = []
-        if current_product.category:
-            category_products = related_query.filter(
+        if len(category_products) < limit and current_product.category:
+            same_category = related_query.filter(
                 Product.category.ilike(f'%{current_product.category}%')
-            ).limit(limit).all()
-            print(f"Found {len(category_products)} products in same category")
+            ).limit(limit - len(category_products)).all()
+            category_products.extend(same_category)
+            print(f"Found {len(same_category)} products in same category")
         
         # Strategy 2: If not enough, get products with similar keywords
         if len(category_products) < limit:
@@ -724,7 +891,8 @@ def get_related_products(product_id):
         return jsonify({
             'products': result_products,
             'total': len(result_products),
-            'current_product': current_product.to_dict()
+            'current_product': current_product.to_dict(),
+            'strategy': strategy
         })
         
     except Exception as e:
@@ -736,7 +904,9 @@ def get_related_products(product_id):
 def get_products_by_category(category_name):
     """Get products by category for related products"""
     try:
-        limit = request.args.get('limit', 12, type=int)
+        limit = max(1, request.args.get('limit', 12, type=int))
+        cursor = request.args.get('cursor')
+        stream = request.args.get('stream', 'false').lower() == 'true'
         exclude_id = request.args.get('exclude_id', None)
         
         print(f"Getting products for category: {category_name}")
@@ -758,58 +928,66 @@ def get_products_by_category(category_name):
         clothing_conditions = [Product.category.ilike(f'%{cat}%') for cat in clothing_categories]
         query = query.filter(or_(*clothing_conditions))
         
-        products = query.limit(limit).all()
+        page = KeysetPage(query, [(Product.id, 'asc')], f"category:{category_name}", cursor=cursor, limit=limit)
         
-        print(f"Found {len(products)} products for category {category_name}")
+        return page_response(page, {'category': category_name}, lambda product: product.to_dict(), stream=stream)
         
-        return jsonify({
-            'products': [product.to_dict() for product in products],
-            'total': len(products),
-            'category': category_name
-        })
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
         
     except Exception as e:
         print(f"Error getting products by category: {e}")
         return jsonify({'error': 'Failed to get products', 'details': str(e)}), 500
 @products_bp.route('/trending', methods=['GET'])
+@cached_response('trending', ttl=POPULARITY_FLUSH_SECONDS)
 def get_trending_products():
     """Get trending products with enhanced clothing support"""
     try:
-        from database.models import UserHistory
-        
         limit = request.args.get('limit', 12, type=int)
         category = request.args.get('category', None)
         max_price = request.args.get('max_price', type=float)
         clothing_only = request.args.get('clothing_only', 'false').lower() == 'true'
+        window = request.args.get('window', 'decayed')
         
-        # Build base query for trending
-        trending_query = db.session.query(
-            Product,
-            func.count(UserHistory.id).label('interaction_count')
-        ).join(
-            UserHistory, Product.id == UserHistory.product_id, isouter=True
-        ).group_by(Product.id)
-        
-        # Apply filters
-        if category:
-            trending_query = trending_query.filter(Product.category.ilike(f'%{category}%'))
-        elif clothing_only:
-            clothing_categories = ['clothing', 'fashion', 'apparel']
-            clothing_conditions = [Product.category.ilike(f'%{cat}%') for cat in clothing_categories]
-            if clothing_conditions:
-                trending_query = trending_query.filter(or_(*clothing_conditions))
-        
-        if max_price is not None:
-            trending_query = trending_query.filter(Product.price <= max_price)
-        
-        # Get trending products
-        results = trending_query.order_by(desc('interaction_count')).limit(limit).all()
+        if window not in TRENDING_WINDOWS and window != 'decayed':
+            return jsonify({'error': f"Unknown window '{window}'", 'windows': list(TRENDING_WINDOWS) + ['decayed']}), 400
         
         trending_products = []
-        for product, count in results:
-            product_dict = product.to_dict()
-            product_dict['interaction_count'] = count or 0
-            trending_products.append(product_dict)
+        seen = set()
+        page_size = max(limit * 4, 50)
+        offset = 0
+        while True:
+            # Top-k read of the ranked (product_id, score) pairs, deep enough for this page
+            ranked = get_trending(window, limit=offset + page_size)
+            scores = {product_id: score for product_id, score in ranked[offset:] if product_id not in seen}
+            if not scores:
+                break
+            seen.update(scores)
+            
+            # Apply filters to one page of ranked candidates at a time
+            page_query = Product.query.filter(Product.id.in_(list(scores)))
+            if category:
+                page_query = page_query.filter(Product.category.ilike(f'%{category}%'))
+            elif clothing_only:
+                clothing_categories = ['clothing', 'fashion', 'apparel']
+                clothing_conditions = [Product.category.ilike(f'%{cat}%') for cat in clothing_categories]
+                if clothing_conditions:
+                    page_query = page_query.filter(or_(*clothing_conditions))
+            
+            if max_price is not None:
+                page_query = page_query.filter(Product.price <= max_price)
+            
+            for product in sorted(page_query.all(), key=lambda p: scores[p.id], reverse=True):
+                product_dict = product.to_dict()
+                product_dict['interaction_count'] = round(scores[product.id], 2)
+                trending_products.append(product_dict)
+            
+            if len(trending_products) >= limit:
+                trending_products = trending_products[:limit]
+                break
+            if len(ranked) < offset + page_size:
+                break
+            offset += page_size
         
         # If not enough trending products, fill with latest products
         if len(trending_products) < limit:
@@ -845,7 +1023,8 @@ def get_trending_products():
             'limit': limit,
             'category': category,
             'max_price': max_price,
-            'clothing_only': clothing_only
+            'clothing_only': clothing_only,
+            'window': window
         })
         
     except Exception as e:
@@ -1,7 +1,11 @@
 from flask import Blueprint, request, jsonify
 from services.vector_search import find_similar_products, search_by_image_id, get_complementary_products
-from services.nlp_agent import refine_recommendations
-from database.models import db, Product, User, UserHistory
+from services.nlp_agent import refine_recommendations, ProductColumns
+from services.response_cache import cached_response, cache_metrics
+from services.interaction_buffer import log_interaction, interaction_buffer_metrics
+from services.quotes import quote_metrics
+from services.result_sets import register_result_set, get_result_set, result_set_metrics
+from database.models import Product, User
 import numpy as np
 import traceback
 
@@ -51,7 +55,12 @@ def log_recommendation_context(features, products_found):
     except Exception as e:
         print(f"Error logging context: {e}")
 
+def records_interactions():
+    """Requests with a user_id write UserHistory rows, so they must not be served from cache"""
+    return bool((request.get_json(silent=True) or {}).get('user_id'))
+
 @recommendation_bp.route('/similar', methods=['POST'])
+@cached_response('similar', bypass=records_interactions)
 def get_similar_products():
     """Get similar products with enhanced gender-aware filtering"""
     try:
@@ -70,7 +79,7 @@ def get_similar_products():
                 return jsonify({'error': 'Invalid features provided'}), 400
             
             limit = data.get('limit', 10)
-            index_type = data.get('index_type', 'image')
+            index_type = data.get('index_type')
             
             print(f"Searching by features using {index_type} index")
             print(f"Enhanced features: {features}")
@@ -82,7 +91,7 @@ def get_similar_products():
             # Search by existing product's image
             image_id = data['image_id']
             limit = data.get('limit', 10)
-            index_type = data.get('index_type', 'image')
+            index_type = data.get('index_type')
             
             print(f"Searching by image ID {image_id} using {index_type} index")
             similar_product_ids = search_by_image_id(image_id, limit=limit*2, index_type=index_type)
@@ -125,15 +134,10 @@ def get_similar_products():
             try:
                 user = User.query.get(user_id)
                 if user:
+                    # Written in batches by the background flusher
                     for product_dict in product_details[:5]:
-                        history = UserHistory(
-                            user_id=user_id,
-                            product_id=product_dict['id'],
-                            interaction_type='recommendation_view'
-                        )
-                        db.session.add(history)
-                    db.session.commit()
-                    print(f"Recorded interactions for user {user_id}")
+                        log_interaction(user_id, product_dict['id'], 'recommendation_view')
+                    print(f"Queued interactions for user {user_id}")
             except Exception as e:
                 print(f"Error recording user interactions: {e}")
         
@@ -141,6 +145,7 @@ def get_similar_products():
         
         return jsonify({
             'recommendations': product_details,
+            'result_set_id': register_result_set(product_details),
             'total': len(product_details),
             'search_method': 'features' if 'features' in data else 'image_id' if 'image_id' in data else 'image_path',
             'features_used': data.get('features') if 'features' in data else None,
@@ -154,6 +159,7 @@ def get_similar_products():
         return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
 
 @recommendation_bp.route('/complementary', methods=['POST'])
+@cached_response('complementary')
 def complementary():
     """Enhanced complementary products with true complementary logic"""
     try:
@@ -171,9 +177,11 @@ def complementary():
             
             # Get true complementary products
             complementary = get_complementary_products(product, limit)
+            complementary_products = [p.to_dict() for p in complementary]
             
             return jsonify({
-                "complementary_products": [p.to_dict() for p in complementary],
+                "complementary_products": complementary_products,
+                "result_set_id": register_result_set(complementary_products),
                 "total": len(complementary),
                 "source_product": product.to_dict(),
                 "complementary_logic": "true_complementary"  # Flag to indicate this is complementary, not similar
@@ -193,9 +201,11 @@ def complementary():
             
             # Get complementary products by features
             complementary = get_complementary_by_features(features, limit)
+            complementary_products = [p.to_dict() for p in complementary]
             
             return jsonify({
-                "complementary_products": [p.to_dict() for p in complementary],
+                "complementary_products": complementary_products,
+                "result_set_id": register_result_set(complementary_products),
                 "total": len(complementary),
                 "source_features": features,
                 "complementary_logic": "feature_based_complementary"
@@ -211,11 +221,16 @@ def complementary():
 
 @recommendation_bp.route('/refine', methods=['POST'])
 def refine_results():
-    """Refine product recommendations with enhanced response handling"""
+    """
+    Refine product recommendations with enhanced response handling
+    
+    Takes a prompt plus either the result_set_id of an earlier recommendation
+    or refine response (refined server-side), or the products themselves.
+    """
     try:
         data = request.json
         
-        if not data or 'products' not in data or 'prompt' not in data:
+        if not data or 'prompt' not in data or ('products' not in data and 'result_set_id' not in data):
             return jsonify({
                 'error': 'Missing products or prompt',
                 'type': 'error',
@@ -223,13 +238,32 @@ def refine_results():
                 'products': []
             }), 400
         
-        products = data['products']
         prompt = data['prompt']
+        result_set = None
+        columns = None
+        
+        if 'result_set_id' in data and 'products' not in data:
+            result_set = get_result_set(data['result_set_id'])
+            if result_set is None:
+                return jsonify({
+                    'error': 'Result set expired',
+                    'type': 'error',
+                    'response': 'These results have expired. Please resend the products or run a new search.',
+                    'products': []
+                }), 410
+            
+            products = result_set.products
+            # Built once per result set and reused by every refinement of it
+            if result_set.columns is None:
+                result_set.columns = ProductColumns(products)
+            columns = result_set.columns
+        else:
+            products = data['products']
         
         print(f"Refining {len(products)} products with prompt: {prompt}")
         
         # Use enhanced NLP to refine recommendations
-        result = refine_recommendations(products, prompt)
+        result = refine_recommendations(products, prompt, columns)
         
         # Extract components with proper defaults
         result_type = result.get('type', 'filtered')
@@ -244,6 +278,9 @@ def refine_results():
             'success': True,
             'type': result_type,
             'response': result_response,
+            # Only server-held products become result sets; posted products are not trusted
+            'result_set_id': register_result_set(result_products, parent_id=result_set.id, prompt=prompt) if result_set else None,
+            'parent_result_set_id': result_set.id if result_set else None,
             'products': result_products,        # Frontend expects this
             'recommendations': result_products, # For compatibility
             'total': len(result_products),
@@ -281,6 +318,10 @@ def get_status():
         # Get index statistics
         index_stats = get_index_stats()
         status.update(index_stats)
+        status['response_cache'] = cache_metrics()
+        status['interaction_buffer'] = interaction_buffer_metrics()
+        status['pricing_quotes'] = quote_metrics()
+        status['result_sets'] = result_set_metrics()
         
         return jsonify(status)
         
@@ -1,5 +1,8 @@
+import datetime
 from flask import Blueprint, request, jsonify
-from database.models import db, User, UserHistory, Product
+from database.models import db, User
+from services.db_service import get_user_history, serialize_history_entry
+from utils.pagination import InvalidCursor, page_response
 
 user_bp = Blueprint('user', __name__)
 
@@ -56,22 +59,39 @@ def user_preferences(user_id):
 
 @user_bp.route('/history/<int:user_id>', methods=['GET'])
 def user_history(user_id):
+    """
+    A user's history, newest first, with compact product details
+    
+    Query params: limit (default 20), cursor, since (ISO datetime), type
+    (comma-separated interaction types), stream=true for chunked JSON.
+    """
     user = User.query.get(user_id)
     
     if not user:
         return jsonify({'error': 'User not found'}), 404
     
-    history_items = UserHistory.query.filter_by(user_id=user_id).order_by(UserHistory.timestamp.desc()).limit(20).all()
+    limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+    interaction_types = [t.strip() for t in request.args.get('type', '').split(',') if t.strip()]
+    stream = request.args.get('stream', 'false').lower() == 'true'
     
-    history_with_products = []
-    for item in history_items:
-        product = Product.query.get(item.product_id)
-        if product:
-            history_with_products.append({
-                'id': item.id,
-                'product': product.to_dict(),
-                'interaction_type': item.interaction_type,
-                'timestamp': item.timestamp.isoformat()
-            })
+    since = request.args.get('since')
+    if since:
+        try:
+            since = datetime.datetime.fromisoformat(since)
+        except ValueError:
+            return jsonify({'error': 'since must be an ISO 8601 datetime'}), 400
+        # Timestamps are stored as naive UTC
+        if since.tzinfo is not None:
+            since = since.astimezone(datetime.timezone.utc).replace(tzinfo=None)
     
-    return jsonify({'history': history_with_products})
\ No newline at end of file
+    try:
+        page = get_user_history(
+            user_id,
+            limit=limit,
+            cursor=request.args.get('cursor'),
+            since=since or None,
+            interaction_types=interaction_types
+        )
+        return page_response(page, {}, serialize_history_entry, stream=stream, items_key='history')
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
@@ -0,0 +1,290 @@
+"""
+Item-item association index mined from UserHistory.
+
+An offline job groups each user's views, add-to-carts and purchases into
+baskets (one per user per SESSION_SECONDS window), counts how often every
+pair of products shares a basket in a sparse co-occurrence matrix, scores
+pairs by PMI (or lift) and keeps the top ASSOCIATION_TOP_N per product.
+"Frequently bought together" for a cart is then a few CSR row reads and a
+merge.
+
+Raw counts and a watermark are kept next to the index, so a rerun only reads
+history from windows that closed since the last run. Pass --full to rebuild
+from scratch.
+
+Usage (from backend/): python -m services.associations [--full]
+"""
+import datetime
+import json
+import os
+import sys
+import time
+import traceback
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from sqlalchemy import text
+
+ASSOCIATIONS_DIR = 'data/associations'
+ASSOCIATIONS_PATH = os.path.join(ASSOCIATIONS_DIR, 'associations.npz')
+COOCCURRENCE_STATE_PATH = os.path.join(ASSOCIATIONS_DIR, 'cooccurrence_state.npz')
+
+# Interactions that express interest in a product (recommendation_view is what we showed, not what they chose)
+ASSOCIATION_INTERACTIONS = ('view', 'add_to_cart', 'purchase')
+
+# Basket window; a window is only mined once it has closed
+SESSION_SECONDS = 1800
+
+# Most recent distinct products kept per basket, so one long session cannot dominate (pairs grow quadratically)
+MAX_BASKET_ITEMS = 50
+
+# Pairs seen together fewer times than this are treated as noise
+MIN_COOCCURRENCE = 2
+
+# Scores are scaled by count / (count + shrinkage): PMI alone ranks a product
+# seen twice, both times with the seed, level with a partner seen together
+# hundreds of times
+ASSOCIATION_SHRINKAGE = 5.0
+
+ASSOCIATION_TOP_N = 20
+
+# Global state for the loaded association index
+_associations = None
+_loaded_mtime = None
+
+def read_baskets(connection, since=None, until=None):
+    """
+    Basket x product incidence matrix for history in [since, until)
+    
+    Args:
+        connection: SQLAlchemy connection
+        since, until: Epoch seconds (aligned to SESSION_SECONDS)
+    
+    Returns:
+        CSR matrix with one row per basket and one column per product ID
+    """
+    conditions = [f"interaction_type IN ({', '.join(repr(t) for t in ASSOCIATION_INTERACTIONS)})"]
+    params = {}
+    # Compared as the stored text so the timestamp index can be used
+    if since is not None:
+        conditions.append("timestamp >= :since")
+        params['since'] = datetime.datetime.utcfromtimestamp(since).strftime('%Y-%m-%d %H:%M:%S')
+    if until is not None:
+        conditions.append("timestamp < :until")
+        params['until'] = datetime.datetime.utcfromtimestamp(until).strftime('%Y-%m-%d %H:%M:%S')
+    
+    history = pd.read_sql_query(text(f"""
+        SELECT user_id, product_id, CAST(strftime('%s', timestamp) AS INTEGER) AS ts
+        FROM user_history
+        WHERE {' AND '.join(conditions)}
+        ORDER BY user_id, timestamp
+    """), connection, params=params)
+    
+    if history.empty:
+        return sp.csr_matrix((0, 0), dtype=np.float32)
+    
+    history['window'] = history['ts'] // SESSION_SECONDS
+    history['basket'] = history.groupby(['user_id', 'window'], sort=False).ngroup()
+    
+    # Distinct products per basket, most recent MAX_BASKET_ITEMS
+    history = history.drop_duplicates(['basket', 'product_id'], keep='last')
+    history = history[history.groupby('basket').cumcount(ascending=False) < MAX_BASKET_ITEMS]
+    
+    return sp.csr_matrix(
+        (np.ones(len(history), dtype=np.float32), (history['basket'].to_numpy(), history['product_id'].to_numpy())),
+        shape=(int(history['basket'].max()) + 1, int(history['product_id'].max()) + 1)
+    )
+
+def count_cooccurrences(baskets):
+    """
+    Pair counts and per-product basket counts for a basket matrix
+    
+    Returns:
+        (cooccurrence CSR with a zero diagonal, item_counts vector, basket count)
+    """
+    cooccurrence = (baskets.T @ baskets).tocsr()
+    cooccurrence.setdiag(0)
+    cooccurrence.eliminate_zeros()
+    item_counts = np.asarray(baskets.sum(axis=0)).ravel()
+    return cooccurrence, item_counts, baskets.shape[0]
+
+def resize_square(matrix, size):
+    matrix = matrix.tocsr(copy=True)
+    matrix.resize((size, size))
+    return matrix
+
+def score_associations(cooccurrence, item_counts, baskets, measure='pmi', top_n=ASSOCIATION_TOP_N, min_count=MIN_COOCCURRENCE):
+    """
+    Score co-occurring pairs and keep each product's top_n partners
+    
+    lift(a, b) = P(a, b) / (P(a) P(b)); PMI is its log. Only positively
+    associated pairs seen at least min_count times are kept, and scores are
+    shrunk towards zero for pairs with little support.
+    
+    Returns:
+        float32 CSR matrix of scores (row = product ID, columns = partners)
+    """
+    counts = cooccurrence.tocoo()
+    keep = counts.data >= min_count
+    rows, cols, pair_counts = counts.row[keep], counts.col[keep], counts.data[keep]
+    
+    lift = pair_counts * baskets / (item_counts[rows] * item_counts[cols])
+    scores = np.log(lift) if measure == 'pmi' else lift
+    scores = scores * pair_counts / (pair_counts + ASSOCIATION_SHRINKAGE)
+    positive = lift > 1.0
+    
+    scored = sp.csr_matrix(
+        (scores[positive].astype(np.float32), (rows[positive], cols[positive])),
+        shape=cooccurrence.shape
+    )
+    
+    # Prune every row to its top_n scores
+    lengths = np.diff(scored.indptr)
+    for row in np.flatnonzero(lengths > top_n):
+        start, stop = scored.indptr[row], scored.indptr[row + 1]
+        weakest = np.argpartition(scored.data[start:stop], -top_n)[:-top_n]
+        scored.data[start + weakest] = 0
+    scored.eliminate_zeros()
+    return scored
+
+def load_cooccurrence_state():
+    """Saved (cooccurrence, item_counts, baskets, watermark), or None"""
+    if not os.path.exists(COOCCURRENCE_STATE_PATH):
+        return None
+    
+    state = np.load(COOCCURRENCE_STATE_PATH)
+    cooccurrence = sp.csr_matrix((state['data'], state['indices'], state['indptr']), shape=tuple(state['shape']))
+    return cooccurrence, state['item_counts'], int(state['baskets']), int(state['watermark'])
+
+def save_npz_atomically(path, save):
+    # Write to a temporary file and rename so readers never see a partial file
+    tmp_path = path + '.tmp.npz'
+    save(tmp_path)
+    os.replace(tmp_path, path)
+
+def update_associations(connection, full=False, measure='pmi', now=None):
+    """
+    Mine baskets from closed windows since the last run and rewrite the index
+    
+    Args:
+        connection: SQLAlchemy connection
+        full: Ignore saved counts and rebuild from all history
+        measure: 'pmi' or 'lift'
+        now: Epoch seconds (defaults to the current time)
+    
+    Returns:
+        Dict with baskets added, total baskets, products and pairs kept
+    """
+    start = time.time()
+    os.makedirs(ASSOCIATIONS_DIR, exist_ok=True)
+    
+    state = None if full else load_cooccurrence_state()
+    if state is None:
+        cooccurrence, item_counts, baskets, watermark = sp.csr_matrix((0, 0), dtype=np.float32), np.zeros(0), 0, None
+    else:
+        cooccurrence, item_counts, baskets, watermark = state
+    
+    # Only windows that have closed, so no basket is ever split across runs
+    until = int(now if now is not None else time.time()) // SESSION_SECONDS * SESSION_SECONDS
+    new_baskets = read_baskets(connection, since=watermark, until=until)
+    
+    if new_baskets.shape[0]:
+        new_counts, new_item_counts, new_basket_count = count_cooccurrences(new_baskets)
+        size = max(cooccurrence.shape[0], new_counts.shape[0])
+        cooccurrence = resize_square(cooccurrence, size) + resize_square(new_counts, size)
+        item_counts = np.pad(item_counts, (0, size - len(item_counts))) + np.pad(new_item_counts, (0, size - len(new_item_counts)))
+        baskets += new_basket_count
+    
+    scores = score_associations(cooccurrence, item_counts, baskets, measure=measure) if baskets else cooccurrence
+    
+    save_npz_atomically(ASSOCIATIONS_PATH, lambda path: sp.save_npz(path, scores.astype(np.float32)))
+    save_npz_atomically(COOCCURRENCE_STATE_PATH, lambda path: np.savez(
+        path,
+        data=cooccurrence.data,
+        indices=cooccurrence.indices,
+        indptr=cooccurrence.indptr,
+        shape=np.array(cooccurrence.shape),
+        item_counts=item_counts,
+        baskets=baskets,
+        watermark=until
+    ))
+    
+    stats = {
+        'new_baskets': int(new_baskets.shape[0]),
+        'baskets': int(baskets),
+        'products': int(np.count_nonzero(np.diff(scores.indptr))) if scores.shape[0] else 0,
+        'pairs': int(scores.nnz),
+        'seconds': round(time.time() - start, 2)
+    }
+    print(f"Association index updated: {json.dumps(stats)}")
+    return stats
+
+def load_associations():
+    """
+    Load (or reload, if the file changed) the association score matrix
+    
+    Returns:
+        CSR matrix or None if unavailable
+    """
+    global _associations, _loaded_mtime
+    
+    try:
+        if not os.path.exists(ASSOCIATIONS_PATH):
+            return None
+        
+        mtime = os.path.getmtime(ASSOCIATIONS_PATH)
+        if _associations is None or mtime != _loaded_mtime:
+            _associations = sp.load_npz(ASSOCIATIONS_PATH).tocsr()
+            _loaded_mtime = mtime
+            print(f"Loaded association index with {_associations.nnz} pairs")
+        
+        return _associations
+    
+    except Exception as e:
+        print(f"Error loading association index: {e}")
+        traceback.print_exc()
+        return None
+
+def get_associated_ids(product_ids, limit=10, exclude=None):
+    """
+    Products most associated with a set of products (e.g. a cart)
+    
+    Each seed's row of partner scores is read and the rows are summed, so
+    partners of several seeds rank first.
+    
+    Args:
+        product_ids: Seed product IDs
+        limit: Maximum number of IDs to return
+        exclude: IDs to leave out (the seeds are always excluded)
+    
+    Returns:
+        List of product IDs, strongest association first
+    """
+    associations = load_associations()
+    if associations is None or not product_ids:
+        return []
+    
+    seeds = []
+    for product_id in product_ids:
+        try:
+            product_id = int(product_id)
+        except (TypeError, ValueError):
+            continue
+        if 0 <= product_id < associations.shape[0]:
+            seeds.append(product_id)
+    if not seeds:
+        return []
+    
+    merged = associations[seeds].sum(axis=0).A1
+    excluded = set(exclude or []) | set(seeds)
+    candidates = np.flatnonzero(merged > 0)
+    ranked = candidates[np.argsort(-merged[candidates], kind='stable')]
+    return [int(pid) for pid in ranked if int(pid) not in excluded][:limit]
+
+if __name__ == '__main__':
+    from app import app
+    from database.models import db
+    
+    with app.app_context():
+        with db.engine.connect() as connection:
+            update_associations(connection, full='--full' in sys.argv)
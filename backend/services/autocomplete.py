@@ -0,0 +1,269 @@
+"""
+In-memory autocomplete over product names, categories and subcategories.
+
+Every entry is indexed under each of its word suffixes ("red cotton t-shirt"
+is reachable from "red", "cotton" and "t-shirt"), stored as a sorted list of
+(key, text) pairs per entry type and searched with bisect. Keys are
+normalized once at build time with the same normalize_search_text() used on
+queries. Entries are weighted by product count plus UserHistory interactions,
+and the top completions for short prefixes (the ones matching the most keys)
+are cached until an entry under them changes.
+"""
+import heapq
+import threading
+import time
+import traceback
+from bisect import bisect_left, insort
+from collections import Counter
+from sqlalchemy import text
+from database.models import db
+from database.catalog import get_catalog_version, on_product_change
+from services.search_index import normalize_search_text
+
+ENTRY_TYPES = ('product', 'category', 'subcategory')
+
+# Prefixes up to this length have their top completions cached
+MAX_CACHED_PREFIX = 3
+CACHED_COMPLETIONS = 20
+
+# Only index the last few words of very long names
+MAX_KEY_SUFFIXES = 6
+
+# Rebuild at least this often so popularity weights follow UserHistory
+AUTOCOMPLETE_REFRESH_SECONDS = 600
+
+class AutocompleteIndex:
+    def __init__(self):
+        self.entries = {}                                       # (type, text) -> entry dict
+        self.keys = {entry_type: [] for entry_type in ENTRY_TYPES}  # type -> sorted [(key, text)]
+        self.products = {}                                      # product id -> (name, category, subcategory, weight)
+        self.prefix_cache = {}                                  # (type, prefix) -> top entries
+        self.catalog_version = None
+        self.built_at = 0.0
+        self.lock = threading.RLock()
+    
+    @staticmethod
+    def entry_keys(value):
+        """Normalized word-suffix keys for one entry text, plus hyphen-free variants ("tsh" -> "t-shirt")"""
+        words = normalize_search_text(value).split()
+        start = max(0, len(words) - MAX_KEY_SUFFIXES)
+        keys = {' '.join(words[i:]) for i in range(start, len(words))}
+        return keys | {key.replace('-', '') for key in keys if '-' in key}
+    
+    @staticmethod
+    def rank_key(entry):
+        return (-entry['weight'], len(entry['text']), entry['text'])
+    
+    def load(self, rows):
+        """
+        Build the index from (id, name, category, subcategory, interactions) rows
+        
+        Keys are generated once per distinct entry and sorted in a single pass.
+        """
+        with self.lock:
+            self.entries = {}
+            self.products = {}
+            self.prefix_cache = {}
+            
+            for product_id, name, category, subcategory, interactions in rows:
+                weight = 1 + (interactions or 0)
+                self.products[product_id] = (name, category, subcategory, weight)
+                for entry_type, value in self._product_entries(name, category, subcategory):
+                    self._add_to_entry(entry_type, value, category, weight)
+            
+            keys = {entry_type: [] for entry_type in ENTRY_TYPES}
+            for (entry_type, value) in self.entries:
+                keys[entry_type].extend((key, value) for key in self.entry_keys(value))
+            for entry_type in ENTRY_TYPES:
+                keys[entry_type].sort()
+            self.keys = keys
+            self.built_at = time.monotonic()
+    
+    @staticmethod
+    def _product_entries(name, category, subcategory):
+        return [
+            (entry_type, value)
+            for entry_type, value in (('product', name), ('category', category), ('subcategory', subcategory))
+            if value
+        ]
+    
+    def _add_to_entry(self, entry_type, value, category, weight):
+        entry = self.entries.get((entry_type, value))
+        created = entry is None
+        if created:
+            entry = {'text': value, 'type': entry_type, 'weight': 0, 'products': 0, 'categories': Counter()}
+            self.entries[(entry_type, value)] = entry
+        
+        entry['weight'] += weight
+        entry['products'] += 1
+        if category:
+            entry['categories'][category] += 1
+        return created
+    
+    def _remove_from_entry(self, entry_type, value, category, weight):
+        entry = self.entries.get((entry_type, value))
+        if entry is None:
+            return False
+        
+        entry['weight'] -= weight
+        entry['products'] -= 1
+        if category:
+            entry['categories'][category] -= 1
+            if entry['categories'][category] <= 0:
+                del entry['categories'][category]
+        
+        if entry['products'] <= 0:
+            del self.entries[(entry_type, value)]
+            return True
+        return False
+    
+    def _invalidate(self, entry_type, keys):
+        for key in keys:
+            for length in range(1, min(len(key), MAX_CACHED_PREFIX) + 1):
+                self.prefix_cache.pop((entry_type, key[:length]), None)
+    
+    def upsert_product(self, product_id, name, category, subcategory):
+        """Add a product, or move it to new name/category/subcategory entries"""
+        with self.lock:
+            weight = 1
+            if product_id in self.products:
+                weight = self.products[product_id][3]
+                self.remove_product(product_id)
+            
+            self.products[product_id] = (name, category, subcategory, weight)
+            for entry_type, value in self._product_entries(name, category, subcategory):
+                created = self._add_to_entry(entry_type, value, category, weight)
+                keys = self.entry_keys(value)
+                if created:
+                    for key in keys:
+                        insort(self.keys[entry_type], (key, value))
+                self._invalidate(entry_type, keys)
+    
+    def remove_product(self, product_id):
+        """Drop a product's contribution; entries left with no products are removed"""
+        with self.lock:
+            product = self.products.pop(product_id, None)
+            if product is None:
+                return
+            
+            name, category, subcategory, weight = product
+            for entry_type, value in self._product_entries(name, category, subcategory):
+                removed = self._remove_from_entry(entry_type, value, category, weight)
+                keys = self.entry_keys(value)
+                if removed:
+                    entry_keys = self.keys[entry_type]
+                    for key in keys:
+                        position = bisect_left(entry_keys, (key, value))
+                        if position < len(entry_keys) and entry_keys[position] == (key, value):
+                            del entry_keys[position]
+                self._invalidate(entry_type, keys)
+    
+    def _scan(self, entry_type, prefix, limit, category_terms=None):
+        entry_keys = self.keys[entry_type]
+        seen = set()
+        candidates = []
+        
+        for i in range(bisect_left(entry_keys, (prefix,)), len(entry_keys)):
+            key, value = entry_keys[i]
+            if not key.startswith(prefix):
+                break
+            if value in seen:
+                continue
+            seen.add(value)
+            
+            entry = self.entries[(entry_type, value)]
+            if category_terms and not any(
+                term in category.lower() for category in entry['categories'] for term in category_terms
+            ):
+                continue
+            candidates.append(entry)
+        
+        return heapq.nsmallest(limit, candidates, key=self.rank_key)
+    
+    def complete(self, prefix, limit=10, entry_types=ENTRY_TYPES, category_terms=None):
+        """
+        Top completions for a prefix
+        
+        Args:
+            prefix: Raw user input (normalized here)
+            limit: Maximum number of completions
+            entry_types: Entry types to include
+            category_terms: Optional lowercase substrings; only entries with a
+                product in a matching category are returned
+        
+        Returns:
+            List of {'text', 'type', 'weight'} dicts, most popular first
+        """
+        prefix = normalize_search_text(prefix)
+        if not prefix:
+            return []
+        
+        results = []
+        with self.lock:
+            for entry_type in entry_types:
+                if len(prefix) <= MAX_CACHED_PREFIX and not category_terms and limit <= CACHED_COMPLETIONS:
+                    cached = self.prefix_cache.get((entry_type, prefix))
+                    if cached is None:
+                        cached = self._scan(entry_type, prefix, CACHED_COMPLETIONS)
+                        self.prefix_cache[(entry_type, prefix)] = cached
+                    results.extend(cached[:limit])
+                else:
+                    results.extend(self._scan(entry_type, prefix, limit, category_terms))
+            
+            top = heapq.nsmallest(limit, results, key=self.rank_key)
+            return [{'text': entry['text'], 'type': entry['type'], 'weight': entry['weight']} for entry in top]
+
+_index = None
+_build_lock = threading.Lock()
+
+def build_autocomplete_index():
+    """Build a fresh index from the product table and UserHistory counts"""
+    version = get_catalog_version(force=True)
+    rows = db.session.execute(text("""
+        SELECT p.id, p.name, p.category, p.subcategory, count(h.id)
+        FROM product p LEFT JOIN user_history h ON h.product_id = p.id
+        GROUP BY p.id
+    """)).fetchall()
+    
+    index = AutocompleteIndex()
+    index.load(rows)
+    index.catalog_version = version
+    print(f"Autocomplete index built: {len(index.entries)} entries from {len(rows)} products")
+    return index
+
+def get_autocomplete_index():
+    """
+    Shared index, rebuilt when the catalog version moves without us (another
+    process or a bulk load) or the popularity weights are older than
+    AUTOCOMPLETE_REFRESH_SECONDS
+    """
+    global _index
+    
+    index = _index
+    if index is not None and index.catalog_version == get_catalog_version() \
+            and time.monotonic() - index.built_at < AUTOCOMPLETE_REFRESH_SECONDS:
+        return index
+    
+    with _build_lock:
+        if _index is index:
+            _index = build_autocomplete_index()
+        return _index
+
+@on_product_change
+def apply_product_changes(changes):
+    """Keep the shared index in step with committed ORM product writes"""
+    index = _index
+    if index is None:
+        return
+    
+    try:
+        for change_type, snapshot in changes:
+            if change_type == 'delete':
+                index.remove_product(snapshot['id'])
+            else:
+                index.upsert_product(snapshot['id'], snapshot['name'], snapshot['category'], snapshot['subcategory'])
+        index.catalog_version = get_catalog_version(force=True)
+    except Exception as e:
+        print(f"Error updating autocomplete index, scheduling rebuild: {e}")
+        traceback.print_exc()
+        index.catalog_version = None
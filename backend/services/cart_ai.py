@@ -1,12 +1,146 @@
 import json
+import threading
+import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime, timedelta
-from database.models import db, Product, User, UserHistory
+from flask import current_app, has_app_context
+from database.models import db, User
 from services.vector_search import find_similar_products, get_complementary_products
+from services.neighbors import get_neighbor_ids_for_many
+from services.associations import get_associated_ids
+from services.sampling import sample_product_ids
+from services.pricing import PricingEngine, get_user_flags
+from services.quotes import quote_pricing
+from services.inventory import get_inventory_signals
+from services.db_service import get_products_by_ids, get_user_history
 from services.nlp_agent import refine_recommendations
-from sqlalchemy import func, desc, and_, or_
+from sqlalchemy import and_, or_
 import random
 
+# Complementary products fetched per cart product; every analysis slices from these
+COMPLEMENTARY_CANDIDATES = 3
+
+# Cart products that get complementary lookups
+COMPLEMENTARY_CART_ITEMS = 2
+
+# Stock at or below this many units raises a stock alert
+LOW_STOCK_THRESHOLD = 3
+
+# Latency budget for a full cart analysis; late components are served their fallback
+CART_ANALYSIS_BUDGET_MS = 1500
+
+# Shared across requests, so concurrent checkouts cannot spawn unbounded threads
+CART_ANALYSIS_WORKERS = 8
+
+_executor = ThreadPoolExecutor(max_workers=CART_ANALYSIS_WORKERS, thread_name_prefix='cart-analysis')
+
+def cart_product_id(item):
+    """Integer product ID of a cart item, or None"""
+    try:
+        return int(item.get('id'))
+    except (TypeError, ValueError):
+        return None
+
+def detached(products):
+    """
+    Detach loaded products from the current thread's session
+    
+    Their columns are already loaded, so they can be read from any thread
+    without touching the session (or app context) that loaded them.
+    """
+    for product in products:
+        # The same instance appears once per repeated ID
+        if product in db.session:
+            db.session.expunge(product)
+    return products
+
+class CartContext:
+    """
+    Data shared by the sub-analyses of one cart analysis
+    
+    Each piece is loaded on first use and then reused: the cart's products
+    with one IN query, the user's recent history with one joined query, and
+    the complementary products of each cart product once. Sub-analyses run on
+    worker threads with their own sessions, so shared products are detached
+    and history rows are plain column tuples.
+    """
+    
+    def __init__(self, cart_items, user_id=None):
+        self.cart_items = cart_items or []
+        self.user_id = user_id
+        self.cart_ids = [pid for pid in (cart_product_id(item) for item in self.cart_items) if pid is not None]
+        self._products = None
+        self._history = None
+        self._complementary = {}
+        # Sub-analyses may run on worker threads; each piece is loaded once
+        self._lock = threading.Lock()
+        self._complementary_locks = {}
+        # Errors sub-analyses recovered from, by sub-analysis name
+        self.errors = {}
+        self._errors_lock = threading.Lock()
+        self._component = threading.local()
+    
+    def run_component(self, name, function, *args):
+        """Run a sub-analysis, attributing the errors it records to name"""
+        self._component.name = name
+        try:
+            return function(*args)
+        finally:
+            self._component.name = None
+    
+    def record_error(self, error):
+        """Note an error the running sub-analysis recovered from"""
+        name = getattr(self._component, 'name', None)
+        if name is not None:
+            with self._errors_lock:
+                self.errors.setdefault(name, []).append(str(error))
+    
+    @property
+    def products(self):
+        """Cart products by ID"""
+        with self._lock:
+            if self._products is None:
+                self._products = {product.id: product for product in detached(get_products_by_ids(self.cart_ids))}
+            return self._products
+    
+    def product(self, item):
+        """Product for a cart item, or None"""
+        return self.products.get(cart_product_id(item))
+    
+    @property
+    def history(self):
+        """The user's 10 most recent history entries (with product columns)"""
+        with self._lock:
+            if self._history is None:
+                self._history = get_user_history(self.user_id, limit=10).all() if self.user_id else []
+            return self._history
+    
+    def complementary(self, product, limit=COMPLEMENTARY_CANDIDATES):
+        """Complementary products for a cart product, computed once per analysis"""
+        with self._lock:
+            product_lock = self._complementary_locks.setdefault(product.id, threading.Lock())
+        
+        with product_lock:
+            if product.id not in self._complementary:
+                self._complementary[product.id] = detached(get_complementary_products(product, limit=COMPLEMENTARY_CANDIDATES))
+            return self._complementary[product.id][:limit]
+
+def report_error(context, error):
+    """Record a recovered error on the analysis context, if there is one"""
+    if context is not None:
+        context.record_error(error)
+
+def run_in_app_context(app, function, *args):
+    """Run function inside an app context (worker threads have none), timing it"""
+    start = time.perf_counter()
+    if app is None:
+        result = function(*args)
+    else:
+        with app.app_context():
+            result = function(*args)
+    return result, round((time.perf_counter() - start) * 1000, 2)
+
 class CartAI:
     def __init__(self):
         self.bundle_rules = {
@@ -14,34 +148,98 @@ class CartAI:
                 'categories': ['clothing'],
                 'min_items': 2,
                 'discount': 0.15,
-                'name': 'Complete Outfit Discount'
+                'name': 'Complete Outfit Discount',
+                'description': '15% off when you buy 2+ clothing items'
             },
             'accessories_bundle': {
                 'categories': ['accessories', 'shoes'],
                 'min_items': 2,
                 'discount': 0.10,
-                'name': 'Accessories Bundle'
+                'applies_to': 'matched',
+                'name': 'Accessories Bundle',
+                'description': '10% off when you buy 2+ accessories'
             },
             'volume_discount': {
+                'type': 'volume',
                 'min_quantity': 3,
                 'discount': 0.12,
-                'name': 'Volume Discount'
+                'name': 'Volume Discount',
+                'description': '12% off for buying {quantity:g} items'
+            },
+            'welcome_discount': {
+                'type': 'welcome',
+                'requires': 'first_time_buyer',
+                'discount': 0.08,
+                'name': 'Welcome Discount',
+                'description': '8% off for first-time customers'
+            },
+            'flash_sale': {
+                'type': 'flash',
+                'hours': (14, 16),  # 2 PM - 4 PM
+                'after_shipping': True,
+                'discount': 0.05,
+                'name': 'Flash Sale',
+                'description': '5% off - Limited time offer (2 PM - 4 PM)'
             }
         }
+        self.pricing_engine = PricingEngine(self.bundle_rules)
     
-    def analyze_cart(self, cart_items, user_id=None):
+    def analyze_cart(self, cart_items, user_id=None, budget_ms=CART_ANALYSIS_BUDGET_MS):
         """
         Comprehensive cart analysis with all AI features
+        
+        The components run concurrently. Any that has not finished within
+        budget_ms is served its get_fallback_analysis section (marked
+        degraded) and keeps running in the background.
+        
+        Returns:
+            Dict of component sections plus 'timings' (ms per component and
+            total) and 'degraded' (names of components that fell back or
+            recovered from errors)
         """
         try:
-            analysis = {
-                'personalized_suggestions': self.get_personalized_suggestions(cart_items, user_id),
-                'dynamic_pricing': self.calculate_dynamic_pricing(cart_items, user_id),
-                'smart_behaviors': self.get_smart_behaviors(cart_items, user_id),
-                'purchase_predictions': self.predict_purchase_behavior(cart_items, user_id),
-                'cart_optimization': self.optimize_cart(cart_items)
+            start = time.perf_counter()
+            context = CartContext(cart_items, user_id)
+            components = {
+                'personalized_suggestions': (self.get_personalized_suggestions, cart_items, user_id, context),
+                'dynamic_pricing': (self.quote_dynamic_pricing, cart_items, user_id),
+                'smart_behaviors': (self.get_smart_behaviors, cart_items, user_id, context),
+                'purchase_predictions': (self.predict_purchase_behavior, cart_items, user_id, context),
+                'cart_optimization': (self.optimize_cart, cart_items, context)
             }
             
+            app = current_app._get_current_object() if has_app_context() else None
+            futures = {
+                name: _executor.submit(run_in_app_context, app, context.run_component, name, *component)
+                for name, component in components.items()
+            }
+            wait(futures.values(), timeout=budget_ms / 1000)
+            
+            analysis = {}
+            timings = {}
+            degraded = []
+            fallback = None
+            for name, future in futures.items():
+                try:
+                    if not future.done():
+                        raise TimeoutError(f"missed the {budget_ms}ms budget")
+                    analysis[name], timings[name] = future.result()
+                    if context.errors.get(name):
+                        # Finished, but on a partial result after recovering from errors
+                        print(f"Cart analysis component {name} degraded: {context.errors[name]}")
+                        analysis[name] = dict(analysis[name], degraded=True, errors=context.errors[name])
+                        degraded.append(name)
+                except Exception as e:
+                    print(f"Cart analysis component {name} degraded: {e}")
+                    fallback = fallback or self.get_fallback_analysis(cart_items)
+                    analysis[name] = dict(fallback[name], degraded=True)
+                    timings[name] = None
+                    degraded.append(name)
+            
+            timings['total'] = round((time.perf_counter() - start) * 1000, 2)
+            analysis['timings'] = timings
+            analysis['degraded'] = degraded
+            
             return analysis
             
         except Exception as e:
@@ -49,11 +247,12 @@ class CartAI:
             traceback.print_exc()
             return self.get_fallback_analysis(cart_items)
     
-    def get_personalized_suggestions(self, cart_items, user_id=None):
+    def get_personalized_suggestions(self, cart_items, user_id=None, context=None):
         """
         Generate personalized product suggestions
         """
         try:
+            context = context or CartContext(cart_items, user_id)
             suggestions = {
                 'frequently_bought_together': [],
                 'complete_the_look': [],
@@ -64,13 +263,22 @@ class CartAI:
             if not cart_items:
                 return suggestions
             
-            # Frequently Bought Together
-            for item in cart_items[:2]:  # Limit to avoid overwhelming
+            # Frequently Bought Together: what users actually bought/viewed together first
+            for product in get_products_by_ids(get_associated_ids(context.cart_ids, limit=3)):
+                product_dict = product.to_dict()
+                product_dict['reason'] = "Frequently bought together with items in your cart"
+                product_dict['confidence'] = 0.85
+                suggestions['frequently_bought_together'].append(product_dict)
+            
+            # then rule-based complements
+            for item in cart_items[:COMPLEMENTARY_CART_ITEMS]:  # Limit to avoid overwhelming
+                if len(suggestions['frequently_bought_together']) >= 3:
+                    break
                 try:
-                    product = Product.query.get(item.get('id'))
+                    product = context.product(item)
                     if product:
                         # Get complementary products
-                        complementary = get_complementary_products(product, limit=3)
+                        complementary = context.complementary(product, limit=3)
                         for comp in complementary:
                             comp_dict = comp.to_dict()
                             comp_dict['reason'] = f"Often bought with {product.name}"
@@ -78,6 +286,7 @@ class CartAI:
                             suggestions['frequently_bought_together'].append(comp_dict)
                 except Exception as e:
                     print(f"Error getting complementary for {item}: {e}")
+                    report_error(context, e)
                     continue
             
             # Complete the Look (for clothing items)
@@ -89,58 +298,64 @@ class CartAI:
                         item_features = self.extract_item_features(clothing_item)
                         if item_features:
                             similar_products = find_similar_products(item_features, limit=3)
-                            for product_id in similar_products:
+                            for product in get_products_by_ids(similar_products):
                                 try:
-                                    product = Product.query.get(product_id)
-                                    if product and product.id not in [ci.get('id') for ci in cart_items]:
+                                    if product.id not in context.cart_ids:
                                         product_dict = product.to_dict()
                                         product_dict['reason'] = f"Completes your {clothing_item.get('name', 'outfit')}"
                                         product_dict['confidence'] = 0.7
                                         suggestions['complete_the_look'].append(product_dict)
                                 except Exception as e:
+                                    report_error(context, e)
                                     continue
                     except Exception as e:
+                        report_error(context, e)
                         continue
             
-            # You May Also Like (based on user history)
-            if user_id:
+            # You May Also Like: precomputed visual neighbours of the cart items
+            neighbor_ids = get_neighbor_ids_for_many(context.cart_ids, limit=4)
+            if neighbor_ids:
+                for product in get_products_by_ids(neighbor_ids):
+                    product_dict = product.to_dict()
+                    product_dict['reason'] = "Similar to items in your cart"
+                    product_dict['confidence'] = 0.65
+                    suggestions['you_may_also_like'].append(product_dict)
+            
+            # Otherwise fall back to the user's history
+            elif user_id:
                 try:
-                    user_history = UserHistory.query.filter_by(user_id=user_id).order_by(desc(UserHistory.created_at)).limit(10).all()
+                    user_history = context.history
                     if user_history:
                         # Get categories user likes
-                        liked_categories = []
-                        for history in user_history:
-                            product = Product.query.get(history.product_id)
-                            if product and product.category:
-                                liked_categories.append(product.category.lower())
+                        liked_categories = [entry.category.lower() for entry in user_history if entry.category]
                         
                         # Find products in liked categories not in cart
                         if liked_categories:
                             most_liked_category = max(set(liked_categories), key=liked_categories.count)
-                            similar_products = Product.query.filter(
-                                Product.category.ilike(f'%{most_liked_category}%'),
-                                ~Product.id.in_([item.get('id') for item in cart_items])
-                            ).order_by(func.random()).limit(4).all()
+                            similar_ids = sample_product_ids(
+                                4, category=most_liked_category, exclude=context.cart_ids, exclude_terms=None
+                            )
                             
-                            for product in similar_products:
+                            for product in get_products_by_ids(similar_ids):
                                 product_dict = product.to_dict()
                                 product_dict['reason'] = f"Based on your interest in {most_liked_category}"
                                 product_dict['confidence'] = 0.6
                                 suggestions['you_may_also_like'].append(product_dict)
                 except Exception as e:
                     print(f"Error getting user history suggestions: {e}")
+                    report_error(context, e)
             
-            # Trending Additions (popular products)
+            # Trending Additions (random picks, weighted towards popular products)
             try:
-                trending = Product.query.order_by(func.random()).limit(3).all()
-                for product in trending:
-                    if product.id not in [item.get('id') for item in cart_items]:
-                        product_dict = product.to_dict()
-                        product_dict['reason'] = "Trending now"
-                        product_dict['confidence'] = 0.5
-                        suggestions['trending_additions'].append(product_dict)
+                trending_ids = sample_product_ids(3, exclude=context.cart_ids, exclude_terms=None, weighted=True)
+                for product in get_products_by_ids(trending_ids):
+                    product_dict = product.to_dict()
+                    product_dict['reason'] = "Trending now"
+                    product_dict['confidence'] = 0.5
+                    suggestions['trending_additions'].append(product_dict)
             except Exception as e:
                 print(f"Error getting trending: {e}")
+                report_error(context, e)
             
             # Limit suggestions to avoid overwhelming
             for key in suggestions:
@@ -150,6 +365,7 @@ class CartAI:
             
         except Exception as e:
             print(f"Error getting personalized suggestions: {e}")
+            report_error(context, e)
             return {
                 'frequently_bought_together': [],
                 'complete_the_look': [],
@@ -160,115 +376,13 @@ class CartAI:
     def calculate_dynamic_pricing(self, cart_items, user_id=None):
         """
         Calculate dynamic pricing with AI-driven discounts
+        
+        All rules in bundle_rules are evaluated in one pass by the compiled
+        pricing engine; the user's eligibility flags come from a cache.
         """
         try:
-            pricing = {
-                'original_total': 0,
-                'discounts': [],
-                'final_total': 0,
-                'savings': 0,
-                'shipping': 0,
-                'free_shipping_eligible': False,
-                'recommendations': []
-            }
-            
-            if not cart_items:
-                return pricing
-            
-            # Calculate original total
-            original_total = sum(item.get('price', 0) * item.get('quantity', 1) for item in cart_items)
-            pricing['original_total'] = original_total
-            
-            total_discount = 0
-            
-            # Bundle Discounts
-            clothing_items = [item for item in cart_items if 'clothing' in str(item.get('category', '')).lower()]
-            accessories_items = [item for item in cart_items if any(cat in str(item.get('category', '')).lower() for cat in ['accessories', 'shoes'])]
-            
-            # Clothing Bundle Discount
-            if len(clothing_items) >= 2:
-                bundle_discount = original_total * 0.15
-                total_discount += bundle_discount
-                pricing['discounts'].append({
-                    'type': 'bundle',
-                    'name': 'Complete Outfit Discount',
-                    'amount': bundle_discount,
-                    'description': '15% off when you buy 2+ clothing items'
-                })
-            
-            # Accessories Bundle
-            if len(accessories_items) >= 2:
-                accessories_total = sum(item.get('price', 0) * item.get('quantity', 1) for item in accessories_items)
-                bundle_discount = accessories_total * 0.10
-                total_discount += bundle_discount
-                pricing['discounts'].append({
-                    'type': 'bundle',
-                    'name': 'Accessories Bundle',
-                    'amount': bundle_discount,
-                    'description': '10% off when you buy 2+ accessories'
-                })
-            
-            # Volume Discount
-            total_quantity = sum(item.get('quantity', 1) for item in cart_items)
-            if total_quantity >= 3:
-                volume_discount = original_total * 0.12
-                total_discount += volume_discount
-                pricing['discounts'].append({
-                    'type': 'volume',
-                    'name': 'Volume Discount',
-                    'amount': volume_discount,
-                    'description': f'12% off for buying {total_quantity} items'
-                })
-            
-            # First Time Buyer Discount (if user_id and no previous orders)
-            if user_id:
-                try:
-                    previous_orders = UserHistory.query.filter_by(user_id=user_id).count()
-                    if previous_orders == 0:
-                        first_time_discount = original_total * 0.08
-                        total_discount += first_time_discount
-                        pricing['discounts'].append({
-                            'type': 'welcome',
-                            'name': 'Welcome Discount',
-                            'amount': first_time_discount,
-                            'description': '8% off for first-time customers'
-                        })
-                except Exception as e:
-                    print(f"Error checking first time buyer: {e}")
-            
-            # Shipping Calculation
-            subtotal_after_discount = original_total - total_discount
-            if subtotal_after_discount >= 75:
-                pricing['shipping'] = 0
-                pricing['free_shipping_eligible'] = True
-                pricing['recommendations'].append({
-                    'type': 'shipping',
-                    'message': 'Congratulations! You qualify for free shipping.'
-                })
-            else:
-                pricing['shipping'] = 10
-                needed_for_free_shipping = 75 - subtotal_after_discount
-                pricing['recommendations'].append({
-                    'type': 'shipping',
-                    'message': f'Add ${needed_for_free_shipping:.2f} more for free shipping!'
-                })
-            
-            # Limited Time Offers
-            current_hour = datetime.now().hour
-            if 14 <= current_hour <= 16:  # 2 PM - 4 PM
-                flash_discount = original_total * 0.05
-                total_discount += flash_discount
-                pricing['discounts'].append({
-                    'type': 'flash',
-                    'name': 'Flash Sale',
-                    'amount': flash_discount,
-                    'description': '5% off - Limited time offer (2 PM - 4 PM)'
-                })
-            
-            pricing['final_total'] = max(0, original_total - total_discount + pricing['shipping'])
-            pricing['savings'] = total_discount
-            
-            return pricing
+            flags = get_user_flags(user_id) if user_id else None
+            return self.pricing_engine.price(cart_items, flags)
             
         except Exception as e:
             print(f"Error calculating dynamic pricing: {e}")
@@ -282,11 +396,24 @@ class CartAI:
                 'recommendations': []
             }
     
-    def get_smart_behaviors(self, cart_items, user_id=None):
+    def quote_dynamic_pricing(self, cart_items, user_id=None):
+        """
+        Dynamic pricing under a signed quote, reused while the quote is live
+        
+        Returns:
+            calculate_dynamic_pricing's result plus 'quote_id' and 'quote_expires_at'
+        """
+        return quote_pricing(cart_items, user_id, self.calculate_dynamic_pricing)
+    
+    def get_smart_behaviors(self, cart_items, user_id=None, context=None):
         """
         Generate smart cart behaviors and recommendations
+        
+        Stock and price alerts come from the installed inventory provider, so
+        the same cart gets the same behaviors until its signals change.
         """
         try:
+            context = context or CartContext(cart_items, user_id)
             behaviors = {
                 'size_recommendations': [],
                 'stock_alerts': [],
@@ -311,26 +438,34 @@ class CartAI:
                         'reason': 'Based on your previous orders, size M fits you best'
                     })
             
-            # Stock Alerts (mock - simulate low stock)
+            # Stock and price signals for every cart product in one bulk read
+            signals = get_inventory_signals(context.cart_ids)
+            
+            # Stock Alerts
             for item in cart_items:
-                stock_level = random.randint(1, 15)  # Mock stock level
-                if stock_level <= 3:
+                stock_level = signals.get(cart_product_id(item), {}).get('stock_level')
+                if stock_level is not None and stock_level <= LOW_STOCK_THRESHOLD:
                     behaviors['stock_alerts'].append({
                         'product_id': item.get('id'),
                         'product_name': item.get('name'),
                         'stock_level': stock_level,
                         'urgency': 'high' if stock_level <= 1 else 'medium',
-                        'message': f'Only {stock_level} left in stock!'
+                        'message': f'Only {stock_level} left in stock!' if stock_level > 0 else 'This item is out of stock'
                     })
             
-            # Price Alerts (mock - simulate price changes)
+            # Price Alerts (current catalog price below the price the item was added at)
             for item in cart_items:
-                if random.random() < 0.3:  # 30% chance of price drop
-                    price_drop = round(random.uniform(2, 10), 2)
+                current_price = signals.get(cart_product_id(item), {}).get('price')
+                try:
+                    price_drop = round(float(item.get('price')) - current_price, 2)
+                except (TypeError, ValueError):
+                    continue
+                if price_drop > 0:
                     behaviors['price_alerts'].append({
                         'product_id': item.get('id'),
                         'product_name': item.get('name'),
                         'price_drop': price_drop,
+                        'current_price': current_price,
                         'message': f'Great news! This item dropped ${price_drop} since you added it'
                     })
             
@@ -373,6 +508,7 @@ class CartAI:
             
         except Exception as e:
             print(f"Error getting smart behaviors: {e}")
+            report_error(context, e)
             return {
                 'size_recommendations': [],
                 'stock_alerts': [],
@@ -381,11 +517,12 @@ class CartAI:
                 'urgency_indicators': []
             }
     
-    def predict_purchase_behavior(self, cart_items, user_id=None):
+    def predict_purchase_behavior(self, cart_items, user_id=None, context=None):
         """
         Predict purchase behavior and likelihood
         """
         try:
+            context = context or CartContext(cart_items, user_id)
             predictions = {
                 'completion_probability': 0.5,
                 'abandonment_risk': 'medium',
@@ -427,11 +564,11 @@ class CartAI:
                 predictions['abandonment_risk'] = 'high'
             
             # Next Likely Purchases (based on current cart)
-            for item in cart_items[:2]:
+            for item in cart_items[:COMPLEMENTARY_CART_ITEMS]:
                 try:
-                    product = Product.query.get(item.get('id'))
+                    product = context.product(item)
                     if product:
-                        complementary = get_complementary_products(product, limit=2)
+                        complementary = context.complementary(product, limit=2)
                         for comp in complementary:
                             predictions['next_likely_purchases'].append({
                                 'product': comp.to_dict(),
@@ -439,6 +576,7 @@ class CartAI:
                                 'reason': f'Commonly bought after {product.name}'
                             })
                 except Exception as e:
+                    report_error(context, e)
                     continue
             
             # Seasonal Recommendations
@@ -487,6 +625,7 @@ class CartAI:
             
         except Exception as e:
             print(f"Error predicting purchase behavior: {e}")
+            report_error(context, e)
             return {
                 'completion_probability': 0.5,
                 'abandonment_risk': 'medium',
@@ -495,11 +634,12 @@ class CartAI:
                 'intervention_suggestions': []
             }
     
-    def optimize_cart(self, cart_items):
+    def optimize_cart(self, cart_items, context=None):
         """
         Suggest cart optimizations
         """
         try:
+            context = context or CartContext(cart_items)
             optimizations = {
                 'suggested_bundles': [],
                 'better_alternatives': [],
@@ -513,9 +653,9 @@ class CartAI:
             if len(cart_items) == 1:
                 item = cart_items[0]
                 try:
-                    product = Product.query.get(item.get('id'))
+                    product = context.product(item)
                     if product:
-                        complementary = get_complementary_products(product, limit=2)
+                        complementary = context.complementary(product, limit=2)
                         if complementary:
                             bundle_price = item.get('price', 0) + sum(p.price for p in complementary)
                             discount_price = bundle_price * 0.85  # 15% off
@@ -529,6 +669,7 @@ class CartAI:
                             })
                 except Exception as e:
                     print(f"Error creating bundle suggestion: {e}")
+                    report_error(context, e)
             
             # Cost optimizations
             total_value = sum(item.get('price', 0) * item.get('quantity', 1) for item in cart_items)
@@ -545,6 +686,7 @@ class CartAI:
             
         except Exception as e:
             print(f"Error optimizing cart: {e}")
+            report_error(context, e)
             return {
                 'suggested_bundles': [],
                 'better_alternatives': [],
@@ -284,6 +284,36 @@ def extract_features_as_embedding(features_or_image_path):
         traceback.print_exc()
         return np.zeros(512, dtype=np.float32)
 
+def extract_text_embedding(text):
+    """
+    CLIP text-tower embedding for a free-text query, in the same space as the
+    image index
+    
+    Returns:
+        Normalized 512-d float32 array, or None if the model is unavailable
+    """
+    try:
+        model, processor = get_clip_model()
+        if model is None or processor is None:
+            print("Failed to load CLIP model")
+            return None
+        
+        device = next(model.parameters()).device
+        inputs = processor(text=[text], return_tensors="pt", padding=True, truncation=True).to(device)
+        
+        with torch.no_grad():
+            embedding = model.get_text_features(**inputs).cpu().numpy()[0]
+        
+        norm = np.linalg.norm(embedding)
+        if norm > 0:
+            embedding = embedding / norm
+        return embedding.astype(np.float32)
+        
+    except Exception as e:
+        print(f"Error in extract_text_embedding: {e}")
+        traceback.print_exc()
+        return None
+
 def create_text_from_features_with_color_intelligence(features):
     """Create enhanced descriptive text with primary color prioritization"""
     text_parts = []
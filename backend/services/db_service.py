@@ -1,6 +1,139 @@
 from database.models import db, Product, User, UserHistory
+from database.sqlite_tuning import SQLITE_PRAGMAS
+from database.fts import product_fts_exists, create_product_fts_triggers, drop_product_fts_triggers, rebuild_product_fts
+from database.catalog import create_catalog_version_triggers, drop_catalog_version_triggers, bump_catalog_version
+from utils.pagination import KeysetPage
+from sqlalchemy import select, type_coerce
+from sqlalchemy.orm import Bundle
 import pandas as pd
 import json
+import time
+import traceback
+
+# Compared as the stored text so cursors round-trip through JSON; the
+# (user_id, timestamp) index serves both the filter and this order
+HISTORY_SORT_KEYS = [
+    (type_coerce(UserHistory.timestamp, db.String), 'desc'),
+    (UserHistory.id, 'desc')
+]
+
+PRODUCT_COLUMNS = ['name', 'description', 'category', 'subcategory', 'price', 'image_url', 'features']
+
+# features arrives as JSON text and is stored as-is; json_valid() nulls out anything malformed
+INSERT_PRODUCT_SQL = (
+    "INSERT INTO product (name, description, category, subcategory, price, image_url, features) "
+    "VALUES (?1, ?2, ?3, ?4, ?5, ?6, CASE WHEN json_valid(?7) THEN ?7 END)"
+)
+
+def features_json(value):
+    """Return features as JSON object text, unwrapping double-encoded strings from older loads"""
+    if isinstance(value, dict):
+        return json.dumps(value)
+    if not isinstance(value, str):
+        return None
+    if value.startswith('"'):
+        try:
+            return features_json(json.loads(value))
+        except ValueError:
+            return None
+    return value
+
+def column_values(series):
+    """Series as a Python list with NaN replaced by None"""
+    return series.astype(object).where(series.notna(), None).tolist()
+
+def product_rows(chunk):
+    """Convert a DataFrame chunk into executemany parameter tuples, column by column"""
+    chunk = chunk.reindex(columns=PRODUCT_COLUMNS)
+    chunk['price'] = pd.to_numeric(chunk['price'], errors='coerce').fillna(0.0).astype(float)
+    chunk['features'] = chunk['features'].map(features_json, na_action='ignore')
+    
+    return list(zip(*(column_values(chunk[column]) for column in PRODUCT_COLUMNS)))
+
+def restore_product_triggers(connection):
+    """Recreate the FTS and catalog-version triggers after a failed bulk load"""
+    with connection.begin():
+        if product_fts_exists(connection):
+            create_product_fts_triggers(connection)
+            rebuild_product_fts(connection)
+        create_catalog_version_triggers(connection)
+
+def bulk_insert_products(chunks, replace=True):
+    """
+    Insert products with executemany inside a single transaction
+    
+    FTS and catalog-version triggers are dropped for the load and the FTS
+    index is rebuilt once at the end; synchronous is turned off while loading
+    since a failed load is simply re-run.
+    
+    Args:
+        chunks: Iterable of DataFrames with PRODUCT_COLUMNS
+        replace: Delete existing products first
+        
+    Returns:
+        Dict with rows loaded, elapsed seconds and rows per second
+    """
+    start = time.perf_counter()
+    total = 0
+    
+    with db.engine.connect() as connection:
+        connection.exec_driver_sql("PRAGMA synchronous=OFF")
+        connection.commit()
+        
+        try:
+            with connection.begin():
+                drop_product_fts_triggers(connection)
+                drop_catalog_version_triggers(connection)
+                
+                if replace:
+                    connection.execute(Product.__table__.delete())
+                
+                for chunk in chunks:
+                    rows = product_rows(chunk)
+                    if rows:
+                        connection.exec_driver_sql(INSERT_PRODUCT_SQL, rows)
+                        total += len(rows)
+                        elapsed = time.perf_counter() - start
+                        print(f"Inserted {total} products ({total / elapsed:.0f} rows/s)")
+                
+                if product_fts_exists(connection):
+                    create_product_fts_triggers(connection)
+                    rebuild_product_fts(connection)
+                create_catalog_version_triggers(connection)
+                bump_catalog_version(connection)
+        except Exception:
+            # pysqlite runs DDL outside the transaction, so the trigger drops
+            # survive the rollback of the rows; put the triggers back
+            restore_product_triggers(connection)
+            raise
+        else:
+            connection.exec_driver_sql("PRAGMA optimize")
+        finally:
+            connection.exec_driver_sql(f"PRAGMA synchronous={SQLITE_PRAGMAS['synchronous']}")
+            connection.commit()
+    
+    elapsed = time.perf_counter() - start
+    stats = {
+        'rows': total,
+        'seconds': round(elapsed, 3),
+        'rows_per_second': round(total / elapsed) if elapsed > 0 else total
+    }
+    print(f"Loaded {stats['rows']} products in {stats['seconds']}s ({stats['rows_per_second']} rows/s)")
+    return stats
+
+def bulk_load_product_catalog(csv_path, chunk_size=10000, replace=True):
+    """
+    Stream a product CSV into the database in chunks of chunk_size rows
+    
+    Args:
+        csv_path: Path to CSV file
+        chunk_size: Rows read and inserted per executemany call
+        replace: Delete existing products first
+        
+    Returns:
+        Load statistics from bulk_insert_products
+    """
+    return bulk_insert_products(pd.read_csv(csv_path, chunksize=chunk_size), replace=replace)
 
 def load_product_catalog(csv_path):
     """
@@ -10,29 +143,101 @@ def load_product_catalog(csv_path):
         csv_path: Path to CSV file
     """
     try:
-        df = pd.read_csv(csv_path)
-        
-        # Clear existing products
-        Product.query.delete()
-        
-        # Insert new products
-        for _, row in df.iterrows():
-            product = Product(
-                name=row['name'],
-                description=row['description'],
-                category=row['category'],
-                price=float(row['price']),
-                image_url=row['image_url'],
-                features=json.dumps(row['features']) if 'features' in row else None
-            )
-            db.session.add(product)
-        
-        db.session.commit()
-        print(f"Loaded {len(df)} products")
-        
+        return bulk_load_product_catalog(csv_path)
     except Exception as e:
         print(f"Error loading product catalog: {e}")
-        db.session.rollback()
+        traceback.print_exc()
+        return None
+
+def get_products_by_ids(product_ids):
+    """
+    Fetch products with one IN query, preserving the order of product_ids
+    
+    Args:
+        product_ids: List of product IDs (missing IDs are skipped)
+        
+    Returns:
+        List of Product objects
+    """
+    if not product_ids:
+        return []
+    
+    products = {product.id: product for product in Product.query.filter(Product.id.in_(product_ids)).all()}
+    return [products[pid] for pid in product_ids if pid in products]
+
+def history_conditions(user_id, since=None, interaction_types=None):
+    """WHERE clauses for a user's history, optionally after since and limited to interaction types"""
+    conditions = [UserHistory.user_id == user_id]
+    if since is not None:
+        conditions.append(UserHistory.timestamp >= since)
+    if interaction_types:
+        conditions.append(UserHistory.interaction_type.in_(interaction_types))
+    return conditions
+
+def user_history_query(user_id, since=None, interaction_types=None):
+    """
+    History entries joined to their products in one statement
+    
+    Each row is a 'history' bundle with the history fields (id, product_id,
+    interaction_type, timestamp) and the product columns a listing needs
+    (name, category, subcategory, price, image_url). Entries whose product
+    no longer exists are skipped by the join.
+    """
+    history = Bundle(
+        'history',
+        UserHistory.id,
+        UserHistory.product_id,
+        UserHistory.interaction_type,
+        UserHistory.timestamp,
+        Product.name,
+        Product.category,
+        Product.subcategory,
+        Product.price,
+        Product.image_url
+    )
+    return (
+        db.session.query(history)
+        .join(Product, Product.id == UserHistory.product_id)
+        .filter(*history_conditions(user_id, since, interaction_types))
+    )
+
+def get_user_history(user_id, limit=20, cursor=None, since=None, interaction_types=None):
+    """
+    A user's most recent history entries, newest first
+    
+    Args:
+        user_id: User ID
+        limit: Page size
+        cursor: next_cursor of the previous page
+        since: Optional datetime; older entries are excluded
+        interaction_types: Optional list of interaction types to keep
+        
+    Returns:
+        KeysetPage of history rows (see user_history_query)
+    """
+    return KeysetPage(
+        user_history_query(user_id, since, interaction_types),
+        HISTORY_SORT_KEYS,
+        f"history:{user_id}",
+        cursor=cursor,
+        limit=limit
+    )
+
+def serialize_history_entry(entry):
+    """Compact JSON form of a history row"""
+    return {
+        'id': entry.id,
+        'product': {
+            'id': entry.product_id,
+            'name': entry.name,
+            'category': entry.category,
+            'subcategory': entry.subcategory,
+            'price': entry.price,
+            'image_url': entry.image_url
+        },
+        'interaction_type': entry.interaction_type,
+        'timestamp': entry.timestamp.isoformat() if entry.timestamp else None
+    }
 
 def get_user_recommendations(user_id, limit=10):
     """
@@ -50,12 +255,10 @@ def get_user_recommendations(user_id, limit=10):
     if not user:
         return []
     
-    # Get user's interaction history
-    history = UserHistory.query.filter_by(user_id=user_id).all()
-    
-    # Extract viewed and purchased product IDs
-    viewed_products = [h.product_id for h in history if h.interaction_type == 'view']
-    purchased_products = [h.product_id for h in history if h.interaction_type == 'purchase']
+    # Purchased products, as a subquery on the (user_id, timestamp) index
+    purchased_products = select(UserHistory.product_id).where(
+        *history_conditions(user_id, interaction_types=['purchase'])
+    )
     
     # Get user preferences
     preferences = user.preferences or {}
@@ -72,8 +275,7 @@ def get_user_recommendations(user_id, limit=10):
         query = query.filter(Product.price >= min_price, Product.price <= max_price)
     
     # Exclude already purchased products
-    if purchased_products:
-        query = query.filter(~Product.id.in_(purchased_products))
+    query = query.filter(~Product.id.in_(purchased_products))
     
     # Get recommended products
     recommended_products = query.limit(limit).all()
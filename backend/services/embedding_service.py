@@ -1,5 +1,6 @@
 import torch
 import numpy as np
+import pandas as pd
 import os
 import faiss
 from PIL import Image
@@ -8,9 +9,13 @@ from sentence_transformers import SentenceTransformer
 from tqdm import tqdm
 from database.models import db, Product
 
+TEXT_INDEX_PATH = 'data/embeddings/text_faiss_index.bin'
+
 def generate_image_embeddings_clip(products_df, batch_size=8):
     """
     Generate image embeddings using CLIP model (512 dimensions)
+    
+    products_df must be indexed by product ID; the index is saved as product_ids.npy
     """
     print("Generating CLIP image embeddings...")
     
@@ -109,6 +114,8 @@ def generate_image_embeddings_clip(products_df, batch_size=8):
 def generate_text_embeddings_clip(products_df, batch_size=16):
     """
     Generate text embeddings using CLIP model (512 dimensions)
+    
+    products_df must be indexed by product ID; the index is saved as text_product_ids.npy
     """
     print("Generating CLIP text embeddings...")
     
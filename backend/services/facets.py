@@ -0,0 +1,257 @@
+"""
+Facet cache over the product catalog.
+
+The catalog is loaded once per catalog version into column arrays: integer
+codes for category, subcategory, gender, color and price bucket, prices, and
+precomputed masks for the clothing / electronics keyword lists. Filters become
+boolean masks and facet counts are np.bincount over the masked codes, so
+neither /categories nor /filter needs a GROUP BY or LIKE scan per request.
+"""
+import json
+import threading
+import time
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from database.models import db
+from database.catalog import get_catalog_version
+
+FACETS = ('category', 'subcategory', 'gender', 'color', 'price_range')
+
+PRICE_BUCKETS = [0, 25, 50, 75, 100, 150, 200]
+
+CLOTHING_CATEGORY_TERMS = ['clothing', 'fashion', 'apparel', 'mens', 'womens', 'kids']
+ELECTRONICS_TERMS = ['electronics', 'phone', 'computer', 'laptop', 'tablet', 'gadget', 'device']
+
+def price_bucket_labels():
+    labels = [f"{low}-{high}" for low, high in zip(PRICE_BUCKETS, PRICE_BUCKETS[1:])]
+    labels.append(f"{PRICE_BUCKETS[-1]}+")
+    return labels
+
+def parse_features(value):
+    """features as a dict, whether stored as an object or double-encoded JSON text"""
+    while isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return {}
+    return value if isinstance(value, dict) else {}
+
+def contains_any(series, terms):
+    """Vectorized case-insensitive substring match of any term"""
+    mask = np.zeros(len(series), dtype=bool)
+    for term in terms:
+        mask |= series.str.contains(term.lower(), regex=False).to_numpy()
+    return mask
+
+class FacetIndex:
+    def __init__(self, rows, catalog_version=None):
+        frame = pd.DataFrame(rows, columns=['id', 'name', 'description', 'category', 'subcategory', 'price', 'features'])
+        features = frame['features'].map(parse_features)
+        
+        self.catalog_version = catalog_version
+        self.ids = frame['id'].to_numpy(dtype=np.int64)
+        self.prices = pd.to_numeric(frame['price'], errors='coerce').fillna(0.0).to_numpy(dtype=np.float64)
+        
+        self.name = frame['name'].fillna('').str.lower()
+        self.description = frame['description'].fillna('').str.lower()
+        self.category_text = frame['category'].fillna('').str.lower()
+        
+        gender = features.map(lambda f: str(f.get('gender') or '').title() or None)
+        color = features.map(lambda f: str((f.get('colors') or [''])[0] or '').title() or None)
+        
+        self.codes = {}
+        self.labels = {}
+        for facet, values in (('category', frame['category']), ('subcategory', frame['subcategory']),
+                              ('gender', gender), ('color', color)):
+            codes, labels = pd.factorize(values)
+            self.codes[facet] = codes.astype(np.int32)
+            self.labels[facet] = [str(label) for label in labels]
+        
+        self.codes['price_range'] = (np.searchsorted(PRICE_BUCKETS, self.prices, side='right') - 1).clip(0).astype(np.int32)
+        self.labels['price_range'] = price_bucket_labels()
+        
+        # Keyword lists evaluated once per catalog version instead of as LIKE clauses per request
+        self.is_clothing = contains_any(self.category_text, CLOTHING_CATEGORY_TERMS)
+        self.is_electronics = contains_any(self.category_text, ELECTRONICS_TERMS) | contains_any(self.name, ELECTRONICS_TERMS)
+        self.clothing_priority = np.where(
+            self.category_text.str.contains('clothing', regex=False), 1,
+            np.where(self.category_text.str.contains('fashion', regex=False), 2, 3)
+        )
+        self.built_at = time.time()
+    
+    def __len__(self):
+        return len(self.ids)
+    
+    def category_contains(self, terms):
+        """Mask of products whose category contains any term (case-insensitive)"""
+        labels = self.labels['category']
+        matching = [code for code, label in enumerate(labels) if any(term.lower() in label.lower() for term in terms)]
+        return np.isin(self.codes['category'], matching)
+    
+    def facet_value_mask(self, facet, value):
+        """Mask for an exact facet value (case-insensitive)"""
+        labels = [label.lower() for label in self.labels[facet]]
+        if value.lower() not in labels:
+            return np.zeros(len(self), dtype=bool)
+        return self.codes[facet] == labels.index(value.lower())
+    
+    def filter_masks(self, filters):
+        """
+        One boolean mask per active filter
+        
+        Args:
+            filters: Dict with any of category, subcategory, gender, price_range,
+                min_price, max_price, color, style, brand, clothing_only,
+                exclude_electronics
+        
+        Returns:
+            Dict of filter name -> mask
+        """
+        masks = {}
+        
+        if filters.get('category'):
+            masks['category'] = self.category_contains([filters['category']])
+        elif filters.get('clothing_only'):
+            masks['category'] = self.is_clothing
+        
+        if filters.get('exclude_electronics') or filters.get('clothing_only'):
+            masks['exclude_electronics'] = ~self.is_electronics
+        
+        for facet in ('subcategory', 'gender', 'price_range'):
+            if filters.get(facet):
+                masks[facet] = self.facet_value_mask(facet, filters[facet])
+        
+        if filters.get('min_price') is not None or filters.get('max_price') is not None:
+            low = filters.get('min_price')
+            high = filters.get('max_price')
+            mask = np.ones(len(self), dtype=bool)
+            if low is not None:
+                mask &= self.prices >= low
+            if high is not None:
+                mask &= self.prices <= high
+            masks['price'] = mask
+        
+        # Free-text filters match name or description, like the SQL ILIKE filters did
+        for field in ('color', 'style'):
+            if filters.get(field):
+                term = filters[field].lower()
+                masks[field] = (
+                    self.name.str.contains(term, regex=False).to_numpy()
+                    | self.description.str.contains(term, regex=False).to_numpy()
+                )
+        
+        if filters.get('brand'):
+            masks['brand'] = self.name.str.contains(filters['brand'].lower(), regex=False).to_numpy()
+        
+        return masks
+    
+    @staticmethod
+    def combine(masks, length, skip=()):
+        mask = np.ones(length, dtype=bool)
+        for name, filter_mask in masks.items():
+            if name not in skip:
+                mask &= filter_mask
+        return mask
+    
+    def counts(self, facet, mask=None):
+        """List of {'value', 'count'} for a facet under a mask, most common first"""
+        codes = self.codes[facet] if mask is None else self.codes[facet][mask]
+        counts = np.bincount(codes[codes >= 0], minlength=len(self.labels[facet]))
+        order = np.argsort(-counts, kind='stable')
+        if facet == 'price_range':
+            order = np.arange(len(counts))
+        return [
+            {'value': self.labels[facet][code], 'count': int(counts[code])}
+            for code in order if counts[code] > 0
+        ]
+    
+    def facet_counts(self, filters):
+        """
+        Counts for every facet conditioned on the current filters
+        
+        Each facet is counted with every filter except its own, so the counts
+        show what selecting another value of that facet would return.
+        """
+        masks = self.filter_masks(filters)
+        own_filters = {
+            'category': ('category',),
+            'subcategory': ('subcategory',),
+            'gender': ('gender',),
+            'color': ('color',),
+            'price_range': ('price_range', 'price')
+        }
+        return {
+            facet: self.counts(facet, self.combine(masks, len(self), skip=own_filters[facet]))
+            for facet in FACETS
+        }
+    
+    def sort_columns(self, filters):
+        """
+        Sort-key columns for /filter, primary first: clothing priority when
+        clothing_only, then price ascending, then id so the order is total
+        """
+        columns = [self.prices, self.ids]
+        if filters.get('clothing_only'):
+            columns.insert(0, self.clothing_priority)
+        return columns
+    
+    def filter_ids(self, filters, limit=20, after=None):
+        """
+        Product IDs matching the filters, ordered like /filter
+        
+        Args:
+            filters: Same dict as filter_masks
+            limit: Page size
+            after: Optional sort-key values of the last row of the previous page
+        
+        Returns:
+            (ids, total_matches, next_after) where next_after is None on the last page
+        """
+        mask = self.combine(self.filter_masks(filters), len(self))
+        total = int(mask.sum())
+        columns = self.sort_columns(filters)
+        
+        if after is not None:
+            # Rows strictly after the cursor: first key greater, or equal and the next key greater, ...
+            beyond = np.zeros(len(self), dtype=bool)
+            equal = np.ones(len(self), dtype=bool)
+            for column, value in zip(columns, after):
+                beyond |= equal & (column > value)
+                equal &= column == value
+            mask &= beyond
+        
+        positions = np.flatnonzero(mask)
+        # lexsort treats its last key as the primary one
+        order = np.lexsort(tuple(column[positions] for column in reversed(columns)))
+        page = positions[order[:limit]]
+        
+        next_after = None
+        if len(order) > limit and len(page):
+            next_after = [column[page[-1]].item() for column in columns]
+        return [int(pid) for pid in self.ids[page]], total, next_after
+
+_facet_index = None
+_build_lock = threading.Lock()
+
+def build_facet_index():
+    version = get_catalog_version(force=True)
+    rows = db.session.execute(text(
+        "SELECT id, name, description, category, subcategory, price, features FROM product"
+    )).fetchall()
+    index = FacetIndex(rows, catalog_version=version)
+    print(f"Facet index built for {len(index)} products (catalog version {version})")
+    return index
+
+def get_facet_index():
+    """Shared facet index, rebuilt whenever the catalog version changes"""
+    global _facet_index
+    
+    index = _facet_index
+    if index is not None and index.catalog_version == get_catalog_version():
+        return index
+    
+    with _build_lock:
+        if _facet_index is index:
+            _facet_index = build_facet_index()
+        return _facet_index
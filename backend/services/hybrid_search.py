@@ -0,0 +1,161 @@
+"""
+Hybrid lexical + vector product search.
+
+Lexical candidates come from the FTS5 inverted index (BM25, any query term),
+vector candidates from the CLIP text embedding of the query searched against
+the image FAISS index, so "navy formal top" can find products named "Blue
+Shirt". The two ranked lists are fused with reciprocal-rank fusion.
+
+The vector stage runs on a worker thread while the lexical stage runs in the
+request; if it misses the latency budget the lexical list is served alone
+(the encoding keeps running and lands in the cache for the next request).
+"""
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from functools import lru_cache
+import numpy as np
+from sqlalchemy import text
+from database.fts import PRODUCT_FTS_TABLE
+from database.models import db
+from services.search_index import fts_available, tokenize_query, quote_fts_term, FTS_COLUMN_WEIGHTS
+
+# Standard RRF constant; larger values flatten the contribution of top ranks
+RRF_K = 60
+
+# Candidates taken from each list before fusion
+HYBRID_CANDIDATES = 100
+
+# Total time allowed for candidate retrieval
+HYBRID_BUDGET_MS = 300
+
+TEXT_EMBEDDING_CACHE_SIZE = 1024
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='hybrid-search')
+
+@lru_cache(maxsize=TEXT_EMBEDDING_CACHE_SIZE)
+def encode_query(query):
+    """
+    Cached CLIP text embedding of a cleaned query
+
+    Raises instead of returning None so failures are not cached.
+    """
+    from services.clip_model import extract_text_embedding
+
+    embedding = extract_text_embedding(query)
+    if embedding is None:
+        raise RuntimeError("CLIP text encoder unavailable")
+    embedding.setflags(write=False)
+    return embedding
+
+def vector_candidates(query, limit=HYBRID_CANDIDATES):
+    """
+    Product IDs nearest to the query's text embedding in the image index
+
+    Returns:
+        (ids, timings) with encode_ms and ann_ms
+    """
+    from services.vector_search import load_faiss_index
+
+    start = time.perf_counter()
+    embedding = encode_query(query)
+    encoded = time.perf_counter()
+
+    index, product_ids = load_faiss_index('image')
+    if index is None:
+        raise RuntimeError("Image FAISS index unavailable")
+
+    _, indices = index.search(np.array(embedding, dtype=np.float32).reshape(1, -1), min(limit, index.ntotal))
+    ids = [int(product_ids[i]) for i in indices[0] if 0 <= i < len(product_ids)]
+
+    return ids, {
+        'encode_ms': round((encoded - start) * 1000, 2),
+        'ann_ms': round((time.perf_counter() - encoded) * 1000, 2)
+    }
+
+def lexical_candidates(query, limit=HYBRID_CANDIDATES):
+    """
+    Product IDs matching any query term in the FTS index, best BM25 first
+
+    Any-term matching favours recall; rows hitting more terms still rank first.
+    """
+    terms = tokenize_query(query)
+    if not terms or not fts_available():
+        return []
+
+    rows = db.session.execute(text(f"""
+        SELECT rowid FROM {PRODUCT_FTS_TABLE}
+        WHERE {PRODUCT_FTS_TABLE} MATCH :match
+        ORDER BY bm25({PRODUCT_FTS_TABLE}, {', '.join(str(w) for w in FTS_COLUMN_WEIGHTS)})
+        LIMIT :limit
+    """), {'match': ' OR '.join(quote_fts_term(term) for term in terms), 'limit': limit}).fetchall()
+    return [row[0] for row in rows]
+
+def reciprocal_rank_fusion(ranked_lists, k=RRF_K):
+    """
+    Fuse ranked ID lists: score(d) = sum over lists of 1 / (k + rank)
+
+    Args:
+        ranked_lists: Dict of source name -> list of IDs, best first
+
+    Returns:
+        List of (id, score, {source: rank}) sorted by score, best first
+    """
+    scores = {}
+    ranks = {}
+    for source, ids in ranked_lists.items():
+        for rank, item_id in enumerate(ids, start=1):
+            scores[item_id] = scores.get(item_id, 0.0) + 1.0 / (k + rank)
+            ranks.setdefault(item_id, {})[source] = rank
+
+    fused = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    return [(item_id, score, ranks[item_id]) for item_id, score in fused]
+
+def hybrid_search(query, limit=HYBRID_CANDIDATES, budget_ms=HYBRID_BUDGET_MS):
+    """
+    Fused lexical + vector candidates for a cleaned query
+
+    Args:
+        query: Cleaned search text
+        limit: Candidates per source
+        budget_ms: Time allowed for retrieval; the vector list is dropped if
+            it is not ready by then
+
+    Returns:
+        Dict with 'results' (list of (id, score, ranks)), 'timings' and
+        'degraded' (sources that were skipped, with the reason)
+    """
+    start = time.perf_counter()
+    timings = {}
+    degraded = {}
+    ranked_lists = {}
+
+    vector_future = _executor.submit(vector_candidates, query, limit)
+
+    lexical_start = time.perf_counter()
+    try:
+        ranked_lists['lexical'] = lexical_candidates(query, limit)
+    except Exception as e:
+        print(f"Lexical candidates failed: {e}")
+        traceback.print_exc()
+        degraded['lexical'] = str(e)
+    timings['lexical_ms'] = round((time.perf_counter() - lexical_start) * 1000, 2)
+
+    remaining = budget_ms / 1000 - (time.perf_counter() - start)
+    try:
+        ranked_lists['vector'], vector_timings = vector_future.result(timeout=max(remaining, 0))
+        timings.update(vector_timings)
+    except TimeoutError:
+        print(f"Vector candidates missed the {budget_ms}ms budget; serving lexical results")
+        degraded['vector'] = 'timeout'
+    except Exception as e:
+        print(f"Vector candidates failed: {e}")
+        degraded['vector'] = str(e)
+    timings['retrieval_ms'] = round((time.perf_counter() - start) * 1000, 2)
+
+    fusion_start = time.perf_counter()
+    results = reciprocal_rank_fusion(ranked_lists)
+    timings['fusion_ms'] = round((time.perf_counter() - fusion_start) * 1000, 2)
+    timings['candidates'] = {source: len(ids) for source, ids in ranked_lists.items()}
+
+    return {'results': results, 'timings': timings, 'degraded': degraded}
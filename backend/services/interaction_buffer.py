@@ -0,0 +1,231 @@
+"""
+Write-behind buffer for UserHistory interaction logging.
+
+Requests append interaction events to an in-process queue and return
+immediately; a background thread drains the queue and writes each batch as a
+single multi-row INSERT once INTERACTION_FLUSH_MS have passed since the first
+buffered event or INTERACTION_BATCH_SIZE events are waiting, whichever comes
+first. One short write transaction per batch replaces one per request.
+A batch the database rejects as busy (lock contention with other writers)
+is retried with exponential backoff before its rows are counted as failed.
+
+Written events are passed on to the popularity counters and the pricing
+eligibility cache (the ORM commit hooks never see these rows). Remaining events are flushed at interpreter exit.
+"""
+import atexit
+import datetime
+import queue
+import threading
+import time
+import traceback
+from collections import Counter
+from sqlalchemy import insert
+from sqlalchemy.exc import OperationalError
+from database.models import db, UserHistory
+from services.popularity import record_interaction, start_popularity_flusher
+from services.pricing import invalidate_user_flags
+
+INTERACTION_FLUSH_MS = 500
+INTERACTION_BATCH_SIZE = 200
+
+# Events beyond this are dropped rather than growing memory without bound
+INTERACTION_QUEUE_SIZE = 10000
+
+# How long a request waits for room in a full queue before dropping its event
+ENQUEUE_TIMEOUT_SECONDS = 0.05
+
+# Retries for a batch the database rejects as busy/locked, doubling the delay each time
+INTERACTION_WRITE_RETRIES = 4
+INTERACTION_RETRY_BACKOFF_SECONDS = 0.1
+
+class InteractionBuffer:
+    def __init__(self, flush_ms=INTERACTION_FLUSH_MS, batch_size=INTERACTION_BATCH_SIZE, max_size=INTERACTION_QUEUE_SIZE):
+        self.flush_seconds = flush_ms / 1000
+        self.batch_size = batch_size
+        self.queue = queue.Queue(maxsize=max_size)
+        self.engine = None
+        self.thread = None
+        self.stopping = threading.Event()
+        self.write_lock = threading.Lock()
+        self.start_lock = threading.Lock()
+        self.counts = Counter()
+        self.max_depth = 0
+        self.last_flush_ms = None
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+    
+    def start(self, engine):
+        """Start the flusher thread (once) writing through engine"""
+        with self.start_lock:
+            self.engine = engine
+            if self.thread is None or not self.thread.is_alive():
+                self.stopping.clear()
+                self.thread = threading.Thread(target=self.run, name='interaction-flusher', daemon=True)
+                self.thread.start()
+    
+    def put(self, event):
+        try:
+            self.queue.put(event, timeout=ENQUEUE_TIMEOUT_SECONDS)
+        except queue.Full:
+            self.counts['dropped'] += 1
+            print(f"Interaction buffer full; dropped {event['interaction_type']} for user {event['user_id']}")
+            return False
+        
+        self.counts['enqueued'] += 1
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+        return True
+    
+    def next_batch(self):
+        """Block for the first event, then collect until the batch is full or the flush interval ends"""
+        try:
+            batch = [self.queue.get(timeout=self.flush_seconds)]
+        except queue.Empty:
+            return []
+        
+        deadline = time.monotonic() + self.flush_seconds
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+    
+    def drain(self):
+        """Everything currently queued, without waiting"""
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                return batch
+    
+    def insert_rows(self, rows):
+        """One multi-row INSERT, retried with backoff while the database is busy"""
+        for attempt in range(INTERACTION_WRITE_RETRIES + 1):
+            try:
+                with self.engine.begin() as connection:
+                    connection.execute(insert(UserHistory.__table__).values(rows))
+                return
+            except OperationalError as e:
+                if attempt == INTERACTION_WRITE_RETRIES:
+                    raise
+                delay = INTERACTION_RETRY_BACKOFF_SECONDS * 2 ** attempt
+                self.counts['retried'] += 1
+                print(f"Retrying {len(rows)} buffered interactions in {delay:.2f}s: {e}")
+                time.sleep(delay)
+    
+    def write(self, batch):
+        """Insert a batch in multi-row statements and update popularity"""
+        if not batch or self.engine is None:
+            return 0
+        
+        start = time.perf_counter()
+        written = []
+        with self.write_lock:
+            for offset in range(0, len(batch), self.batch_size):
+                rows = batch[offset:offset + self.batch_size]
+                try:
+                    self.insert_rows(rows)
+                except Exception as e:
+                    # Only rows that still fail after the retries are lost
+                    self.counts['failed'] += len(rows)
+                    print(f"Error writing {len(rows)} buffered interactions: {e}")
+                    traceback.print_exc()
+                    continue
+                written.extend(rows)
+        
+        if not written:
+            return 0
+        
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self.counts['flushed'] += len(written)
+        self.counts['batches'] += 1
+        self.last_flush_ms = round(elapsed_ms, 2)
+        self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+        self.total_flush_ms += elapsed_ms
+        
+        try:
+            for event in written:
+                record_interaction(event['product_id'], event['interaction_type'], event['timestamp'])
+            start_popularity_flusher(self.engine)
+        except Exception as e:
+            print(f"Error recording popularity for buffered interactions: {e}")
+        invalidate_user_flags({event['user_id'] for event in written})
+        return len(written)
+    
+    def run(self):
+        while not self.stopping.is_set():
+            self.write(self.next_batch())
+    
+    def flush(self):
+        """Write everything queued so far from the calling thread"""
+        return self.write(self.drain())
+    
+    def stop(self, timeout=5.0):
+        """Stop the flusher and write whatever is left"""
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+        return self.flush()
+    
+    def metrics(self):
+        batches = self.counts['batches']
+        return {
+            'queue_depth': self.queue.qsize(),
+            'max_queue_depth': self.max_depth,
+            'enqueued': self.counts['enqueued'],
+            'flushed': self.counts['flushed'],
+            'retried': self.counts['retried'],
+            'failed': self.counts['failed'],
+            'dropped': self.counts['dropped'],
+            'batches': batches,
+            'avg_batch_size': round(self.counts['flushed'] / batches, 1) if batches else None,
+            'last_flush_ms': self.last_flush_ms,
+            'avg_flush_ms': round(self.total_flush_ms / batches, 2) if batches else None,
+            'max_flush_ms': round(self.max_flush_ms, 2),
+            'flusher_running': self.thread is not None and self.thread.is_alive()
+        }
+
+_buffer = InteractionBuffer()
+
+def log_interaction(user_id, product_id, interaction_type, timestamp=None):
+    """
+    Queue a UserHistory row for the background flusher
+    
+    Must be called inside an app context (the first call binds the flusher to
+    the app's engine).
+    
+    Returns:
+        True if the event was queued, False if the buffer was full
+    """
+    if _buffer.thread is None or not _buffer.thread.is_alive():
+        _buffer.start(db.engine)
+    
+    return _buffer.put({
+        'user_id': user_id,
+        'product_id': product_id,
+        'interaction_type': interaction_type,
+        'timestamp': timestamp or datetime.datetime.utcnow()
+    })
+
+def flush_interactions():
+    """Synchronously write all queued interactions"""
+    return _buffer.flush()
+
+def interaction_buffer_metrics():
+    return _buffer.metrics()
+
+@atexit.register
+def _flush_on_exit():
+    if _buffer.engine is None:
+        return
+    try:
+        written = _buffer.stop()
+        if written:
+            print(f"Flushed {written} buffered interactions on shutdown")
+    except Exception as e:
+        print(f"Error flushing interactions on shutdown: {e}")
+        traceback.print_exc()
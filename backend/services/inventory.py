@@ -0,0 +1,140 @@
+"""
+Stock and price signals for cart products.
+
+Cart behaviors read inventory through a provider with one bulk call,
+get_many(product_ids). The bundled TableInventoryProvider reads stock levels
+from the product_inventory table and current prices from product, in a single
+joined query. CachedInventoryProvider wraps any provider with a per-product
+TTL cache, so repeated polls of the same cart are served from memory and only
+uncached IDs reach the backing store.
+
+To plug in a real inventory system, implement get_many and install it with
+set_inventory_provider().
+"""
+import threading
+import traceback
+from cachetools import TTLCache
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert
+from database.models import db, Product, ProductInventory
+
+INVENTORY_CACHE_SIZE = 10000
+INVENTORY_CACHE_TTL = 60
+
+class InventoryProvider:
+    """Interface for stock and price signal sources"""
+
+    def get_many(self, product_ids):
+        """
+        Signals for a batch of products
+        
+        Args:
+            product_ids: Integer product IDs
+        
+        Returns:
+            Dict of product ID to {'stock_level', 'price'}; either value is
+            None when unknown, and unknown products are omitted
+        """
+        raise NotImplementedError
+
+class TableInventoryProvider(InventoryProvider):
+    """Stock levels from product_inventory, prices from the catalog"""
+
+    def get_many(self, product_ids):
+        if not product_ids:
+            return {}
+        
+        query = (
+            select(Product.id, Product.price, ProductInventory.stock_level)
+            .outerjoin(ProductInventory, ProductInventory.product_id == Product.id)
+            .where(Product.id.in_(product_ids))
+        )
+        return {
+            row.id: {'stock_level': row.stock_level, 'price': row.price}
+            for row in db.session.execute(query)
+        }
+
+class CachedInventoryProvider(InventoryProvider):
+    """Per-product TTL cache in front of another provider"""
+
+    def __init__(self, provider, ttl=INVENTORY_CACHE_TTL, maxsize=INVENTORY_CACHE_SIZE):
+        self.provider = provider
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.lock = threading.Lock()
+    
+    def get_many(self, product_ids):
+        signals = {}
+        missing = []
+        with self.lock:
+            for product_id in dict.fromkeys(product_ids):
+                cached = self.cache.get(product_id)
+                if cached is not None:
+                    signals[product_id] = cached
+                else:
+                    missing.append(product_id)
+        
+        if missing:
+            fetched = self.provider.get_many(missing)
+            with self.lock:
+                for product_id in missing:
+                    # Unknown products are cached too, so they are not re-read on every poll
+                    self.cache[product_id] = fetched.get(product_id, {})
+            signals.update(fetched)
+        
+        return {product_id: signal for product_id, signal in signals.items() if signal}
+    
+    def invalidate(self, product_ids=None):
+        with self.lock:
+            if product_ids is None:
+                self.cache.clear()
+                return
+            for product_id in product_ids:
+                self.cache.pop(product_id, None)
+
+_provider = CachedInventoryProvider(TableInventoryProvider())
+
+def get_inventory_provider():
+    return _provider
+
+def set_inventory_provider(provider, ttl=INVENTORY_CACHE_TTL):
+    """Replace the inventory source (wrapped in the TTL cache unless ttl is None)"""
+    global _provider
+    _provider = provider if ttl is None else CachedInventoryProvider(provider, ttl=ttl)
+
+def get_inventory_signals(product_ids):
+    """
+    Signals for a batch of products from the installed provider
+    
+    Returns:
+        Dict of product ID to {'stock_level', 'price'}, empty if the provider fails
+    """
+    try:
+        return get_inventory_provider().get_many(product_ids)
+    except Exception as e:
+        print(f"Error reading inventory signals: {e}")
+        traceback.print_exc()
+        return {}
+
+def update_stock_levels(levels):
+    """
+    Upsert stock levels into product_inventory and drop them from the cache
+    
+    Args:
+        levels: Dict of product ID to units in stock
+    """
+    if not levels:
+        return
+    
+    statement = insert(ProductInventory.__table__)
+    statement = statement.on_conflict_do_update(
+        index_elements=['product_id'],
+        set_={'stock_level': statement.excluded.stock_level, 'updated_at': statement.excluded.updated_at}
+    )
+    db.session.execute(statement, [
+        {'product_id': product_id, 'stock_level': stock_level}
+        for product_id, stock_level in levels.items()
+    ])
+    db.session.commit()
+    
+    if isinstance(_provider, CachedInventoryProvider):
+        _provider.invalidate(levels.keys())
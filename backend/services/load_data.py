@@ -3,163 +3,199 @@ import sys
 import pandas as pd
 import json
 import requests
-from tqdm import tqdm
 from PIL import Image
 from io import BytesIO
 import time
 from datasets import load_dataset
 import gc
 import numpy as np
+import traceback
 
 # Add parent directory to path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from app import app
 from database.models import db, Product
+from services.db_service import bulk_insert_products, bulk_load_product_catalog
 
-def download_fashion_dataset():
+DATASET_NAME = "ashraq/fashion-product-images-small"
+PROCESSED_FILE = 'data/processed/fashion_products_processed.csv'
+CHECKPOINT_FILE = 'data/processed/ingest_checkpoint.json'
+
+PROCESSED_COLUMNS = ['name', 'description', 'category', 'subcategory', 'price', 'image_url', 'local_image_path', 'features']
+
+def stream_fashion_dataset(skip=0):
     """
-    Download the fashion-product-images-small dataset from Hugging Face
+    Iterate the fashion-product-images-small dataset from Hugging Face in streaming mode
+    
+    Args:
+        skip: Number of leading rows to skip (rows already ingested)
     """
-    print("Downloading fashion-product-images-small dataset...")
+    print(f"Streaming {DATASET_NAME} dataset (skipping {skip} rows)...")
+    dataset = load_dataset(DATASET_NAME, split='train', streaming=True)
+    if skip:
+        dataset = dataset.skip(skip)
+    return dataset
+
+def load_checkpoint():
+    """Read ingest progress, or a fresh checkpoint if none exists"""
+    if os.path.exists(CHECKPOINT_FILE):
+        with open(CHECKPOINT_FILE) as f:
+            return json.load(f)
+    return {'rows_seen': 0, 'rows_written': 0, 'csv_bytes': 0, 'complete': False}
+
+def save_checkpoint(checkpoint):
+    """Write the checkpoint atomically so a crash never leaves it half-written"""
+    tmp_path = CHECKPOINT_FILE + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, CHECKPOINT_FILE)
+
+def process_fashion_example(row):
+    """
+    Save one dataset row's image and build its processed product record
     
-    try:
-        # Load dataset from Hugging Face
-        dataset = load_dataset("ashraq/fashion-product-images-small")
-        
-        # Convert to pandas DataFrame
-        df = pd.DataFrame(dataset['train'])
+    Returns:
+        Product dict, or None if the row has no image
+    """
+    img = row.get('image')
+    if img is None:
+        return None
+    
+    img_path = f'static/images/fashion_{row["id"]}.jpg'
+    
+    # Images already written by an interrupted run are reused
+    if not os.path.exists(img_path):
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
         
-        # Save to CSV
-        os.makedirs('data/raw', exist_ok=True)
-        df.to_csv('data/raw/fashion_products.csv', index=False)
+        # Resize large images to save space and memory
+        if img.size[0] > 800 or img.size[1] > 800:
+            img.thumbnail((800, 800), Image.Resampling.LANCZOS)
         
-        print(f"Downloaded {len(df)} fashion products")
-        return df
-    except Exception as e:
-        print(f"Error downloading fashion dataset: {e}")
-        return None
+        img.save(img_path, 'JPEG', quality=85, optimize=True)
+    
+    year = row.get('year')
+    return {
+        'name': row['productDisplayName'],
+        'description': f"{row['gender']} {row['articleType']} in {row['baseColour']} for {row['usage']}",
+        'category': row['masterCategory'],
+        'subcategory': row['subCategory'],
+        'price': float(50 + (row['id'] % 100)),  # Generate a fake price
+        'image_url': f"/static/images/fashion_{row['id']}.jpg",  # Web-accessible path
+        'local_image_path': img_path,
+        'features': json.dumps({
+            'main_category': str(row['masterCategory']).lower(),
+            'subcategory': str(row['subCategory']).lower(),
+            'colors': [str(row['baseColour']).lower()],
+            'patterns': [],
+            'style': [str(row['usage']).lower()],
+            'material': '',
+            'brand': '',
+            'gender': str(row['gender']).lower(),
+            'article_type': str(row['articleType']).lower(),
+            'season': str(row['season']).lower(),
+            'year': int(year) if year is not None and not pd.isna(year) else 2020
+        })
+    }
 
-def process_fashion_dataset(df):
-    """
-    Process fashion dataset and prepare for database
+def append_processed_chunk(products, checkpoint, rows_seen):
+    """Append a chunk to the processed CSV, then advance the checkpoint past it"""
+    write_header = checkpoint['csv_bytes'] == 0
+    
+    with open(PROCESSED_FILE, 'a', newline='') as f:
+        if products:
+            pd.DataFrame(products, columns=PROCESSED_COLUMNS).to_csv(f, header=write_header, index=False)
+        f.flush()
+        os.fsync(f.fileno())
+        csv_bytes = f.tell()
+    
+    checkpoint['rows_seen'] = rows_seen
+    checkpoint['rows_written'] += len(products)
+    checkpoint['csv_bytes'] = csv_bytes
+    save_checkpoint(checkpoint)
+
+def ingest_fashion_dataset(chunk_size=500, limit=None, dataset=None):
     """
-    print("Processing fashion dataset...")
+    Stream the dataset into the processed CSV with constant memory, resuming
+    from the last checkpoint
+    
+    Rows are processed chunk_size at a time: images are written as they are
+    seen and each chunk is appended to the CSV before the checkpoint moves.
+    Anything written after the last checkpoint (an interrupted chunk) is
+    truncated away on resume, so rows are never duplicated.
     
-    # Create directories for images - make sure this is in the public/static directory
-    # that your web server can access
+    Args:
+        chunk_size: Rows per CSV append / checkpoint
+        limit: Optional maximum number of dataset rows to ingest in total
+        dataset: Optional iterable of rows (defaults to the streamed HF dataset)
+        
+    Returns:
+        The final checkpoint dict
+    """
     os.makedirs('static/images', exist_ok=True)
+    os.makedirs('data/processed', exist_ok=True)
     
-    # Process each product
-    processed_data = []
-    for idx, row in tqdm(df.iterrows(), total=len(df), desc="Processing products"):
-        try:
-            # Extract image and save locally
-            if 'image' in row and row['image'] is not None:
-                img = row['image']
-                img_path = f'static/images/fashion_{row["id"]}.jpg'
-                
-                # Convert and resize image to reduce memory usage
-                if img.mode != 'RGB':
-                    img = img.convert('RGB')
-                
-                # Resize large images to save space and memory
-                if img.size[0] > 800 or img.size[1] > 800:
-                    img.thumbnail((800, 800), Image.Resampling.LANCZOS)
-                
-                img.save(img_path, 'JPEG', quality=85, optimize=True)
-                
-                # Use a web-accessible path for the image_url
-                image_url = f"/static/images/fashion_{row['id']}.jpg"
-                
-                # Create product entry
-                product = {
-                    'name': row['productDisplayName'],
-                    'description': f"{row['gender']} {row['articleType']} in {row['baseColour']} for {row['usage']}",
-                    'category': row['masterCategory'],
-                    'subcategory': row['subCategory'],
-                    'price': float(50 + (row['id'] % 100)),  # Generate a fake price
-                    'image_url': image_url,  # Use web-accessible path
-                    'local_image_path': img_path,
-                    'features': json.dumps({
-                        'main_category': str(row['masterCategory']).lower(),
-                        'subcategory': str(row['subCategory']).lower(),
-                        'colors': [str(row['baseColour']).lower()],
-                        'patterns': [],
-                        'style': [str(row['usage']).lower()],
-                        'material': '',
-                        'brand': '',
-                        'gender': str(row['gender']).lower(),
-                        'article_type': str(row['articleType']).lower(),
-                        'season': str(row['season']).lower(),
-                        'year': int(row['year']) if not pd.isna(row['year']) else 2020
-                    })
-                }
-                
-                processed_data.append(product)
-                
-                # Process only a subset to keep it manageable for testing
-                if len(processed_data) >= 500:  # Reduced from 1000 to 500
-                    print(f"Processed {len(processed_data)} products (limiting for stability)")
-                    break
-                    
-        except Exception as e:
-            print(f"Error processing product {idx}: {e}")
-            continue
+    checkpoint = load_checkpoint()
+    if checkpoint.get('complete'):
+        print(f"Dataset already ingested ({checkpoint['rows_written']} products)")
+        return checkpoint
     
-    # Convert to DataFrame
-    processed_df = pd.DataFrame(processed_data)
+    # Drop any partial chunk written after the last checkpoint
+    if os.path.exists(PROCESSED_FILE):
+        with open(PROCESSED_FILE, 'r+') as f:
+            f.truncate(checkpoint['csv_bytes'])
     
-    # Save processed data
-    os.makedirs('data/processed', exist_ok=True)
-    processed_df.to_csv('data/processed/fashion_products_processed.csv', index=False)
+    rows_seen = checkpoint['rows_seen']
+    if rows_seen:
+        print(f"Resuming ingest at row {rows_seen} ({checkpoint['rows_written']} products written)")
+    
+    if dataset is None:
+        dataset = stream_fashion_dataset(skip=rows_seen)
+    
+    products = []
+    start = time.time()
+    start_row = rows_seen
+    
+    for row in dataset:
+        if limit is not None and rows_seen >= limit:
+            break
+        rows_seen += 1
+        
+        try:
+            product = process_fashion_example(row)
+            if product is not None:
+                products.append(product)
+        except Exception as e:
+            print(f"Error processing product {row.get('id', rows_seen)}: {e}")
+        
+        if rows_seen % chunk_size == 0:
+            append_processed_chunk(products, checkpoint, rows_seen)
+            products = []
+            rate = (rows_seen - start_row) / max(time.time() - start, 1e-9)
+            print(f"Ingested {rows_seen} rows, {checkpoint['rows_written']} products ({rate:.0f} rows/s)")
+    else:
+        checkpoint['complete'] = True
     
-    print(f"Processed {len(processed_df)} fashion products")
-    return processed_df
+    append_processed_chunk(products, checkpoint, rows_seen)
+    print(f"Processed {checkpoint['rows_written']} fashion products from {rows_seen} rows")
+    return checkpoint
 
-def load_products_to_database(processed_df):
+def load_products_to_database(processed_df, chunk_size=10000):
     """
-    Load products to database safely
+    Load products to database with a single bulk transaction
     """
     print("Loading products to database...")
     
     try:
-        # Clear existing products
-        Product.query.delete()
-        db.session.commit()
-        print("Cleared existing products")
+        chunks = (processed_df.iloc[i:i + chunk_size] for i in range(0, len(processed_df), chunk_size))
+        stats = bulk_insert_products(chunks, replace=True)
         
-        # Insert new products in batches
-        batch_size = 50
-        for i in range(0, len(processed_df), batch_size):
-            batch = processed_df.iloc[i:i+batch_size]
-            
-            for _, row in batch.iterrows():
-                product = Product(
-                    name=row['name'],
-                    description=row['description'],
-                    category=row['category'],
-                    price=row['price'],
-                    image_url=row['image_url'],
-                    features=row['features']
-                )
-                
-                # Add local image path if available
-                if 'local_image_path' in row and pd.notna(row['local_image_path']):
-                    product.local_image_path = row['local_image_path']
-                
-                db.session.add(product)
-            
-            # Commit each batch
-            db.session.commit()
-            print(f"Loaded batch {i//batch_size + 1}/{(len(processed_df)-1)//batch_size + 1}")
-        
-        print(f"Successfully loaded {len(processed_df)} products to database")
+        print(f"Successfully loaded {stats['rows']} products to database ({stats['rows_per_second']} rows/s)")
         return True
         
     except Exception as e:
         print(f"Error loading products to database: {e}")
-        db.session.rollback()
         return False
 
 def generate_embeddings_safely(processed_df):
@@ -170,7 +206,7 @@ def generate_embeddings_safely(processed_df):
     
     try:
         # Import the updated embedding service
-        from services.embedding_service import generate_image_embeddings_clip, create_faiss_index
+        from services.embedding_service import generate_image_embeddings_clip, generate_text_embeddings_clip, create_faiss_index, TEXT_INDEX_PATH
         
         # Generate image embeddings with very small batch size to avoid memory issues
         print("Generating CLIP image embeddings...")
@@ -225,12 +261,29 @@ def generate_embeddings_safely(processed_df):
                 distances, indices = index.search(test_query, 5)
                 print(f"✅ Index test successful: {len(indices[0])} results found")
                 
+                # Precompute visual neighbours for related/similar product lookups
+                from services.neighbors import build_neighbor_matrix, NEIGHBORS_PATH
+                neighbors = build_neighbor_matrix(embeddings, index=index)
+                np.save(NEIGHBORS_PATH, neighbors)
+                print(f"✅ Saved {neighbors.shape[1]} visual neighbours per product")
+                
             except Exception as e:
                 print(f"❌ Error creating FAISS index: {e}")
                 import traceback
                 traceback.print_exc()
         else:
             print("❌ No image embeddings generated")
+        
+        # Product-text embeddings + index, searched by text queries (index_type='text' / 'fused')
+        print("Generating CLIP text embeddings...")
+        text_embeddings, text_product_ids = generate_text_embeddings_clip(processed_df)
+        gc.collect()
+        
+        if text_embeddings is not None and len(text_embeddings) > 0:
+            if create_faiss_index(text_embeddings, TEXT_INDEX_PATH) is not None:
+                print(f"✅ Successfully created text FAISS index with {len(text_embeddings)} vectors")
+        else:
+            print("❌ No text embeddings generated")
     
     except Exception as e:
         print(f"❌ Error in embedding generation: {e}")
@@ -243,37 +296,39 @@ def main():
     """
     print("=== Fashion Product Data Loading Script ===")
     
-    # Check if processed data already exists
-    processed_file = 'data/processed/fashion_products_processed.csv'
-    
-    if os.path.exists(processed_file):
-        print(f"Found existing processed data at {processed_file}")
-        processed_df = pd.read_csv(processed_file)
-        print(f"Loaded {len(processed_df)} products from existing file")
+    if os.path.exists(PROCESSED_FILE) and not os.path.exists(CHECKPOINT_FILE):
+        # Processed file from an older (non-streaming) run
+        print(f"Found existing processed data at {PROCESSED_FILE}")
     else:
-        # Download and process fashion dataset
-        fashion_df = download_fashion_dataset()
-        
-        if fashion_df is not None:
-            # Process fashion dataset
-            processed_df = process_fashion_dataset(fashion_df)
-        else:
-            print("Failed to download fashion dataset.")
+        try:
+            ingest_fashion_dataset()
+        except Exception as e:
+            print(f"Error ingesting fashion dataset: {e}")
+            traceback.print_exc()
+            print("Progress is checkpointed; re-run to resume.")
             return
     
     # Work with Flask app context
     with app.app_context():
-        if processed_df is not None and not processed_df.empty:
-            # Load products to database
-            success = load_products_to_database(processed_df)
-            
-            if success:
-                # Generate embeddings with better error handling
-                generate_embeddings_safely(processed_df)
-            else:
-                print("Failed to load products to database, skipping embedding generation")
-        else:
+        try:
+            stats = bulk_load_product_catalog(PROCESSED_FILE)
+        except Exception as e:
+            print(f"Failed to load products to database, skipping embedding generation: {e}")
+            return
+        
+        if stats['rows'] == 0:
             print("No processed data available")
+            return
+        
+        # Embeddings need the image paths and product text, indexed by the product
+        # IDs the rows were stored under (the load inserts them in file order)
+        processed_df = pd.read_csv(PROCESSED_FILE, usecols=['local_image_path', 'name', 'category', 'description'])
+        product_ids = [product_id for (product_id,) in db.session.query(Product.id).order_by(Product.id)]
+        if len(product_ids) != len(processed_df):
+            print(f"Loaded {len(product_ids)} products for {len(processed_df)} processed rows; skipping embedding generation")
+            return
+        processed_df.index = product_ids
+        generate_embeddings_safely(processed_df)
 
 if __name__ == '__main__':
     # Set environment variables to potentially help with stability
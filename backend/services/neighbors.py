@@ -0,0 +1,186 @@
+"""
+Precomputed visual nearest neighbours.
+
+An offline FAISS self-search over the image embeddings stores, for every row
+of product_ids.npy, the row positions of its top-K most similar products as an
+int32 matrix (-1 padded). Serving "related" / "more like this" is then a
+single array lookup.
+
+Usage (from backend/): python -m services.neighbors [k]
+"""
+import os
+import sys
+import time
+import traceback
+import numpy as np
+import faiss
+
+EMBEDDINGS_DIR = 'data/embeddings'
+IMAGE_INDEX_PATH = os.path.join(EMBEDDINGS_DIR, 'faiss_index.bin')
+IMAGE_EMBEDDINGS_PATH = os.path.join(EMBEDDINGS_DIR, 'image_embeddings.npy')
+PRODUCT_IDS_PATH = os.path.join(EMBEDDINGS_DIR, 'product_ids.npy')
+NEIGHBORS_PATH = os.path.join(EMBEDDINGS_DIR, 'neighbors.npy')
+
+DEFAULT_NEIGHBORS = 20
+
+# Global state for the loaded neighbour matrix
+_neighbors = None
+_neighbor_product_ids = None
+_sorted_ids = None
+_sorted_rows = None
+_loaded_mtime = None
+
+def build_neighbor_matrix(embeddings, k=DEFAULT_NEIGHBORS, index=None, batch_size=4096):
+    """
+    Top-k neighbours of every embedding row via batched FAISS self-search
+    
+    Args:
+        embeddings: (n, d) array of image embeddings
+        k: Neighbours to keep per row
+        index: Optional FAISS index over the same rows (a flat IP index is built otherwise)
+        batch_size: Query rows per search call
+    
+    Returns:
+        (n, k) int32 array of row positions, -1 where fewer than k neighbours exist
+    """
+    embeddings = np.array(embeddings, dtype=np.float32, order='C')  # copy: normalized in place below
+    faiss.normalize_L2(embeddings)
+    n = embeddings.shape[0]
+    
+    if index is None or index.ntotal != n:
+        index = faiss.IndexFlatIP(embeddings.shape[1])
+        index.add(embeddings)
+    
+    neighbors = np.full((n, k), -1, dtype=np.int32)
+    search_k = min(k + 1, n)
+    
+    for start in range(0, n, batch_size):
+        stop = min(start + batch_size, n)
+        _, indices = index.search(embeddings[start:stop], search_k)
+        
+        rows = np.arange(start, stop)[:, None]
+        # Drop the query row itself (usually, but not always, the first hit)
+        indices = np.where(indices == rows, -1, indices)
+        for offset, row_indices in enumerate(indices):
+            row_indices = row_indices[row_indices >= 0][:k]
+            neighbors[start + offset, :len(row_indices)] = row_indices
+    
+    return neighbors
+
+def precompute_neighbors(k=DEFAULT_NEIGHBORS):
+    """
+    Build and save neighbors.npy from the stored image embeddings and index
+    
+    Returns:
+        The neighbour matrix, or None if embeddings are missing
+    """
+    if not os.path.exists(IMAGE_EMBEDDINGS_PATH) or not os.path.exists(PRODUCT_IDS_PATH):
+        print("Image embeddings not found. Please run load_data.py first.")
+        return None
+    
+    start = time.time()
+    embeddings = np.load(IMAGE_EMBEDDINGS_PATH)
+    product_ids = np.load(PRODUCT_IDS_PATH)
+    if len(embeddings) != len(product_ids):
+        print(f"Embeddings ({len(embeddings)}) and product ids ({len(product_ids)}) are not aligned")
+        return None
+    
+    index = faiss.read_index(IMAGE_INDEX_PATH) if os.path.exists(IMAGE_INDEX_PATH) else None
+    neighbors = build_neighbor_matrix(embeddings, k=k, index=index)
+    
+    # Write atomically so a serving process never maps a half-written file
+    tmp_path = NEIGHBORS_PATH + '.tmp.npy'
+    np.save(tmp_path, neighbors)
+    os.replace(tmp_path, NEIGHBORS_PATH)
+    
+    print(f"Saved {neighbors.shape[0]}x{neighbors.shape[1]} neighbour matrix in {time.time() - start:.1f}s")
+    return neighbors
+
+def load_neighbors():
+    """
+    Load (or reload, if the file changed) the neighbour matrix and its id mapping
+    
+    Returns:
+        (neighbors, product_ids) or (None, None) if unavailable
+    """
+    global _neighbors, _neighbor_product_ids, _sorted_ids, _sorted_rows, _loaded_mtime
+    
+    try:
+        if not os.path.exists(NEIGHBORS_PATH) or not os.path.exists(PRODUCT_IDS_PATH):
+            return None, None
+        
+        mtime = os.path.getmtime(NEIGHBORS_PATH)
+        if _neighbors is None or mtime != _loaded_mtime:
+            neighbors = np.load(NEIGHBORS_PATH, mmap_mode='r')
+            product_ids = np.load(PRODUCT_IDS_PATH).astype(np.int64)
+            if neighbors.shape[0] != len(product_ids):
+                print("neighbors.npy is out of date with product_ids.npy; run python -m services.neighbors")
+                return None, None
+            
+            order = np.argsort(product_ids, kind='stable')
+            _sorted_ids = product_ids[order]
+            _sorted_rows = order
+            _neighbors = neighbors
+            _neighbor_product_ids = product_ids
+            _loaded_mtime = mtime
+            print(f"Loaded neighbour matrix for {len(product_ids)} products")
+        
+        return _neighbors, _neighbor_product_ids
+    
+    except Exception as e:
+        print(f"Error loading neighbour matrix: {e}")
+        traceback.print_exc()
+        return None, None
+
+def get_neighbor_ids(product_id, limit=DEFAULT_NEIGHBORS):
+    """
+    Precomputed visual neighbours of a product, most similar first
+    
+    Returns:
+        List of product IDs (empty if the product or matrix is unavailable)
+    """
+    neighbors, product_ids = load_neighbors()
+    if neighbors is None:
+        return []
+    
+    try:
+        product_id = int(product_id)
+    except (TypeError, ValueError):
+        return []
+    
+    position = np.searchsorted(_sorted_ids, product_id)
+    if position >= len(_sorted_ids) or _sorted_ids[position] != product_id:
+        return []
+    
+    rows = neighbors[_sorted_rows[position]]
+    rows = rows[rows >= 0][:limit]
+    return [int(pid) for pid in product_ids[rows] if pid != product_id]
+
+def get_neighbor_ids_for_many(product_ids, limit=10, exclude=None):
+    """
+    Merge the neighbour lists of several products, interleaving them so each
+    contributes its closest matches first
+    
+    Args:
+        product_ids: Seed product IDs
+        limit: Maximum number of IDs to return
+        exclude: IDs to leave out (the seeds are always excluded)
+    
+    Returns:
+        List of distinct product IDs
+    """
+    excluded = set(exclude or []) | set(product_ids)
+    lists = [get_neighbor_ids(pid) for pid in product_ids if pid is not None]
+    
+    result = []
+    for rank in range(max((len(ids) for ids in lists), default=0)):
+        for ids in lists:
+            if rank < len(ids) and ids[rank] not in excluded:
+                excluded.add(ids[rank])
+                result.append(ids[rank])
+                if len(result) >= limit:
+                    return result
+    return result
+
+if __name__ == '__main__':
+    precompute_neighbors(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_NEIGHBORS)
@@ -5,6 +5,10 @@ import traceback
 import time
 import random
 import re
+import threading
+from collections import namedtuple
+from functools import lru_cache
+import numpy as np
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -27,243 +31,261 @@ def exponential_backoff_delay(attempt):
     delay = min(BASE_DELAY * (2 ** attempt) + random.uniform(0, 1), MAX_DELAY)
     return delay
 
-def extract_price_from_prompt(prompt):
-    """FIXED: Extract price constraints with comprehensive pattern matching"""
-    prompt_lower = prompt.lower()
-    price_constraints = {}
-    
-    print(f"Aurra: Extracting price from prompt: '{prompt_lower}'")
-    
-    # ENHANCED: More comprehensive range patterns - handles "to", "and", "dollars" variations
-    range_patterns = [
-        # Standard range patterns
-        r'between\s*\$?(\d+(?:\.\d+)?)\s*(?:and|to)\s*\$?(\d+(?:\.\d+)?)',
-        r'from\s*\$?(\d+(?:\.\d+)?)\s*(?:and|to)\s*\$?(\d+(?:\.\d+)?)',
-        r'\$?(\d+(?:\.\d+)?)\s*(?:-|to)\s*\$?(\d+(?:\.\d+)?)',
-        r'\$?(\d+(?:\.\d+)?)\s*(?:and|to)\s*\$?(\d+(?:\.\d+)?)',
-        
-        # Dollar word patterns - FIXED to handle "dollars to dollars"
-        r'between\s*(\d+(?:\.\d+)?)\s*dollars?\s*(?:and|to)\s*(\d+(?:\.\d+)?)\s*dollars?',
-        r'from\s*(\d+(?:\.\d+)?)\s*dollars?\s*(?:and|to)\s*(\d+(?:\.\d+)?)\s*dollars?',
-        r'(\d+(?:\.\d+)?)\s*dollars?\s*(?:and|to)\s*(\d+(?:\.\d+)?)\s*dollars?',
-        
-        # More flexible patterns
-        r'price\s*between\s*\$?(\d+(?:\.\d+)?)\s*(?:and|to)\s*\$?(\d+(?:\.\d+)?)',
-        r'price\s*from\s*\$?(\d+(?:\.\d+)?)\s*(?:and|to)\s*\$?(\d+(?:\.\d+)?)',
-        r'cost\s*between\s*\$?(\d+(?:\.\d+)?)\s*(?:and|to)\s*\$?(\d+(?:\.\d+)?)',
-    ]
-    
-    # Enhanced under patterns
-    under_patterns = [
-        r'under\s*\$?(\d+(?:\.\d+)?)',
-        r'below\s*\$?(\d+(?:\.\d+)?)', 
-        r'less\s+than\s*\$?(\d+(?:\.\d+)?)',
-        r'cheaper\s+than\s*\$?(\d+(?:\.\d+)?)',
-        r'maximum\s*\$?(\d+(?:\.\d+)?)',
-        r'max\s*\$?(\d+(?:\.\d+)?)',
-        r'up\s+to\s*\$?(\d+(?:\.\d+)?)',
-        r'within\s*\$?(\d+(?:\.\d+)?)',
-        r'not\s+more\s+than\s*\$?(\d+(?:\.\d+)?)',
-        # Dollar word patterns
-        r'under\s*(\d+(?:\.\d+)?)\s*dollars?',
-        r'below\s*(\d+(?:\.\d+)?)\s*dollars?',
-        r'less\s+than\s*(\d+(?:\.\d+)?)\s*dollars?',
-        r'cheaper\s+than\s*(\d+(?:\.\d+)?)\s*dollars?',
-        r'maximum\s*(\d+(?:\.\d+)?)\s*dollars?',
-        r'max\s*(\d+(?:\.\d+)?)\s*dollars?',
-    ]
-    
-    # Enhanced over patterns  
-    over_patterns = [
-        r'over\s*\$?(\d+(?:\.\d+)?)',
-        r'above\s*\$?(\d+(?:\.\d+)?)',
-        r'more\s+than\s*\$?(\d+(?:\.\d+)?)',
-        r'minimum\s*\$?(\d+(?:\.\d+)?)',
-        r'min\s*\$?(\d+(?:\.\d+)?)',
-        r'at\s+least\s*\$?(\d+(?:\.\d+)?)',
-        r'starting\s+from\s*\$?(\d+(?:\.\d+)?)',
-        r'greater\s+than\s*\$?(\d+(?:\.\d+)?)',
-        # Dollar word patterns
-        r'over\s*(\d+(?:\.\d+)?)\s*dollars?',
-        r'above\s*(\d+(?:\.\d+)?)\s*dollars?',
-        r'more\s+than\s*(\d+(?:\.\d+)?)\s*dollars?',
-        r'minimum\s*(\d+(?:\.\d+)?)\s*dollars?',
-        r'min\s*(\d+(?:\.\d+)?)\s*dollars?',
-        r'at\s+least\s*(\d+(?:\.\d+)?)\s*dollars?',
-        r'starting\s+from\s*(\d+(?:\.\d+)?)\s*dollars?',
-        r'greater\s+than\s*(\d+(?:\.\d+)?)\s*dollars?',
-    ]
-    
-    # Check for "cheaper" or "cheaper options" patterns (but not "cheaper than X")
-    if re.search(r'(cheaper|cheap|budget|affordable|inexpensive)(?!\s+than\s+\$?\d)', prompt_lower):
-        price_constraints['preference'] = 'cheaper'
-        print(f"Aurra: Found 'cheaper' preference")
-    
-    # Check for "expensive" or "premium" patterns  
-    if re.search(r'(expensive|premium|luxury|high.end)', prompt_lower):
-        price_constraints['preference'] = 'expensive'
-        print(f"Aurra: Found 'expensive' preference")
-    
-    # FIXED: Check range patterns first (most specific)
-    range_found = False
-    for pattern in range_patterns:
-        match = re.search(pattern, prompt_lower)
+# Prompt rules are compiled once at import. parse_prompt() runs them and
+# returns a PromptConstraints, memoized because refinement prompts repeat.
+# Products are filtered over a columnar view: prices as a numpy array, and
+# each text column joined into one string so every rule is a single regex scan
+# whose match positions are mapped back to rows.
+
+PROMPT_CACHE_SIZE = 1024
+
+# Text columns a ProductColumns keeps (one per row subset); reused across
+# refinements of a stored result set
+MAX_CACHED_COLUMNS = 16
+
+_PRICE = r'(\d+(?:\.\d+)?)'
+
+# Checked in order; the first range that matches wins, then (only if no range
+# matched) the first max and the first min pattern
+PRICE_RANGE_PATTERNS = [re.compile(pattern.replace('N', _PRICE)) for pattern in [
+    # Standard range patterns
+    r'between\s*\$?N\s*(?:and|to)\s*\$?N',
+    r'from\s*\$?N\s*(?:and|to)\s*\$?N',
+    r'\$?N\s*(?:-|to)\s*\$?N',
+    r'\$?N\s*(?:and|to)\s*\$?N',
+    
+    # Dollar word patterns
+    r'between\s*N\s*dollars?\s*(?:and|to)\s*N\s*dollars?',
+    r'from\s*N\s*dollars?\s*(?:and|to)\s*N\s*dollars?',
+    r'N\s*dollars?\s*(?:and|to)\s*N\s*dollars?',
+    
+    # More flexible patterns
+    r'price\s*between\s*\$?N\s*(?:and|to)\s*\$?N',
+    r'price\s*from\s*\$?N\s*(?:and|to)\s*\$?N',
+    r'cost\s*between\s*\$?N\s*(?:and|to)\s*\$?N',
+]]
+
+MAX_PRICE_PATTERNS = [re.compile(pattern.replace('N', _PRICE)) for pattern in [
+    r'under\s*\$?N',
+    r'below\s*\$?N',
+    r'less\s+than\s*\$?N',
+    r'cheaper\s+than\s*\$?N',
+    r'maximum\s*\$?N',
+    r'max\s*\$?N',
+    r'up\s+to\s*\$?N',
+    r'within\s*\$?N',
+    r'not\s+more\s+than\s*\$?N',
+]]
+
+MIN_PRICE_PATTERNS = [re.compile(pattern.replace('N', _PRICE)) for pattern in [
+    r'over\s*\$?N',
+    r'above\s*\$?N',
+    r'more\s+than\s*\$?N',
+    r'minimum\s*\$?N',
+    r'min\s*\$?N',
+    r'at\s+least\s*\$?N',
+    r'starting\s+from\s*\$?N',
+    r'greater\s+than\s*\$?N',
+]]
+
+# "cheaper options" but not "cheaper than $X"
+CHEAPER_PATTERN = re.compile(r'(cheaper|cheap|budget|affordable|inexpensive)(?!\s+than\s+\$?\d)')
+EXPENSIVE_PATTERN = re.compile(r'(expensive|premium|luxury|high.end)')
+
+# Specific product types, most specific first; the first category with any matching pattern wins
+CATEGORY_PATTERNS = {
+    'tshirt': [r'\bt-?shirts?\b', r'\btees?\b', r'\btshirts?\b', r'only\s+t-?shirts?\b', r'just\s+t-?shirts?\b', r't-?shirts?\s+only\b'],
+    'shirt': [r'\bshirts?\b(?!\s*sleeve)(?!.*t-?shirt)', r'\bblouses?\b', r'\bdress\s+shirts?\b', r'only\s+shirts?\b', r'just\s+shirts?\b', r'shirts?\s+only\b'],
+    'pants': [r'\bpants?\b', r'\btrousers?\b', r'\bjeans?\b', r'\bslacks?\b', r'only\s+pants?\b', r'just\s+pants?\b', r'pants?\s+only\b'],
+    'shorts': [r'\bshorts?\b', r'\bbermudas?\b', r'only\s+shorts?\b', r'just\s+shorts?\b', r'shorts?\s+only\b'],
+    'shoes': [r'\bshoes?\b', r'\bsneakers?\b', r'\bboots?\b', r'\bloafers?\b', r'\bpumps?\b', r'\bheels?\b', r'only\s+shoes?\b', r'just\s+shoes?\b', r'shoes?\s+only\b'],
+    'sandals': [r'\bsandals?\b', r'\bflip\s*flops?\b', r'\bslippers?\b', r'only\s+sandals?\b', r'just\s+sandals?\b', r'sandals?\s+only\b'],
+    'footwear': [r'\bfootwear\b', r'\bfoot\s*wear\b', r'only\s+footwear\b', r'just\s+footwear\b', r'footwear\s+only\b'],
+    'dress': [r'\bdresses?\b', r'\bgowns?\b', r'only\s+dresses?\b', r'just\s+dresses?\b'],
+    'jacket': [r'\bjackets?\b', r'\bcoats?\b', r'\bblazers?\b', r'only\s+jackets?\b', r'just\s+jackets?\b'],
+    'accessories': [r'\baccessories?\b', r'\bbags?\b', r'\bwallet', r'\bbelts?\b', r'\bwatches?\b', r'only\s+accessories?\b', r'just\s+accessories?\b']
+}
+
+BROAD_CLOTHING_PATTERN = re.compile(r'\bclothing\b|\bapparel\b|\bclothes\b|\bwear\b|\boutfit')
+
+COLORS = ['red', 'blue', 'green', 'yellow', 'black', 'white', 'pink', 'purple', 'orange',
+          'brown', 'gray', 'grey', 'navy', 'maroon', 'gold', 'silver', 'beige', 'cream',
+          'turquoise', 'magenta', 'cyan', 'lime', 'olive', 'coral', 'salmon', 'violet',
+          'indigo', 'tan', 'khaki', 'burgundy', 'emerald', 'ruby', 'sapphire']
+
+COLOR_PATTERN = re.compile(r'\b(' + '|'.join(COLORS) + r')\b')
+
+# Informational queries, checked in order
+QUESTION_PATTERNS = [
+    ('count', re.compile(r'how\s+many|count|number\s+of')),
+    ('price_range', re.compile(r'price\s+range|cheapest|most\s+expensive')),
+    ('categories', re.compile(r'what\s+categories|types\s+of|categories'))
+]
+
+# How products are matched to a detected category; categories without rules
+# match on a plain substring of the category, name and description
+CATEGORY_RULES = {
+    'tshirt': {
+        'must_contain': [r'\bt-?shirt\b', r'\btee\b'],
+        'must_not_contain': [r'\bshirt\b(?!.*t-?shirt)'],
+        'category_match': ['apparel', 'clothing']
+    },
+    'shirt': {
+        'must_contain': [r'\bshirt\b'],
+        'must_not_contain': [r'\bt-?shirt\b', r'\btee\b'],
+        'category_match': ['apparel', 'clothing']
+    },
+    'pants': {
+        'must_contain': [r'\btrouser\b', r'\bpant\b', r'\bjean\b'],
+        'must_not_contain': [r'\bshort\b'],
+        'category_match': ['apparel', 'clothing']
+    },
+    'shorts': {
+        'must_contain': [r'\bshort\b'],
+        'must_not_contain': [],
+        'category_match': ['apparel', 'clothing']
+    },
+    'shoes': {
+        'must_contain': [r'\bshoe\b', r'\bsneaker\b', r'\bboot\b', r'\bloafer\b'],
+        'must_not_contain': [r'\bsandal\b', r'\bflip\b', r'\bslipper\b'],
+        'category_match': ['footwear', 'shoes']
+    },
+    'sandals': {
+        'must_contain': [r'\bsandal\b', r'\bflip\b', r'\bslipper\b', r'\bfloater\b'],
+        'must_not_contain': [],
+        'category_match': ['footwear', 'shoes']
+    },
+    'footwear': {
+        'must_contain': [r'\bsandal\b', r'\bshoe\b', r'\bsneaker\b', r'\bboot\b', r'\bflip\b', r'\bslipper\b', r'\bfloater\b'],
+        'must_not_contain': [],
+        'category_match': ['footwear', 'shoes']
+    }
+}
+
+def any_of(patterns):
+    """One compiled alternation of patterns (None if there are none)"""
+    patterns = list(patterns)
+    return re.compile('|'.join(f'(?:{pattern})' for pattern in patterns)) if patterns else None
+
+RulePattern = namedtuple('RulePattern', ['prefilter', 'exact'])
+
+def rule_pattern(patterns):
+    """
+    Product rule compiled for column scans
+    
+    A leading \\b stops re from skipping ahead to a literal, so scanning a
+    whole column with the exact pattern is slow. The prefilter is the same
+    alternation without word boundaries: it matches in every row the exact
+    pattern does (and possibly more), and the exact pattern then only runs on
+    those rows.
+    """
+    patterns = list(patterns)
+    if not patterns:
+        return None
+    exact = any_of(patterns)
+    loose = [pattern.replace(r'\b', '') for pattern in patterns]
+    return RulePattern(any_of(loose) if loose != patterns else exact, exact)
+
+CATEGORY_PROMPT_PATTERNS = [(category, any_of(patterns)) for category, patterns in CATEGORY_PATTERNS.items()]
+
+COMPILED_CATEGORY_RULES = {
+    category: (
+        rule_pattern(rule['must_contain']),
+        rule_pattern(rule['must_not_contain']),
+        rule_pattern(re.escape(term) for term in rule['category_match'])
+    )
+    for category, rule in CATEGORY_RULES.items()
+}
+
+PromptConstraints = namedtuple('PromptConstraints', [
+    'questions', 'min_price', 'max_price', 'preference', 'category', 'colors'
+])
+
+def first_match(patterns, text):
+    for pattern in patterns:
+        match = pattern.search(text)
         if match:
-            min_price = float(match.group(1))
-            max_price = float(match.group(2))
-            price_constraints['min_price'] = min(min_price, max_price)
-            price_constraints['max_price'] = max(min_price, max_price)
-            print(f"Aurra: Found range pattern '{pattern}': ${price_constraints['min_price']:.2f} - ${price_constraints['max_price']:.2f}")
-            range_found = True
-            break
-    
-    # Only check under/over patterns if no range was found
-    if not range_found:
-        for pattern in under_patterns:
-            match = re.search(pattern, prompt_lower)
+            return match
+    return None
+
+@lru_cache(maxsize=PROMPT_CACHE_SIZE)
+def parse_prompt(prompt):
+    """
+    Parse a refinement prompt into structured constraints
+    
+    Returns:
+        PromptConstraints: informational question kinds ('count',
+        'price_range', 'categories'), min/max price, price preference ('cheaper',
+        'expensive' or None), category and colors (tuple, in COLORS order)
+    """
+    text = prompt.lower()
+    
+    questions = tuple(kind for kind, pattern in QUESTION_PATTERNS if pattern.search(text))
+    
+    preference = None
+    if CHEAPER_PATTERN.search(text):
+        preference = 'cheaper'
+    if EXPENSIVE_PATTERN.search(text):
+        preference = 'expensive'
+    
+    # Every price pattern needs a digit
+    min_price = max_price = None
+    if any(char.isdigit() for char in text):
+        match = first_match(PRICE_RANGE_PATTERNS, text)
+        if match:
+            min_price, max_price = sorted((float(match.group(1)), float(match.group(2))))
+        else:
+            match = first_match(MAX_PRICE_PATTERNS, text)
             if match:
-                price_constraints['max_price'] = float(match.group(1))
-                print(f"Aurra: Found max price pattern '{pattern}': ${price_constraints['max_price']:.2f}")
-                break
-        
-        for pattern in over_patterns:
-            match = re.search(pattern, prompt_lower)
+                max_price = float(match.group(1))
+            match = first_match(MIN_PRICE_PATTERNS, text)
             if match:
-                price_constraints['min_price'] = float(match.group(1))
-                print(f"Aurra: Found min price pattern '{pattern}': ${price_constraints['min_price']:.2f}")
-                break
-    
-    print(f"Aurra: Final price constraints: {price_constraints}")
+                min_price = float(match.group(1))
+    
+    category = next((name for name, pattern in CATEGORY_PROMPT_PATTERNS if pattern.search(text)), None)
+    if category is None and BROAD_CLOTHING_PATTERN.search(text):
+        category = 'clothing'
+    
+    found_colors = set(COLOR_PATTERN.findall(text))
+    
+    return PromptConstraints(
+        questions=questions,
+        min_price=min_price,
+        max_price=max_price,
+        preference=preference,
+        category=category,
+        colors=tuple(color for color in COLORS if color in found_colors)
+    )
+
+def price_constraints_of(constraints):
+    """Price part of PromptConstraints in the dict form used in responses"""
+    price_constraints = {}
+    if constraints.preference:
+        price_constraints['preference'] = constraints.preference
+    if constraints.min_price is not None:
+        price_constraints['min_price'] = constraints.min_price
+    if constraints.max_price is not None:
+        price_constraints['max_price'] = constraints.max_price
     return price_constraints
 
+def extract_price_from_prompt(prompt):
+    """Extract price constraints (min_price, max_price, preference)"""
+    return price_constraints_of(parse_prompt(prompt))
+
 def extract_category_from_prompt(prompt):
-    """ENHANCED: Extract category with better combined query handling"""
-    prompt_lower = prompt.lower()
-    
-    print(f"Aurra: Extracting category from prompt: '{prompt_lower}'")
-    
-    # ENHANCED: More specific category patterns with word boundaries and combined query support
-    category_patterns = {
-        # Specific product types (most specific first)
-        'tshirt': [
-            r'\bt-?shirts?\b', 
-            r'\btees?\b', 
-            r'\btshirts?\b',
-            r'only\s+t-?shirts?\b',
-            r'just\s+t-?shirts?\b',
-            r't-?shirts?\s+only\b'
-        ],
-        'shirt': [
-            r'\bshirts?\b(?!\s*sleeve)(?!.*t-?shirt)', 
-            r'\bblouses?\b', 
-            r'\bdress\s+shirts?\b',
-            r'only\s+shirts?\b',
-            r'just\s+shirts?\b',
-            r'shirts?\s+only\b'
-        ],
-        'pants': [
-            r'\bpants?\b', 
-            r'\btrousers?\b', 
-            r'\bjeans?\b', 
-            r'\bslacks?\b',
-            r'only\s+pants?\b',
-            r'just\s+pants?\b',
-            r'pants?\s+only\b'
-        ],
-        'shorts': [
-            r'\bshorts?\b', 
-            r'\bbermudas?\b',
-            r'only\s+shorts?\b',
-            r'just\s+shorts?\b',
-            r'shorts?\s+only\b'
-        ],
-        'shoes': [
-            r'\bshoes?\b', 
-            r'\bsneakers?\b', 
-            r'\bboots?\b', 
-            r'\bloafers?\b', 
-            r'\bpumps?\b', 
-            r'\bheels?\b',
-            r'only\s+shoes?\b',
-            r'just\s+shoes?\b',
-            r'shoes?\s+only\b'
-        ],
-        'sandals': [
-            r'\bsandals?\b', 
-            r'\bflip\s*flops?\b', 
-            r'\bslippers?\b',
-            r'only\s+sandals?\b',
-            r'just\s+sandals?\b',
-            r'sandals?\s+only\b'
-        ],
-        'footwear': [
-            r'\bfootwear\b', 
-            r'\bfoot\s*wear\b',
-            r'only\s+footwear\b',
-            r'just\s+footwear\b',
-            r'footwear\s+only\b'
-        ],
-        'dress': [
-            r'\bdresses?\b', 
-            r'\bgowns?\b',
-            r'only\s+dresses?\b',
-            r'just\s+dresses?\b'
-        ],
-        'jacket': [
-            r'\bjackets?\b', 
-            r'\bcoats?\b', 
-            r'\bblazers?\b',
-            r'only\s+jackets?\b',
-            r'just\s+jackets?\b'
-        ],
-        'accessories': [
-            r'\baccessories?\b', 
-            r'\bbags?\b', 
-            r'\bwallet', 
-            r'\bbelts?\b', 
-            r'\bwatches?\b',
-            r'only\s+accessories?\b',
-            r'just\s+accessories?\b'
-        ]
-    }
-    
-    # Check for specific product types first (most specific)
-    for category, patterns in category_patterns.items():
-        for pattern in patterns:
-            if re.search(pattern, prompt_lower):
-                print(f"Aurra: Detected specific category '{category}' from pattern '{pattern}'")
-                return category
-    
-    # If no specific match, check for broader category hints
-    if re.search(r'\bclothing\b|\bapparel\b|\bclothes\b|\bwear\b|\boutfit', prompt_lower):
-        print(f"Aurra: Detected broad category 'clothing'")
-        return 'clothing'
-    
-    print(f"Aurra: No category detected")
-    return None
+    """Extract the most specific category mentioned, or None"""
+    return parse_prompt(prompt).category
 
 def extract_color_from_prompt(prompt):
     """Extract color preferences from user prompt"""
-    prompt_lower = prompt.lower()
-    
-    colors = ['red', 'blue', 'green', 'yellow', 'black', 'white', 'pink', 'purple', 'orange', 
-             'brown', 'gray', 'grey', 'navy', 'maroon', 'gold', 'silver', 'beige', 'cream',
-             'turquoise', 'magenta', 'cyan', 'lime', 'olive', 'coral', 'salmon', 'violet',
-             'indigo', 'tan', 'khaki', 'burgundy', 'emerald', 'ruby', 'sapphire']
-    
-    found_colors = []
-    for color in colors:
-        if re.search(r'\b' + color + r'\b', prompt_lower):
-            found_colors.append(color)
-    
-    return found_colors
+    return list(parse_prompt(prompt).colors)
 
 def handle_question_queries(products, prompt):
     """Handle informational queries about the products"""
-    prompt_lower = prompt.lower()
+    questions = parse_prompt(prompt).questions
     
     # Count queries
-    if re.search(r'how\s+many|count|number\s+of', prompt_lower):
+    if 'count' in questions:
         count = len(products)
         return {
             'type': 'info',
@@ -272,7 +294,7 @@ def handle_question_queries(products, prompt):
         }
     
     # Price range queries
-    if re.search(r'price\s+range|cheapest|most\s+expensive', prompt_lower):
+    if 'price_range' in questions:
         if products:
             prices = [p.get('price', 0) for p in products if p.get('price')]
             if prices:
@@ -286,7 +308,7 @@ def handle_question_queries(products, prompt):
                 }
     
     # Category breakdown
-    if re.search(r'what\s+categories|types\s+of|categories', prompt_lower):
+    if 'categories' in questions:
         categories = {}
         for product in products:
             cat = product.get('category', 'Unknown')
@@ -301,176 +323,133 @@ def handle_question_queries(products, prompt):
     
     return None
 
+class ProductColumns:
+    """
+    Columnar view of a candidate product list
+    
+    Prices are a numpy array. Text columns are lowercased and joined with
+    newlines for the rows still in play, so a rule is one regex scan over the
+    column whose match positions map back to rows (no rule pattern crosses a
+    line).
+    """
+
+    def __init__(self, products):
+        self.products = products
+        self.prices = np.array([float(p.get('price') or 0) for p in products], dtype=np.float64)
+        self._columns = {}
+        self._lock = threading.Lock()
+    
+    def column(self, name, rows):
+        """(values, joined text, row start offsets) of 'category', 'text' or 'name_description' for rows"""
+        key = (name, rows.tobytes())
+        with self._lock:
+            column = self._columns.get(key)
+        if column is not None:
+            return column
+        
+        products = [self.products[row] for row in rows]
+        if name == 'category':
+            values = [f"{p.get('category', '')}".lower() for p in products]
+        elif name == 'text':
+            values = [f"{p.get('category', '')} {p.get('name', '')} {p.get('description', '')}".lower() for p in products]
+        else:
+            values = [f"{p.get('name', '')} {p.get('description', '')}".lower() for p in products]
+        
+        lengths = np.fromiter((len(value) + 1 for value in values), dtype=np.int64, count=len(values))
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        column = (values, '\n'.join(values), starts)
+        # Shared across requests through ResultSet.columns, so another refine may clear the cache at any time
+        with self._lock:
+            if len(self._columns) >= MAX_CACHED_COLUMNS:
+                self._columns.clear()
+            self._columns[key] = column
+        return column
+    
+    def matches(self, name, rule, rows):
+        """Boolean mask (over all products) of the given rows whose column matches a RulePattern"""
+        mask = np.zeros(len(self.products), dtype=bool)
+        if len(rows) == 0:
+            return mask
+        
+        values, joined, starts = self.column(name, rows)
+        positions = [match.start() for match in rule.prefilter.finditer(joined)]
+        if not positions:
+            return mask
+        
+        candidates = np.unique(np.searchsorted(starts, positions, side='right') - 1)
+        if rule.exact is not rule.prefilter:
+            candidates = [i for i in candidates if rule.exact.search(values[i])]
+        mask[rows[candidates]] = True
+        return mask
+
+def category_mask(columns, target_category, rows):
+    """Which of rows match a detected category (see CATEGORY_RULES)"""
+    rule = COMPILED_CATEGORY_RULES.get(target_category)
+    if rule is None:
+        return columns.matches('text', rule_pattern([re.escape(target_category)]), rows)
+    
+    must_contain, must_not_contain, category_match = rule
+    mask = columns.matches('text', must_contain, rows)
+    if must_not_contain is not None:
+        mask &= ~columns.matches('text', must_not_contain, rows)
+    if category_match is not None:
+        mask &= columns.matches('category', category_match, rows)
+    return mask
+
 def match_product_to_category(product, target_category):
-    """ENHANCED: Product matching with better accuracy"""
+    """Whether a single product matches a detected category"""
     if not target_category:
         return True
-    
-    # Get product fields for matching
-    product_category = str(product.get('category', '')).lower()
-    product_name = str(product.get('name', '')).lower()
-    product_desc = str(product.get('description', '')).lower()
-    
-    # Combine all text fields for comprehensive matching
-    product_text = f"{product_category} {product_name} {product_desc}".lower()
-    
-    print(f"Aurra: Matching product '{product.get('name', 'Unknown')[:30]}...' against category '{target_category}'")
-    print(f"Aurra: Product text: '{product_text[:100]}...'")
-    
-    # Enhanced category matching rules
-    category_rules = {
-        'tshirt': {
-            'must_contain': [r'\bt-?shirt\b', r'\btee\b'],
-            'must_not_contain': [r'\bshirt\b(?!.*t-?shirt)'],
-            'category_match': ['apparel', 'clothing'],
-            'description_hints': ['tshirt', 't-shirt', 'tee']
-        },
-        'shirt': {
-            'must_contain': [r'\bshirt\b'],
-            'must_not_contain': [r'\bt-?shirt\b', r'\btee\b'],
-            'category_match': ['apparel', 'clothing'],
-            'description_hints': ['shirt']
-        },
-        'pants': {
-            'must_contain': [r'\btrouser\b', r'\bpant\b', r'\bjean\b'],
-            'must_not_contain': [r'\bshort\b'],
-            'category_match': ['apparel', 'clothing'],
-            'description_hints': ['trouser', 'pant']
-        },
-        'shorts': {
-            'must_contain': [r'\bshort\b'],
-            'must_not_contain': [],
-            'category_match': ['apparel', 'clothing'],
-            'description_hints': ['short']
-        },
-        'shoes': {
-            'must_contain': [r'\bshoe\b', r'\bsneaker\b', r'\bboot\b', r'\bloafer\b'],
-            'must_not_contain': [r'\bsandal\b', r'\bflip\b', r'\bslipper\b'],
-            'category_match': ['footwear', 'shoes'],
-            'description_hints': ['shoe', 'sneaker', 'boot']
-        },
-        'sandals': {
-            'must_contain': [r'\bsandal\b', r'\bflip\b', r'\bslipper\b', r'\bfloater\b'],
-            'must_not_contain': [],
-            'category_match': ['footwear', 'shoes'],
-            'description_hints': ['sandal', 'flip', 'slipper', 'floater']
-        },
-        'footwear': {
-            'must_contain': [r'\bsandal\b', r'\bshoe\b', r'\bsneaker\b', r'\bboot\b', r'\bflip\b', r'\bslipper\b', r'\bfloater\b'],
-            'must_not_contain': [],
-            'category_match': ['footwear', 'shoes'],
-            'description_hints': ['footwear', 'sandal', 'shoe', 'flip', 'slipper']
-        }
-    }
-    
-    # Get rules for target category
-    rules = category_rules.get(target_category, {})
-    
-    if not rules:
-        # Fallback to simple text matching
-        return target_category in product_text
-    
-    # Check must_contain patterns
-    must_contain = rules.get('must_contain', [])
-    contains_required = False
-    for pattern in must_contain:
-        if re.search(pattern, product_text):
-            contains_required = True
-            print(f"Aurra: ✓ Found required pattern '{pattern}' in product")
-            break
-    
-    if must_contain and not contains_required:
-        print(f"Aurra: ✗ Product doesn't contain any required patterns: {must_contain}")
-        return False
-    
-    # Check must_not_contain patterns
-    must_not_contain = rules.get('must_not_contain', [])
-    for pattern in must_not_contain:
-        if re.search(pattern, product_text):
-            print(f"Aurra: ✗ Product contains excluded pattern '{pattern}'")
-            return False
-    
-    # Check category match
-    category_match = rules.get('category_match', [])
-    if category_match:
-        category_matches = any(cat in product_category for cat in category_match)
-        if not category_matches:
-            print(f"Aurra: ✗ Product category '{product_category}' doesn't match required: {category_match}")
-            return False
-    
-    print(f"Aurra: ✓ Product matches category '{target_category}'")
-    return True
+    return bool(category_mask(ProductColumns([product]), target_category, np.arange(1))[0])
 
-def refine_recommendations_advanced(products, prompt):
-    """FIXED: Advanced refinement with perfect price and category filtering"""
+def refine_recommendations_advanced(products, prompt, columns=None):
+    """
+    Rule-based refinement: price, category and color filters parsed from the prompt
+    
+    Args:
+        products: Candidate product dicts
+        prompt: User request
+        columns: ProductColumns for products, reused across calls if given
+    """
     try:
-        print(f"Aurra: Advanced refinement for prompt: '{prompt}' on {len(products)} products")
-        
         # First check if it's an informational query
         info_result = handle_question_queries(products, prompt)
         if info_result:
             return info_result
         
-        # Extract constraints from prompt
-        price_constraints = extract_price_from_prompt(prompt)
-        preferred_category = extract_category_from_prompt(prompt)
-        preferred_colors = extract_color_from_prompt(prompt)
+        constraints = parse_prompt(prompt)
+        price_constraints = price_constraints_of(constraints)
+        preferred_category = constraints.category
+        preferred_colors = constraints.colors
         
-        print(f"Aurra: Price constraints: {price_constraints}")
-        print(f"Aurra: Preferred category: {preferred_category}")
-        print(f"Aurra: Preferred colors: {preferred_colors}")
+        print(f"Aurra: Refining {len(products)} products with constraints {constraints}")
         
-        # Start with full product list
-        refined_products = products.copy()
+        columns = columns if columns is not None else ProductColumns(products)
+        prices = columns.prices
         original_count = len(products)
+        keep = np.ones(original_count, dtype=bool)
         
-        # FIXED: Apply price filtering FIRST with exact constraints
-        if 'min_price' in price_constraints:
-            min_price = price_constraints['min_price']
-            before_count = len(refined_products)
-            refined_products = [p for p in refined_products if p.get('price', 0) >= min_price]
-            print(f"Aurra: Applied min price ${min_price}: {before_count} → {len(refined_products)} products")
-        
-        if 'max_price' in price_constraints:
-            max_price = price_constraints['max_price']
-            before_count = len(refined_products)
-            refined_products = [p for p in refined_products if p.get('price', 0) <= max_price]
-            print(f"Aurra: Applied max price ${max_price}: {before_count} → {len(refined_products)} products")
+        # Apply price filtering FIRST with exact constraints
+        if constraints.min_price is not None:
+            keep &= prices >= constraints.min_price
+        if constraints.max_price is not None:
+            keep &= prices <= constraints.max_price
         
-        # Handle "cheaper options" request
-        if price_constraints.get('preference') == 'cheaper':
-            if products:
-                all_prices = [p.get('price', 0) for p in products if p.get('price', 0) > 0]
-                if all_prices:
-                    median_price = sorted(all_prices)[len(all_prices) // 3]  # Lower third
-                    before_count = len(refined_products)
-                    refined_products = [p for p in refined_products if p.get('price', 0) <= median_price]
-                    print(f"Aurra: Applied cheaper filter (under ${median_price:.2f}): {before_count} → {len(refined_products)} products")
-        
-        # Handle "expensive/premium" request
-        elif price_constraints.get('preference') == 'expensive':
-            if products:
-                all_prices = [p.get('price', 0) for p in products if p.get('price', 0) > 0]
-                if all_prices:
-                    high_price = sorted(all_prices)[len(all_prices) * 2 // 3]  # Upper third
-                    before_count = len(refined_products)
-                    refined_products = [p for p in refined_products if p.get('price', 0) >= high_price]
-                    print(f"Aurra: Applied expensive filter (over ${high_price:.2f}): {before_count} → {len(refined_products)} products")
+        # "cheaper" keeps the lower third of all prices, "expensive" the upper third
+        positive_prices = prices[prices > 0]
+        if constraints.preference and len(positive_prices):
+            if constraints.preference == 'cheaper':
+                rank = len(positive_prices) // 3
+                keep &= prices <= np.partition(positive_prices, rank)[rank]
+            else:
+                rank = len(positive_prices) * 2 // 3
+                keep &= prices >= np.partition(positive_prices, rank)[rank]
         
         # Apply category filtering AFTER price filtering
         if preferred_category:
-            print(f"Aurra: Applying category filter '{preferred_category}'...")
-            before_count = len(refined_products)
-            category_filtered = []
-            
-            for product in refined_products:
-                if match_product_to_category(product, preferred_category):
-                    category_filtered.append(product)
+            keep &= category_mask(columns, preferred_category, np.flatnonzero(keep))
             
-            refined_products = category_filtered
-            print(f"Aurra: Applied category filter '{preferred_category}': {before_count} → {len(refined_products)} products")
-            
-            if len(refined_products) == 0:
+            if not keep.any():
                 print(f"Aurra: ✗ No products found for category '{preferred_category}' with current price constraints")
                 return {
                     'type': 'filtered',
@@ -478,33 +457,23 @@ def refine_recommendations_advanced(products, prompt):
                     'products': []
                 }
         
-        # Apply color filtering
+        # Apply color filtering (only if some products have the color)
         if preferred_colors:
-            color_filtered = []
-            for product in refined_products:
-                product_name = str(product.get('name', '')).lower()
-                product_desc = str(product.get('description', '')).lower()
-                
-                for color in preferred_colors:
-                    if color in product_name or color in product_desc:
-                        color_filtered.append(product)
-                        break
-            
-            if color_filtered:
-                before_count = len(refined_products)
-                refined_products = color_filtered
-                print(f"Aurra: Applied color filter {preferred_colors}: {before_count} → {len(refined_products)} products")
+            color_pattern = rule_pattern(re.escape(color) for color in preferred_colors)
+            color_keep = columns.matches('name_description', color_pattern, np.flatnonzero(keep))
+            if color_keep.any():
+                keep = color_keep
         
-        # Sort by price if needed
-        if price_constraints.get('preference') == 'cheaper' or 'max_price' in price_constraints:
-            refined_products.sort(key=lambda x: x.get('price', 0))  # Cheapest first
-        elif price_constraints.get('preference') == 'expensive' or 'min_price' in price_constraints:
-            refined_products.sort(key=lambda x: x.get('price', 0), reverse=True)  # Most expensive first
+        rows = np.flatnonzero(keep)
         
-        # Limit results but keep more for better selection
-        refined_products = refined_products[:20]  # Increased limit
+        # Sort by price if needed (stable, so ties keep their order)
+        if constraints.preference == 'cheaper' or 'max_price' in price_constraints:
+            rows = rows[np.argsort(prices[rows], kind='stable')]  # Cheapest first
+        elif constraints.preference == 'expensive' or 'min_price' in price_constraints:
+            rows = rows[np.argsort(-prices[rows], kind='stable')]  # Most expensive first
         
-        print(f"Aurra: Final refined products: {len(refined_products)} from original {original_count}")
+        # Limit results but keep more for better selection
+        refined_products = [products[row] for row in rows[:20]]
         
         # Generate appropriate response with detailed feedback
         if len(refined_products) == 0:
@@ -563,7 +532,7 @@ def refine_recommendations_advanced(products, prompt):
                 'response': f"All {original_count} products already match your criteria!",
                 'products': refined_products
             }
-        
+    
     except Exception as e:
         print(f"Aurra: Error in advanced refinement: {e}")
         traceback.print_exc()
@@ -600,7 +569,7 @@ def make_openrouter_request(data, max_retries=MAX_RETRIES):
             else:
                 print(f"Aurra: OpenRouter API error: {response.status_code} - {response.text}")
                 return None
-                    
+        
         except Exception as e:
             print(f"Aurra: Request error: {e}")
             if attempt < max_retries:
@@ -612,13 +581,13 @@ def make_openrouter_request(data, max_retries=MAX_RETRIES):
     
     return None
 
-def refine_recommendations(products, prompt):
-    """Main refinement function with enhanced AI fallback"""
+def refine_recommendations(products, prompt, columns=None):
+    """Main refinement function with enhanced AI fallback (columns: see refine_recommendations_advanced)"""
     try:
         print(f"Aurra: Refining {len(products)} products with prompt: '{prompt}'")
         
         # Always try advanced rule-based refinement first
-        result = refine_recommendations_advanced(products, prompt)
+        result = refine_recommendations_advanced(products, prompt, columns)
         
         # If it's an info query or successful filtering, return immediately
         if result['type'] in ['info', 'filtered']:
@@ -655,7 +624,7 @@ Response:"""
                     "max_tokens": 500,
                     "temperature": 0.1
                 }
-
+                
                 response_data = make_openrouter_request(data, max_retries=1)
                 
                 if response_data:
@@ -674,13 +643,13 @@ Response:"""
                                 'response': f"I found {len(ai_refined)} products that match your request!",
                                 'products': ai_refined
                             }
-                            
+            
             except Exception as e:
                 print(f"Aurra: AI enhancement failed: {e}")
         
         # Return the rule-based result
         return result
-        
+    
     except Exception as e:
         print(f"Aurra: Error in refine_recommendations: {e}")
         traceback.print_exc()
@@ -0,0 +1,358 @@
+"""
+Precompiled complementary-outfit graph.
+
+Every product is classified once per catalog version by the outfit rules
+(top, bottom, dress, shoes, accessory, jewelry, or general item by name
+keywords), its gender context and the colors in its name. Products with the
+same classification share a signature, and for each signature and outfit
+slot (bottoms, shoes, accessories...) the ranked complementary candidates are
+computed once with vectorized masks over the facet index:
+- gender compatibility: men's items for men, women's items for women,
+  anything for unisex / kids;
+- color compatibility: names sharing a color or carrying a neutral, kept in a
+  separate list so lookups can mix matches with variety.
+
+Everything is stored as flat int32 arrays with offsets, so complementary
+products for a product are an O(1) lookup plus a few slices. The graph is
+rebuilt in-process when the catalog version changes; python -m
+services.outfit_graph writes it to disk so workers can load instead of
+building.
+
+Usage (from backend/): python -m services.outfit_graph
+"""
+import os
+import re
+import threading
+import time
+import traceback
+import numpy as np
+from services.facets import get_facet_index, contains_any
+
+OUTFIT_GRAPH_PATH = 'data/outfit_graph.npz'
+
+# Ranked candidates kept per slot list (one extra so the product itself can be skipped)
+SLOT_DEPTH = 24
+
+# (product type, name keywords, slots); the first rule whose keyword is in the name applies.
+# A slot is (slot type, candidate name keywords, weight, name keyword that drops the slot)
+OUTFIT_RULES = [
+    ('top', ['shirt', 't-shirt', 'top', 'blouse', 'polo', 'sweater', 'hoodie', 'jacket'], [
+        ('bottoms', ['jeans', 'pants', 'trousers', 'shorts'], 0.4, None),
+        ('shoes', ['shoes', 'sneakers', 'boots', 'sandals'], 0.3, None),
+        ('accessories', ['bag', 'handbag', 'backpack', 'wallet', 'belt'], 0.2, None),
+        ('outerwear', ['jacket', 'coat', 'blazer'], 0.1, 'jacket')
+    ]),
+    ('bottom', ['jeans', 'pants', 'trousers', 'shorts', 'skirt'], [
+        ('tops', ['shirt', 't-shirt', 'top', 'blouse', 'polo'], 0.4, None),
+        ('shoes', ['shoes', 'sneakers', 'boots', 'sandals'], 0.3, None),
+        ('accessories', ['belt', 'bag', 'handbag', 'wallet'], 0.2, None),
+        ('outerwear', ['jacket', 'coat', 'blazer'], 0.1, None)
+    ]),
+    ('dress', ['dress'], [
+        ('shoes', ['shoes', 'heels', 'sandals', 'boots'], 0.4, None),
+        ('accessories', ['bag', 'handbag', 'purse', 'clutch'], 0.3, None),
+        ('jewelry', ['jewelry', 'necklace', 'earrings', 'bracelet'], 0.2, None),
+        ('outerwear', ['jacket', 'cardigan', 'blazer'], 0.1, None)
+    ]),
+    ('shoes', ['shoes', 'sneakers', 'boots', 'sandals', 'heels'], [
+        ('bottoms', ['jeans', 'pants', 'shorts'], 0.3, None),
+        ('tops', ['shirt', 't-shirt', 'top'], 0.3, None),
+        ('accessories', ['bag', 'backpack', 'belt'], 0.2, None),
+        ('socks', ['socks', 'hosiery'], 0.2, None)
+    ]),
+    ('accessory', ['bag', 'handbag', 'backpack', 'purse', 'wallet', 'belt'], [
+        ('clothing', ['shirt', 't-shirt', 'dress', 'top'], 0.4, None),
+        ('shoes', ['shoes', 'sneakers', 'boots'], 0.3, None),
+        ('accessories', ['jewelry', 'watch', 'sunglasses'], 0.2, None),
+        ('bottoms', ['jeans', 'pants'], 0.1, None)
+    ]),
+    ('jewelry', ['jewelry', 'necklace', 'earrings', 'bracelet', 'ring', 'watch'], [
+        ('dresses', ['dress', 'gown'], 0.3, None),
+        ('tops', ['blouse', 'top', 'shirt'], 0.3, None),
+        ('bags', ['handbag', 'purse', 'clutch'], 0.2, None),
+        ('shoes', ['heels', 'sandals', 'shoes'], 0.2, None)
+    ]),
+    ('general', [], [
+        ('bottoms', ['jeans', 'pants'], 0.3, None),
+        ('shoes', ['shoes', 'sneakers'], 0.3, None),
+        ('accessories', ['bag', 'accessories'], 0.2, None),
+        ('outerwear', ['jacket'], 0.2, None)
+    ])
+]
+
+SLOT_TYPES = sorted({slot[0] for _, _, slots in OUTFIT_RULES for slot in slots})
+
+GENDERS = ['unisex', 'women', 'men', 'kids']
+
+# Gender context of the main product, from its name and description (checked in this order)
+GENDER_CONTEXT_TERMS = [
+    ('women', ['women', 'woman', 'female', 'ladies', 'girl']),
+    ('men', ['men', 'man', 'male', 'guys']),
+    ('kids', ['kids', 'children', 'child', 'teen'])
+]
+
+COLORS = ['black', 'white', 'red', 'blue', 'green', 'yellow', 'pink', 'purple', 'brown', 'gray', 'grey', 'orange', 'navy']
+
+# Colors that go with anything
+NEUTRAL_COLORS = ['black', 'white', 'gray', 'grey']
+
+FALLBACK_EXCLUDED_TERMS = ['infant', 'baby']
+
+def word_pattern(terms):
+    """Whole-word match of any term, so 'men' does not match 'women'"""
+    return r'\b(?:' + '|'.join(re.escape(term) for term in terms) + r')\b'
+
+class OutfitGraph:
+    """Complementary candidates for every product of one catalog version"""
+
+    def __init__(self, arrays, catalog_version=None):
+        self.catalog_version = catalog_version
+        self.product_ids = arrays['product_ids']
+        self.signature_of = arrays['signature_of']
+        self.signature_slots = arrays['signature_slots']
+        self.slot_type = arrays['slot_type']
+        self.slot_weight = arrays['slot_weight']
+        self.matched_offsets = arrays['matched_offsets']
+        self.matched_ids = arrays['matched_ids']
+        self.other_offsets = arrays['other_offsets']
+        self.other_ids = arrays['other_ids']
+        self.fallback_offsets = arrays['fallback_offsets']
+        self.fallback_ids = arrays['fallback_ids']
+        self.product_gender = arrays['product_gender']
+        
+        self.order = np.argsort(self.product_ids, kind='stable')
+        self.sorted_ids = self.product_ids[self.order]
+    
+    @classmethod
+    def build(cls, index):
+        """Classify every product of a FacetIndex and compute each signature's slot lists"""
+        start = time.time()
+        names = index.name
+        context_text = names + ' ' + index.description
+        n = len(index)
+        
+        # Product type: first matching rule, else general
+        rule_of = np.full(n, len(OUTFIT_RULES) - 1, dtype=np.int16)
+        unassigned = np.ones(n, dtype=bool)
+        for rule, (_, keywords, _) in enumerate(OUTFIT_RULES[:-1]):
+            hit = unassigned & contains_any(names, keywords)
+            rule_of[hit] = rule
+            unassigned &= ~hit
+        
+        gender_of = np.zeros(n, dtype=np.int8)
+        unassigned = np.ones(n, dtype=bool)
+        for gender, terms in GENDER_CONTEXT_TERMS:
+            hit = unassigned & contains_any(context_text, terms)
+            gender_of[hit] = GENDERS.index(gender)
+            unassigned &= ~hit
+        
+        color_masks = np.stack([names.str.contains(color, regex=False).to_numpy() for color in COLORS])
+        color_bits = (color_masks.T * (1 << np.arange(len(COLORS)))).sum(axis=1).astype(np.int32)
+        
+        # Slots dropped by a keyword in the product's own name (tops that are jackets)
+        dropping_terms = sorted({slot[3] for _, _, slots in OUTFIT_RULES for slot in slots if slot[3]})
+        drop_bits = np.zeros(n, dtype=np.int32)
+        for bit, term in enumerate(dropping_terms):
+            drop_bits |= names.str.contains(term, regex=False).to_numpy().astype(np.int32) << bit
+        
+        signatures, signature_of = np.unique(
+            np.stack([rule_of, gender_of, color_bits, drop_bits], axis=1), axis=0, return_inverse=True
+        )
+        
+        # Candidate masks shared by every signature
+        men_items = contains_any(names, ['men', 'man', 'male', 'guys']) & ~contains_any(names, ['women', 'female', 'ladies', 'girl'])
+        women_items = contains_any(names, ['women', 'woman', 'female', 'ladies']) & ~names.str.contains(word_pattern(['men', 'male', 'guys'])).to_numpy()
+        gender_ok = {GENDERS.index('men'): men_items, GENDERS.index('women'): women_items}
+        neutral = contains_any(names, NEUTRAL_COLORS)
+        item_masks = {}
+
+        def first(mask):
+            return index.ids[mask][:SLOT_DEPTH].astype(np.int32)
+        
+        signature_slots = [0]
+        slot_type, slot_weight = [], []
+        matched_lists, other_lists = [], []
+        for rule, gender, bits, drops in signatures:
+            _, _, slots = OUTFIT_RULES[rule]
+            colors = [color for bit, color in enumerate(COLORS) if bits & (1 << bit)]
+            for slot_name, items, weight, dropped_by in slots:
+                if dropped_by and drops & (1 << dropping_terms.index(dropped_by)):
+                    continue
+                key = tuple(items)
+                if key not in item_masks:
+                    item_masks[key] = contains_any(names, items)
+                candidates = item_masks[key]
+                if gender in gender_ok:
+                    candidates = candidates & gender_ok[gender]
+                
+                if colors:
+                    color_match = neutral | color_masks[[COLORS.index(color) for color in colors]].any(axis=0)
+                    matched_lists.append(first(candidates & color_match))
+                    other_lists.append(first(candidates & ~color_match))
+                else:
+                    matched_lists.append(first(candidates))
+                    other_lists.append(np.zeros(0, dtype=np.int32))
+                slot_type.append(SLOT_TYPES.index(slot_name))
+                slot_weight.append(weight)
+            signature_slots.append(len(slot_type))
+        
+        # General items per gender when no slot has candidates
+        safe = ~contains_any(names, FALLBACK_EXCLUDED_TERMS)
+        fallback_gender = {
+            GENDERS.index('men'): contains_any(names, ['men', 'male']),
+            GENDERS.index('women'): contains_any(names, ['women', 'female'])
+        }
+        fallback_lists = [first(safe & fallback_gender.get(gender, True)) for gender in range(len(GENDERS))]
+
+        def flatten(lists):
+            offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum([len(ids) for ids in lists])
+            ids = np.concatenate(lists) if lists else np.zeros(0, dtype=np.int32)
+            return offsets, ids.astype(np.int32)
+        
+        matched_offsets, matched_ids = flatten(matched_lists)
+        other_offsets, other_ids = flatten(other_lists)
+        fallback_offsets, fallback_ids = flatten(fallback_lists)
+        
+        graph = cls({
+            'product_ids': index.ids.astype(np.int64),
+            'signature_of': signature_of.ravel().astype(np.int32),
+            'signature_slots': np.array(signature_slots, dtype=np.int32),
+            'slot_type': np.array(slot_type, dtype=np.int8),
+            'slot_weight': np.array(slot_weight, dtype=np.float32),
+            'matched_offsets': matched_offsets,
+            'matched_ids': matched_ids,
+            'other_offsets': other_offsets,
+            'other_ids': other_ids,
+            'fallback_offsets': fallback_offsets,
+            'fallback_ids': fallback_ids,
+            'product_gender': gender_of
+        }, catalog_version=index.catalog_version)
+        print(f"Outfit graph built for {n} products: {len(signatures)} signatures, "
+              f"{len(slot_type)} slots in {time.time() - start:.2f}s")
+        return graph
+    
+    def arrays(self):
+        return {
+            'product_ids': self.product_ids,
+            'signature_of': self.signature_of,
+            'signature_slots': self.signature_slots,
+            'slot_type': self.slot_type,
+            'slot_weight': self.slot_weight,
+            'matched_offsets': self.matched_offsets,
+            'matched_ids': self.matched_ids,
+            'other_offsets': self.other_offsets,
+            'other_ids': self.other_ids,
+            'fallback_offsets': self.fallback_offsets,
+            'fallback_ids': self.fallback_ids,
+            'product_gender': self.product_gender
+        }
+    
+    def position(self, product_id):
+        position = np.searchsorted(self.sorted_ids, product_id)
+        if position >= len(self.sorted_ids) or self.sorted_ids[position] != product_id:
+            return None
+        return self.order[position]
+    
+    def complementary_ids(self, product_id, limit=10):
+        """
+        Complementary product IDs for a product, slot by slot
+        
+        Each slot contributes max(1, limit * weight) items, about half of them
+        color matches and the rest for variety, until limit is reached. General
+        items of the same gender are returned if no slot has candidates.
+        
+        Returns:
+            List of (product_id, slot_type) pairs
+        """
+        try:
+            product_id = int(product_id)
+        except (TypeError, ValueError):
+            return []
+        position = self.position(product_id)
+        if position is None:
+            return []
+        
+        results = []
+        seen = {product_id}
+
+        def take(ids, count, slot):
+            for pid in ids:
+                if count <= 0:
+                    break
+                pid = int(pid)
+                if pid not in seen:
+                    seen.add(pid)
+                    results.append((pid, slot))
+                    count -= 1
+            return count
+        
+        signature = self.signature_of[position]
+        for slot in range(self.signature_slots[signature], self.signature_slots[signature + 1]):
+            wanted = max(1, int(limit * float(self.slot_weight[slot])))
+            slot_name = SLOT_TYPES[self.slot_type[slot]]
+            matched = self.matched_ids[self.matched_offsets[slot]:self.matched_offsets[slot + 1]]
+            other = self.other_ids[self.other_offsets[slot]:self.other_offsets[slot + 1]]
+            
+            remaining = take(matched, (wanted + 1) // 2 if len(other) else wanted, slot_name)
+            remaining = take(other, remaining + wanted // 2 if len(other) else 0, slot_name)
+            take(matched, remaining, slot_name)
+            
+            if len(results) >= limit:
+                break
+        
+        if not results:
+            gender = self.product_gender[position]
+            take(self.fallback_ids[self.fallback_offsets[gender]:self.fallback_offsets[gender + 1]], limit, 'general')
+        
+        return results[:limit]
+
+_graph = None
+_graph_index = None
+_build_lock = threading.Lock()
+
+def save_outfit_graph(graph, path=OUTFIT_GRAPH_PATH):
+    # Write to a temporary file and rename so readers never see a partial file
+    tmp_path = path + '.tmp.npz'
+    np.savez(tmp_path, catalog_version=np.array(graph.catalog_version if graph.catalog_version is not None else -1), **graph.arrays())
+    os.replace(tmp_path, path)
+
+def load_outfit_graph(catalog_version, path=OUTFIT_GRAPH_PATH):
+    """Saved graph if it was built for catalog_version, else None"""
+    try:
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as saved:
+            if int(saved['catalog_version']) != catalog_version:
+                return None
+            arrays = {name: saved[name] for name in saved.files if name != 'catalog_version'}
+        return OutfitGraph(arrays, catalog_version=catalog_version)
+    except Exception as e:
+        print(f"Error loading outfit graph: {e}")
+        traceback.print_exc()
+        return None
+
+def get_outfit_graph():
+    """Shared graph for the current catalog version (loaded from disk or built)"""
+    global _graph, _graph_index
+    
+    index = get_facet_index()
+    if _graph is not None and _graph_index is index:
+        return _graph
+    
+    with _build_lock:
+        if _graph is None or _graph_index is not index:
+            graph = load_outfit_graph(index.catalog_version)
+            if graph is None or len(graph.product_ids) != len(index):
+                graph = OutfitGraph.build(index)
+            else:
+                print(f"Loaded outfit graph for catalog version {index.catalog_version}")
+            _graph, _graph_index = graph, index
+        return _graph
+
+if __name__ == '__main__':
+    from app import app
+    
+    with app.app_context():
+        save_outfit_graph(OutfitGraph.build(get_facet_index()))
+        print(f"Saved outfit graph to {OUTFIT_GRAPH_PATH}")
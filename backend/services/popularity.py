@@ -0,0 +1,356 @@
+"""
+Rolling product popularity.
+
+Interactions are counted into fixed-size time buckets held in memory, with a
+running total per trending window (hour/day/week) that is adjusted as buckets
+enter and leave the window, and an exponentially decayed score per product.
+Trending is then a top-k over those small counters instead of a scan of
+UserHistory.
+
+Committed UserHistory inserts are recorded automatically. A background thread
+flushes bucket deltas to the popularity_bucket summary table every
+POPULARITY_FLUSH_SECONDS and reloads the in-memory state from the table, so
+several worker processes converge on the same counts. Unflushed deltas are
+written at interpreter exit.
+"""
+import atexit
+import calendar
+import datetime
+import heapq
+import threading
+import time
+import traceback
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+from database.models import db, UserHistory
+
+BUCKET_SECONDS = 300
+
+TRENDING_WINDOWS = {
+    'hour': 3600,
+    'day': 86400,
+    'week': 7 * 86400
+}
+
+# Buckets older than the longest window are dropped from memory and the table
+RETENTION_SECONDS = max(TRENDING_WINDOWS.values())
+
+DECAY_HALF_LIFE_SECONDS = 86400
+
+# Rebase decayed scores before the growth factor loses float precision
+MAX_DECAY_GROWTH = 1e9
+
+INTERACTION_WEIGHTS = {
+    'purchase': 5.0,
+    'add_to_cart': 3.0,
+    'view': 1.0,
+    'search': 1.0,
+    'recommendation_view': 1.0
+}
+
+POPULARITY_FLUSH_SECONDS = 60
+
+UPSERT_BUCKET_SQL = text("""
+    INSERT INTO popularity_bucket (bucket_start, product_id, weight)
+    VALUES (:bucket_start, :product_id, :weight)
+    ON CONFLICT(bucket_start, product_id) DO UPDATE SET weight = weight + excluded.weight
+""")
+
+def bucket_of(timestamp):
+    """Start (epoch seconds) of the bucket containing a timestamp"""
+    return int(timestamp) // BUCKET_SECONDS * BUCKET_SECONDS
+
+def to_epoch(value):
+    """Epoch seconds for a naive-UTC datetime (as stored in UserHistory), or now"""
+    if value is None:
+        return time.time()
+    if isinstance(value, datetime.datetime):
+        return calendar.timegm(value.utctimetuple()) + value.microsecond / 1e6
+    return float(value)
+
+def interaction_weight(interaction_type):
+    return INTERACTION_WEIGHTS.get(interaction_type, 1.0)
+
+class PopularityStore:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.buckets = {}                       # bucket_start -> Counter(product_id -> weight)
+        self.bucket_keys = []                   # sorted bucket starts
+        self.pending = defaultdict(Counter)     # unflushed deltas, same shape as buckets
+        self.window_totals = {name: Counter() for name in TRENDING_WINDOWS}
+        self.window_floors = {name: None for name in TRENDING_WINDOWS}
+        self.decayed = Counter()                # product_id -> score scaled to decay_reference
+        self.decay_reference = None
+        self.last_flush = time.monotonic()
+        self.loaded = False
+    
+    def _window_floor(self, name, now):
+        return bucket_of(now) - TRENDING_WINDOWS[name] + BUCKET_SECONDS
+    
+    def _advance(self, now):
+        """Expire buckets that have slid out of each window"""
+        for name in TRENDING_WINDOWS:
+            floor = self._window_floor(name, now)
+            previous = self.window_floors[name]
+            if previous is not None and floor > previous:
+                totals = self.window_totals[name]
+                start = bisect_left(self.bucket_keys, previous)
+                stop = bisect_left(self.bucket_keys, floor)
+                for bucket_start in self.bucket_keys[start:stop]:
+                    for product_id, weight in self.buckets[bucket_start].items():
+                        totals[product_id] -= weight
+                        if totals[product_id] <= 1e-9:
+                            del totals[product_id]
+            if previous is None or floor > previous:
+                self.window_floors[name] = floor
+        
+        # Drop buckets older than every window
+        cutoff = bisect_left(self.bucket_keys, bucket_of(now) - RETENTION_SECONDS + BUCKET_SECONDS)
+        for bucket_start in self.bucket_keys[:cutoff]:
+            del self.buckets[bucket_start]
+        del self.bucket_keys[:cutoff]
+    
+    def _add(self, bucket_start, product_id, weight, now):
+        if bucket_start < bucket_of(now) - RETENTION_SECONDS + BUCKET_SECONDS:
+            return
+        
+        if bucket_start not in self.buckets:
+            self.buckets[bucket_start] = Counter()
+            insort(self.bucket_keys, bucket_start)
+        self.buckets[bucket_start][product_id] += weight
+        
+        for name in TRENDING_WINDOWS:
+            if bucket_start >= self.window_floors[name]:
+                self.window_totals[name][product_id] += weight
+        
+        # Forward decay: weight grows with time instead of decaying every score
+        if self.decay_reference is None:
+            self.decay_reference = now
+        growth = 2 ** ((bucket_start + BUCKET_SECONDS / 2 - self.decay_reference) / DECAY_HALF_LIFE_SECONDS)
+        self.decayed[product_id] += weight * growth
+        if growth > MAX_DECAY_GROWTH:
+            self._rebase_decay(now)
+    
+    def _rebase_decay(self, now):
+        scale = 2 ** ((self.decay_reference - now) / DECAY_HALF_LIFE_SECONDS)
+        for product_id in self.decayed:
+            self.decayed[product_id] *= scale
+        self.decay_reference = now
+    
+    def record(self, product_id, interaction_type='view', timestamp=None):
+        """Count one interaction"""
+        timestamp = to_epoch(timestamp)
+        weight = interaction_weight(interaction_type)
+        with self.lock:
+            now = max(time.time(), timestamp)
+            self._advance(now)
+            bucket_start = bucket_of(timestamp)
+            self.pending[bucket_start][product_id] += weight
+            self._add(bucket_start, product_id, weight, now)
+    
+    def top(self, window='decayed', limit=None):
+        """
+        Products ranked by popularity in a window
+        
+        Args:
+            window: 'hour', 'day', 'week' or 'decayed'
+            limit: Maximum number of products (all ranked products if None)
+        
+        Returns:
+            List of (product_id, score) tuples, most popular first
+        """
+        now = time.time()
+        with self.lock:
+            self._advance(now)
+            if window == 'decayed':
+                if self.decay_reference is None:
+                    return []
+                scale = 2 ** ((self.decay_reference - now) / DECAY_HALF_LIFE_SECONDS)
+                items = ((product_id, score * scale) for product_id, score in self.decayed.items())
+            else:
+                items = self.window_totals[window].items()
+            
+            if limit is None:
+                return sorted(items, key=lambda item: item[1], reverse=True)
+            return heapq.nlargest(limit, items, key=lambda item: item[1])
+    
+    def _reset(self, now):
+        self.buckets = {}
+        self.bucket_keys = []
+        self.window_totals = {name: Counter() for name in TRENDING_WINDOWS}
+        self.window_floors = {name: self._window_floor(name, now) for name in TRENDING_WINDOWS}
+        self.decayed = Counter()
+        self.decay_reference = now
+    
+    def rebuild(self, rows):
+        """Replace the in-memory state with (bucket_start, product_id, weight) rows plus unflushed deltas"""
+        now = time.time()
+        
+        # Build from the table rows off-lock, so readers only wait for the swap
+        fresh = PopularityStore()
+        fresh._reset(now)
+        for bucket_start, product_id, weight in rows:
+            fresh._add(bucket_start, product_id, weight, now)
+        
+        with self.lock:
+            self.buckets = fresh.buckets
+            self.bucket_keys = fresh.bucket_keys
+            self.window_totals = fresh.window_totals
+            self.window_floors = fresh.window_floors
+            self.decayed = fresh.decayed
+            self.decay_reference = fresh.decay_reference
+            for bucket_start, counts in self.pending.items():
+                for product_id, weight in counts.items():
+                    self._add(bucket_start, product_id, weight, now)
+            self.loaded = True
+    
+    def load(self, connection):
+        """Rebuild from the popularity_bucket table"""
+        cutoff = bucket_of(time.time()) - RETENTION_SECONDS + BUCKET_SECONDS
+        rows = connection.execute(
+            text("SELECT bucket_start, product_id, weight FROM popularity_bucket WHERE bucket_start >= :cutoff"),
+            {'cutoff': cutoff}
+        ).fetchall()
+        self.rebuild(rows)
+    
+    def flush(self, engine):
+        """
+        Write unflushed deltas to popularity_bucket, prune expired buckets, then
+        reload so counts recorded by other processes are picked up
+        
+        Returns:
+            Number of (bucket, product) rows written
+        """
+        with self.lock:
+            pending, self.pending = self.pending, defaultdict(Counter)
+            self.last_flush = time.monotonic()
+        
+        params = [
+            {'bucket_start': bucket_start, 'product_id': product_id, 'weight': weight}
+            for bucket_start, counts in pending.items()
+            for product_id, weight in counts.items()
+        ]
+        try:
+            with engine.begin() as connection:
+                if params:
+                    connection.execute(UPSERT_BUCKET_SQL, params)
+                connection.execute(
+                    text("DELETE FROM popularity_bucket WHERE bucket_start < :cutoff"),
+                    {'cutoff': bucket_of(time.time()) - RETENTION_SECONDS + BUCKET_SECONDS}
+                )
+                self.load(connection)
+        except Exception:
+            # Keep the deltas for the next attempt
+            with self.lock:
+                for bucket_start, counts in pending.items():
+                    self.pending[bucket_start].update(counts)
+            raise
+        return len(params)
+
+def backfill_popularity_buckets(connection):
+    """Seed popularity_bucket from the last RETENTION_SECONDS of UserHistory"""
+    weight_case = ' '.join(
+        f"WHEN '{interaction_type}' THEN {weight}" for interaction_type, weight in INTERACTION_WEIGHTS.items()
+    )
+    since = (datetime.datetime.utcnow() - datetime.timedelta(seconds=RETENTION_SECONDS)).strftime('%Y-%m-%d %H:%M:%S')
+    connection.execute(text(f"""
+        INSERT OR IGNORE INTO popularity_bucket (bucket_start, product_id, weight)
+        SELECT CAST(strftime('%s', timestamp) AS INTEGER) / {BUCKET_SECONDS} * {BUCKET_SECONDS},
+               product_id,
+               sum(CASE interaction_type {weight_case} ELSE 1.0 END)
+        FROM user_history
+        WHERE timestamp >= :since
+        GROUP BY 1, 2
+    """), {'since': since})
+
+_store = PopularityStore()
+
+def get_popularity_store():
+    """Shared store, loaded from the summary table on first use"""
+    if not _store.loaded:
+        with db.engine.connect() as connection:
+            _store.load(connection)
+    return _store
+
+_flusher = None
+_flusher_engine = None
+_flusher_lock = threading.Lock()
+_flusher_stopping = threading.Event()
+
+def flush_popularity(engine=None):
+    """Synchronously flush the shared store (db.engine needs an app context)"""
+    try:
+        return _store.flush(engine or db.engine)
+    except Exception as e:
+        print(f"Error flushing popularity counters: {e}")
+        traceback.print_exc()
+        return 0
+
+def _run_flusher(engine):
+    while not _flusher_stopping.wait(POPULARITY_FLUSH_SECONDS):
+        flush_popularity(engine)
+
+def start_popularity_flusher(engine=None):
+    """
+    Start the background thread (once) that flushes the shared store every
+    POPULARITY_FLUSH_SECONDS, so requests never pay for the upsert and reload
+    """
+    global _flusher, _flusher_engine
+    if _flusher is not None and _flusher.is_alive():
+        return
+    with _flusher_lock:
+        if _flusher is None or not _flusher.is_alive():
+            _flusher_stopping.clear()
+            _flusher_engine = engine or db.engine
+            _flusher = threading.Thread(
+                target=_run_flusher, args=(_flusher_engine,), name='popularity-flusher', daemon=True
+            )
+            _flusher.start()
+
+def record_interaction(product_id, interaction_type='view', timestamp=None):
+    """Count an interaction that was not written through the ORM session"""
+    _store.record(product_id, interaction_type, timestamp)
+
+def get_trending(window='decayed', limit=None):
+    """Ranked (product_id, score) pairs for a trending window"""
+    store = get_popularity_store()
+    start_popularity_flusher()
+    return store.top(window, limit)
+
+@event.listens_for(Session, 'after_flush')
+def _collect_history_inserts(session, flush_context):
+    inserts = [
+        (obj.product_id, obj.interaction_type, obj.timestamp)
+        for obj in session.new
+        if isinstance(obj, UserHistory)
+    ]
+    if inserts:
+        session.info.setdefault('history_inserts', []).extend(inserts)
+
+@event.listens_for(Session, 'after_commit')
+def _record_history_inserts(session):
+    inserts = session.info.pop('history_inserts', None)
+    if not inserts:
+        return
+    
+    try:
+        for product_id, interaction_type, timestamp in inserts:
+            _store.record(product_id, interaction_type, timestamp)
+        start_popularity_flusher()
+    except Exception as e:
+        print(f"Error recording popularity: {e}")
+        traceback.print_exc()
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_history_inserts(session):
+    session.info.pop('history_inserts', None)
+
+@atexit.register
+def _flush_on_exit():
+    # Registered before the interaction buffer's hook, so it runs after it
+    _flusher_stopping.set()
+    if _flusher_engine is None or not any(_store.pending.values()):
+        return
+    flush_popularity(_flusher_engine)
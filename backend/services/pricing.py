@@ -0,0 +1,227 @@
+"""
+Cart pricing engine.
+
+Discount rules are compiled once into a rule table: parallel arrays of rates,
+thresholds, category scopes, eligibility requirements and active hours. A
+cart is turned into line arrays (price x quantity, quantity, category), and
+every rule is evaluated at once with a few array operations. Category
+matching runs over the cart's distinct categories rather than its lines, so
+large carts with repeated categories (B2B orders) stay cheap.
+
+Per-user eligibility flags (first-time buyer) are cached. A user's entry is
+dropped whenever UserHistory rows are written for them, through the ORM or
+the interaction buffer, so a purchase ends the welcome discount at once.
+"""
+import threading
+import traceback
+from datetime import datetime
+import numpy as np
+from cachetools import TTLCache
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from database.models import db, UserHistory
+
+FREE_SHIPPING_THRESHOLD = 75
+SHIPPING_FEE = 10
+
+# Eligibility flags a rule can require (see get_user_flags)
+USER_FLAGS = ('first_time_buyer',)
+
+USER_FLAGS_CACHE_SIZE = 10000
+USER_FLAGS_TTL = 600
+
+_user_flags = TTLCache(maxsize=USER_FLAGS_CACHE_SIZE, ttl=USER_FLAGS_TTL)
+_user_flags_lock = threading.Lock()
+
+class PricingEngine:
+    """
+    Rule table compiled from a dict of rule specs
+    
+    Each spec has a name, description and discount rate, and optionally:
+        type: Discount type reported to the client (default 'bundle')
+        categories: Category substrings selecting the lines the rule counts
+            (default all lines)
+        min_items: Minimum number of matching lines
+        min_quantity: Minimum total quantity of matching lines
+        applies_to: 'cart' (default) or 'matched' (only the matching lines)
+        requires: A USER_FLAGS name the user must have
+        hours: (first, last) local hour the rule is active, inclusive
+        after_shipping: Not counted towards the free shipping threshold
+    """
+
+    def __init__(self, rules):
+        specs = list(rules.values())
+        self.names = [spec['name'] for spec in specs]
+        self.types = [spec.get('type', 'bundle') for spec in specs]
+        self.descriptions = [spec.get('description', spec['name']) for spec in specs]
+        
+        self.rates = np.array([spec['discount'] for spec in specs], dtype=np.float64)
+        self.min_items = np.array([spec.get('min_items', 0) for spec in specs], dtype=np.float64)
+        self.min_quantity = np.array([spec.get('min_quantity', 0) for spec in specs], dtype=np.float64)
+        self.matched_only = np.array([spec.get('applies_to') == 'matched' for spec in specs], dtype=bool)
+        self.after_shipping = np.array([bool(spec.get('after_shipping')) for spec in specs], dtype=bool)
+        
+        # Column len(USER_FLAGS) of the flag vector is always True (no requirement)
+        self.requires = np.array([
+            USER_FLAGS.index(spec['requires']) if spec.get('requires') else len(USER_FLAGS)
+            for spec in specs
+        ], dtype=np.intp)
+        
+        hours = [spec.get('hours') or (0, 23) for spec in specs]
+        self.first_hour = np.array([first for first, _ in hours])
+        self.last_hour = np.array([last for _, last in hours])
+        
+        # Category scope: rules x terms, plus which rules count every line
+        self.terms = sorted({term.lower() for spec in specs for term in spec.get('categories', [])})
+        self.scope = np.array([
+            [term in {t.lower() for t in spec.get('categories', [])} for term in self.terms]
+            for spec in specs
+        ], dtype=np.float64).reshape(len(specs), len(self.terms))
+        self.unscoped = np.array([not spec.get('categories') for spec in specs], dtype=bool)
+    
+    def match_lines(self, categories):
+        """Boolean lines x rules matrix of the lines each rule counts"""
+        distinct, inverse = np.unique(np.array(categories, dtype=str), return_inverse=True)
+        hits = np.array([[term in category for term in self.terms] for category in distinct], dtype=np.float64)
+        hits = hits.reshape(len(distinct), len(self.terms))
+        matched = ((hits @ self.scope.T) > 0) | self.unscoped
+        return matched[inverse.ravel()]
+    
+    def evaluate(self, cart_items, flags=None, hour=None):
+        """
+        Discount amount per rule for a cart
+        
+        Returns:
+            (amounts array aligned with the rules, original total, total quantity)
+        """
+        prices = np.array([float(item.get('price', 0)) for item in cart_items], dtype=np.float64)
+        quantities = np.array([float(item.get('quantity', 1)) for item in cart_items], dtype=np.float64)
+        line_totals = prices * quantities
+        original_total = float(line_totals.sum())
+        
+        matched = self.match_lines([str(item.get('category', '')).lower() for item in cart_items])
+        matched_items = matched.sum(axis=0)
+        matched_quantity = quantities @ matched
+        matched_totals = line_totals @ matched
+        
+        flag_values = np.array([bool((flags or {}).get(name)) for name in USER_FLAGS] + [True])
+        hour = datetime.now().hour if hour is None else hour
+        
+        eligible = (
+            (matched_items >= self.min_items)
+            & (matched_quantity >= self.min_quantity)
+            & flag_values[self.requires]
+            & (self.first_hour <= hour) & (hour <= self.last_hour)
+        )
+        base = np.where(self.matched_only, matched_totals, original_total)
+        amounts = np.where(eligible, self.rates * base, 0.0)
+        return amounts, original_total, float(quantities.sum())
+    
+    def price(self, cart_items, flags=None, hour=None):
+        """
+        Priced cart: totals, applied discounts, shipping and recommendations
+        
+        Args:
+            cart_items: List of cart items with price, quantity and category
+            flags: Eligibility flags for the user (see get_user_flags)
+            hour: Local hour for time-limited rules (defaults to now)
+        """
+        pricing = {
+            'original_total': 0,
+            'discounts': [],
+            'final_total': 0,
+            'savings': 0,
+            'shipping': 0,
+            'free_shipping_eligible': False,
+            'recommendations': []
+        }
+        
+        if not cart_items:
+            return pricing
+        
+        amounts, original_total, total_quantity = self.evaluate(cart_items, flags, hour)
+        pricing['original_total'] = original_total
+        
+        for rule in np.flatnonzero(amounts > 0):
+            pricing['discounts'].append({
+                'type': self.types[rule],
+                'name': self.names[rule],
+                'amount': float(amounts[rule]),
+                'description': self.descriptions[rule].format(quantity=total_quantity)
+            })
+        
+        # Shipping Calculation
+        subtotal_after_discount = original_total - float(amounts[~self.after_shipping].sum())
+        if subtotal_after_discount >= FREE_SHIPPING_THRESHOLD:
+            pricing['shipping'] = 0
+            pricing['free_shipping_eligible'] = True
+            pricing['recommendations'].append({
+                'type': 'shipping',
+                'message': 'Congratulations! You qualify for free shipping.'
+            })
+        else:
+            pricing['shipping'] = SHIPPING_FEE
+            needed_for_free_shipping = FREE_SHIPPING_THRESHOLD - subtotal_after_discount
+            pricing['recommendations'].append({
+                'type': 'shipping',
+                'message': f'Add ${needed_for_free_shipping:.2f} more for free shipping!'
+            })
+        
+        total_discount = float(amounts.sum())
+        pricing['final_total'] = max(0, original_total - total_discount + pricing['shipping'])
+        pricing['savings'] = total_discount
+        
+        return pricing
+
+def get_user_flags(user_id):
+    """
+    Cached eligibility flags for a user
+    
+    Returns:
+        Dict of USER_FLAGS names to booleans (empty if they could not be loaded)
+    """
+    if not user_id:
+        return {}
+    
+    with _user_flags_lock:
+        flags = _user_flags.get(user_id)
+    if flags is not None:
+        return flags
+    
+    try:
+        # Any recorded interaction means the user is not new
+        has_history = db.session.query(UserHistory.id).filter(UserHistory.user_id == user_id).first() is not None
+    except Exception as e:
+        print(f"Error loading pricing flags for user {user_id}: {e}")
+        traceback.print_exc()
+        return {}
+    
+    flags = {'first_time_buyer': not has_history}
+    with _user_flags_lock:
+        _user_flags[user_id] = flags
+    return flags
+
+def invalidate_user_flags(user_ids=None):
+    """Drop cached flags for some users, or for everyone"""
+    with _user_flags_lock:
+        if user_ids is None:
+            _user_flags.clear()
+            return
+        for user_id in user_ids:
+            _user_flags.pop(user_id, None)
+
+@event.listens_for(Session, 'after_flush')
+def _collect_history_users(session, flush_context):
+    user_ids = {obj.user_id for obj in session.new if isinstance(obj, UserHistory)}
+    if user_ids:
+        session.info.setdefault('history_users', set()).update(user_ids)
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_history_users(session):
+    user_ids = session.info.pop('history_users', None)
+    if user_ids:
+        invalidate_user_flags(user_ids)
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_history_users(session):
+    session.info.pop('history_users', None)
@@ -0,0 +1,172 @@
+"""
+Query understanding for product search.
+
+All search vocabularies (colors, clothing types, clothing keywords, gender
+words, multi-item conjunctions) and the price phrases are compiled at import
+into one regex, with the vocabulary factored as a prefix trie. A single finditer pass over the cleaned query yields every
+component; the lookahead form lets overlapping terms both match ("t-shirt"
+also yields "shirt"). Parsed queries are memoized, since search traffic
+repeats the same few queries constantly.
+"""
+import re
+from collections import namedtuple
+from functools import lru_cache
+from services.search_index import normalize_search_text
+
+COLORS = [
+    'red', 'blue', 'green', 'yellow', 'black', 'white', 'pink', 'purple',
+    'orange', 'brown', 'gray', 'grey', 'navy', 'maroon', 'beige', 'cream'
+]
+
+CLOTHING_TYPES = [
+    'shirt', 't-shirt', 'tshirt', 'top', 'blouse', 'dress', 'pants', 'jeans',
+    'jacket', 'hoodie', 'sweater', 'shorts'
+]
+
+# Words that make a query a clothing search
+CLOTHING_KEYWORDS = [
+    'shirt', 't-shirt', 'tshirt', 'top', 'blouse', 'sweater', 'hoodie',
+    'dress', 'skirt', 'pants', 'jeans', 'trousers', 'shorts',
+    'jacket', 'coat', 'blazer', 'vest', 'cardigan',
+    'underwear', 'bra', 'socks', 'clothing', 'apparel', 'fashion',
+    'outfit', 'wear', 'garment'
+]
+
+GENDER_TERMS = {
+    'men': 'Men', 'mens': 'Men', 'man': 'Men', 'male': 'Men',
+    'women': 'Women', 'womens': 'Women', 'woman': 'Women', 'female': 'Women', 'ladies': 'Women',
+    'boys': 'Boys', 'girls': 'Girls',
+    'kids': 'Kids', 'unisex': 'Unisex'
+}
+
+MULTI_ITEM_TERMS = ['and', 'with']
+
+QUERY_CACHE_SIZE = 4096
+
+QueryAnalysis = namedtuple('QueryAnalysis', [
+    'text', 'colors', 'clothing_types', 'gender', 'min_price', 'max_price',
+    'is_multi_item', 'is_clothing_search'
+])
+
+def _build_term_kinds():
+    kinds = {}
+    for kind, terms in (('color', COLORS), ('clothing_type', CLOTHING_TYPES),
+                        ('clothing', CLOTHING_KEYWORDS), ('gender', GENDER_TERMS),
+                        ('multi_item', MULTI_ITEM_TERMS)):
+        for term in terms:
+            kinds.setdefault(term, set()).add(kind)
+    return kinds
+
+TERM_KINDS = _build_term_kinds()
+
+def trie_pattern(terms):
+    """
+    Regex matching any of terms, factored as a prefix trie ("sh(?:irt|orts)")
+    so matching walks shared prefixes once instead of trying each term in turn.
+    Optional tails are greedy, so the longest term at a position wins.
+    """
+    trie = {}
+    for term in terms:
+        node = trie
+        for char in term:
+            node = node.setdefault(char, {})
+        node[''] = {}
+    
+    def render(node):
+        branches = [re.escape(char) + render(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        return f'(?:{body})?' if '' in node else body
+    
+    return render(trie)
+
+_NUMBER = r'\$?(\d+(?:\.\d+)?)'
+
+# Anchored at word starts ("shirt" inside "t-shirt" is still one); an
+# optional plural suffix keeps "shirts" / "dresses" matching
+QUERY_PATTERN = re.compile(
+    r"\b(?:"
+    rf"between\s+{_NUMBER}\s+(?:and|to)\s+{_NUMBER}\b"
+    rf"|(?:under|below|less than|cheaper than|up to|max)\s+{_NUMBER}\b"
+    rf"|(?:over|above|more than|at least|min)\s+{_NUMBER}\b"
+    r"|(?=(" + trie_pattern(TERM_KINDS) + r")(?:e?s)?\b)"
+    r")"
+)
+
+def _ordered(found, vocabulary):
+    """Found terms in vocabulary order, without duplicates"""
+    return [term for term in vocabulary if term in found]
+
+@lru_cache(maxsize=QUERY_CACHE_SIZE)
+def analyze_query(query):
+    """
+    Parse a cleaned search query in one pass
+    
+    Args:
+        query: Output of normalize_search_text
+    
+    Returns:
+        QueryAnalysis; text is the query with price phrases removed and
+        gender words in catalog form
+    """
+    found = set()
+    gender = None
+    min_price = max_price = None
+    rewrites = []   # (start, stop, replacement) applied to the searchable text
+    
+    for match in QUERY_PATTERN.finditer(query):
+        low, high, below, above, term = match.groups()
+        if term is not None:
+            found.add(term)
+            if term in GENDER_TERMS:
+                gender = gender or GENDER_TERMS[term]
+                # Catalog names say "Men" / "Women", not "mens" / "ladies"
+                rewrites.append((match.start(), match.start() + len(term), GENDER_TERMS[term].lower()))
+            continue
+        
+        rewrites.append((match.start(), match.end(), ''))
+        if low is not None:
+            min_price, max_price = sorted((float(low), float(high)))
+        elif below is not None:
+            max_price = float(below)
+        else:
+            min_price = float(above)
+    
+    text = query
+    for start, stop, replacement in reversed(rewrites):
+        text = text[:start] + replacement + text[stop:]
+    
+    return QueryAnalysis(
+        text=' '.join(text.split()),
+        colors=tuple(_ordered(found, COLORS)),
+        clothing_types=tuple(_ordered(found, CLOTHING_TYPES)),
+        gender=gender,
+        min_price=min_price,
+        max_price=max_price,
+        is_multi_item=any(term in found for term in MULTI_ITEM_TERMS),
+        is_clothing_search=any(term in found for term in CLOTHING_KEYWORDS)
+    )
+
+@lru_cache(maxsize=QUERY_CACHE_SIZE)
+def understand_query(raw_query):
+    """
+    normalize_search_text + analyze_query, memoized on the raw input
+    
+    Decimal and $ prices survive cleaning:
+    
+    >>> _, analysis = understand_query('Shirts under $49.99')
+    >>> analysis.min_price, analysis.max_price
+    (None, 49.99)
+    >>> _, analysis = understand_query('between 19.5 and $30 shoes')
+    >>> analysis.min_price, analysis.max_price, analysis.text
+    (19.5, 30.0, 'shoes')
+    """
+    query = normalize_search_text(raw_query)
+    return query, analyze_query(query)
+
+def query_cache_info():
+    return {
+        'raw': understand_query.cache_info()._asdict(),
+        'cleaned': analyze_query.cache_info()._asdict()
+    }
@@ -0,0 +1,182 @@
+"""
+Signed, short-lived pricing quotes.
+
+Pricing a cart issues a quote: the pricing result stored under a digest of
+the normalized cart and user, plus a quote ID that signs (HMAC-SHA256) that
+digest together with the expiry and the quoted totals. Repeated pricing of
+the same cart within QUOTE_TTL_SECONDS reuses the stored result, and checkout
+redeems the quote ID instead of pricing again, so the customer is charged the
+total they were shown.
+
+The signed totals make a quote redeemable even after it has left the store
+(or on another worker), as long as every process shares QUOTE_SECRET.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from cachetools import TTLCache
+
+QUOTE_TTL_SECONDS = 600
+QUOTE_STORE_SIZE = 10000
+
+QUOTE_SECRET = os.getenv('QUOTE_SECRET')
+if not QUOTE_SECRET:
+    # Other workers could not verify this process's quotes; checkout would re-price every cross-worker order
+    if int(os.getenv('WEB_CONCURRENCY', '1')) > 1:
+        raise RuntimeError("QUOTE_SECRET must be set (to the same value on every worker) when WEB_CONCURRENCY > 1")
+    print("QUOTE_SECRET not set; pricing quotes are only redeemable in this process")
+_secret = (QUOTE_SECRET or secrets.token_hex(32)).encode()
+
+# Quotes by cart digest
+_quotes = TTLCache(maxsize=QUOTE_STORE_SIZE, ttl=QUOTE_TTL_SECONDS)
+_lock = threading.Lock()
+_metrics = Counter()
+
+class InvalidQuote(ValueError):
+    """Raised when a quote ID is malformed, expired or was issued for a different cart"""
+
+def normalize_cart(cart_items):
+    """Order-independent representation of the cart fields that affect pricing"""
+    lines = []
+    for item in cart_items or []:
+        lines.append([
+            str(item.get('id')),
+            round(float(item.get('price', 0)), 2),
+            float(item.get('quantity', 1)),
+            str(item.get('category', '')).lower()
+        ])
+    return sorted(lines)
+
+def cart_digest(cart_items, user_id=None):
+    payload = json.dumps({'cart': normalize_cart(cart_items), 'user': user_id}, separators=(',', ':'), default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def to_cents(amount):
+    return int(round(float(amount) * 100))
+
+def sign(payload, digest):
+    return hmac.new(_secret, f"{payload}.{digest}".encode(), hashlib.sha256).hexdigest()
+
+def encode_quote_id(digest, expires, pricing):
+    """Quote ID carrying the expiry and totals, signed together with the cart digest"""
+    fields = {
+        'n': secrets.token_hex(4),
+        'e': int(expires),
+        'o': to_cents(pricing['original_total']),
+        't': to_cents(pricing['final_total']),
+        's': to_cents(pricing['savings'])
+    }
+    payload = base64.urlsafe_b64encode(json.dumps(fields, separators=(',', ':')).encode()).decode().rstrip('=')
+    return f"{payload}.{sign(payload, digest)}"
+
+def parse_quote_id(quote_id):
+    """Split a quote ID into its payload, signature and (unverified) fields"""
+    try:
+        payload, signature = quote_id.split('.')
+        padded = payload + '=' * (-len(payload) % 4)
+        fields = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        fields['e'] = int(fields['e'])
+    except (AttributeError, ValueError, TypeError, KeyError) as e:
+        raise InvalidQuote(f"Malformed quote: {e}")
+    return payload, signature, fields
+
+def decode_quote_id(quote_id, digest, now=None):
+    """
+    Verify a quote ID against a cart digest
+    
+    Returns:
+        Dict with the signed expiry ('e'), and original total ('o'), final
+        total ('t') and savings ('s') in cents
+    """
+    payload, signature, fields = parse_quote_id(quote_id)
+    if not hmac.compare_digest(signature, sign(payload, digest)):
+        raise InvalidQuote("Quote does not match this cart")
+    if fields['e'] <= (now if now is not None else time.time()):
+        raise InvalidQuote("Quote has expired")
+    return fields
+
+def quoted_final_total(quote_id):
+    """
+    Final total a quote claims, in cents, without verifying it (None if
+    unreadable). Only for comparing against a fresh price, never for charging.
+    """
+    try:
+        return int(parse_quote_id(quote_id)[2]['t'])
+    except (InvalidQuote, KeyError, TypeError, ValueError):
+        return None
+
+def expiry_timestamp(expires):
+    return datetime.fromtimestamp(expires, tz=timezone.utc).isoformat()
+
+def quote_pricing(cart_items, user_id, calculate):
+    """
+    Pricing for a cart, reusing a live quote for the same cart and user
+    
+    Args:
+        cart_items: Cart items as sent by the client
+        user_id: Optional user ID (part of the quote key)
+        calculate: Callable (cart_items, user_id) -> pricing dict, used on a miss
+    
+    Returns:
+        Pricing dict with 'quote_id' and 'quote_expires_at' added
+    """
+    digest = cart_digest(cart_items, user_id)
+    with _lock:
+        quote = _quotes.get(digest)
+    if quote is not None:
+        _metrics['reused'] += 1
+        return dict(quote['pricing'])
+    
+    pricing = calculate(cart_items, user_id)
+    expires = int(time.time()) + QUOTE_TTL_SECONDS
+    quote_id = encode_quote_id(digest, expires, pricing)
+    pricing = dict(pricing, quote_id=quote_id, quote_expires_at=expiry_timestamp(expires))
+    
+    with _lock:
+        _quotes[digest] = {'quote_id': quote_id, 'pricing': pricing}
+    _metrics['issued'] += 1
+    return dict(pricing)
+
+def redeem_quote(quote_id, cart_items, user_id=None):
+    """
+    Pricing promised by a quote, checked against the cart being charged
+    
+    Returns:
+        The stored pricing dict, or just the signed totals if the quote has
+        left this process's store
+    
+    Raises:
+        InvalidQuote: If the quote is malformed, expired or for another cart
+    """
+    digest = cart_digest(cart_items, user_id)
+    try:
+        fields = decode_quote_id(quote_id, digest)
+    except InvalidQuote:
+        _metrics['rejected'] += 1
+        raise
+    
+    _metrics['redeemed'] += 1
+    with _lock:
+        quote = _quotes.get(digest)
+    if quote is not None and quote['quote_id'] == quote_id:
+        return dict(quote['pricing'])
+    
+    return {
+        'original_total': fields['o'] / 100,
+        'final_total': fields['t'] / 100,
+        'savings': fields['s'] / 100,
+        'quote_id': quote_id,
+        'quote_expires_at': expiry_timestamp(fields['e'])
+    }
+
+def quote_metrics():
+    with _lock:
+        live = len(_quotes)
+    return dict(_metrics, live_quotes=live, ttl_seconds=QUOTE_TTL_SECONDS, shared_secret=bool(QUOTE_SECRET))
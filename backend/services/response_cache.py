@@ -0,0 +1,230 @@
+"""
+Response cache for idempotent product and recommendation endpoints.
+
+Responses are keyed on the endpoint, path, sorted query arguments and
+normalized JSON body, plus the catalog version and the mtimes of the
+embedding index files, so any catalog write or index rebuild moves every
+endpoint to fresh keys. Entries live in a size-bounded in-process LRU with a
+per-endpoint TTL and, when RESPONSE_CACHE_DB is set, in a small SQLite file
+shared by every worker process on the host.
+
+Cached responses carry an ETag; GET requests with a matching If-None-Match
+get a 304. Hits, misses and revalidations are counted per endpoint.
+"""
+import functools
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+from collections import Counter, defaultdict
+from cachetools import TLRUCache
+from flask import Response, request, make_response
+from database.catalog import get_catalog_version
+
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', 2048))
+RESPONSE_CACHE_TTL = 300
+
+# Optional SQLite file shared between worker processes (disabled when unset)
+RESPONSE_CACHE_DB = os.getenv('RESPONSE_CACHE_DB')
+
+# Files whose modification invalidates cached vector results
+INDEX_FILES = [
+    'data/embeddings/faiss_index.bin',
+    'data/embeddings/text_faiss_index.bin',
+    'data/embeddings/neighbors.npy'
+]
+
+# Expired shared rows are deleted every this many writes
+SHARED_PRUNE_INTERVAL = 500
+
+_local_cache = TLRUCache(maxsize=RESPONSE_CACHE_SIZE, ttu=lambda key, entry, now: now + entry['ttl'], timer=time.time)
+_lock = threading.Lock()
+_metrics = defaultdict(Counter)
+_shared = threading.local()
+_shared_writes = 0
+
+def index_version():
+    """Modification times of the embedding index files"""
+    return [os.path.getmtime(path) if os.path.exists(path) else None for path in INDEX_FILES]
+
+def request_cache_key(name):
+    """Digest of the normalized request plus catalog and index versions"""
+    body = request.get_json(silent=True) if request.method != 'GET' else None
+    parts = {
+        'endpoint': name,
+        'method': request.method,
+        'path': request.path,
+        'args': sorted(request.args.items(multi=True)),
+        'body': body,
+        'catalog': get_catalog_version(),
+        'index': index_version()
+    }
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+def shared_connection():
+    """Per-thread connection to the shared SQLite cache, or None if disabled"""
+    if not RESPONSE_CACHE_DB:
+        return None
+    
+    connection = getattr(_shared, 'connection', None)
+    if connection is None:
+        connection = sqlite3.connect(RESPONSE_CACHE_DB, timeout=1.0, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS response_cache (
+                key TEXT PRIMARY KEY,
+                entry TEXT NOT NULL,
+                body BLOB NOT NULL,
+                expires REAL NOT NULL
+            )
+        """)
+        _shared.connection = connection
+    return connection
+
+def shared_get(key):
+    try:
+        connection = shared_connection()
+        if connection is None:
+            return None
+        row = connection.execute(
+            "SELECT entry, body, expires FROM response_cache WHERE key = ? AND expires > ?",
+            (key, time.time())
+        ).fetchone()
+        if row is None:
+            return None
+        entry = json.loads(row[0])
+        entry['body'] = row[1]
+        # Keep only the remaining lifetime locally
+        entry['ttl'] = row[2] - time.time()
+        return entry
+    except Exception as e:
+        print(f"Shared response cache read failed: {e}")
+        return None
+
+def shared_put(key, entry):
+    global _shared_writes
+    
+    try:
+        connection = shared_connection()
+        if connection is None:
+            return
+        metadata = {field: value for field, value in entry.items() if field != 'body'}
+        connection.execute(
+            "INSERT OR REPLACE INTO response_cache (key, entry, body, expires) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(metadata), entry['body'], time.time() + entry['ttl'])
+        )
+        _shared_writes += 1
+        if _shared_writes % SHARED_PRUNE_INTERVAL == 0:
+            connection.execute("DELETE FROM response_cache WHERE expires <= ?", (time.time(),))
+    except Exception as e:
+        print(f"Shared response cache write failed: {e}")
+
+def build_response(entry, outcome):
+    """Response for a cache entry, or a 304 if the client already holds it"""
+    etag = entry['etag']
+    if request.method in ('GET', 'HEAD') and etag in request.if_none_match:
+        response = Response(status=304)
+        if outcome != 'miss':
+            outcome = 'not_modified'
+    else:
+        response = Response(entry['body'], status=entry['status'], mimetype=entry['mimetype'])
+    
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Cache'] = outcome
+    return response, outcome
+
+def cached_response(name, ttl=RESPONSE_CACHE_TTL, bypass=None):
+    """
+    Cache a view's successful responses
+    
+    Args:
+        name: Endpoint name used in the key and the metrics
+        ttl: Seconds an entry stays valid
+        bypass: Optional callable; when it returns True the request is served
+            uncached (e.g. requests with side effects)
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            metrics = _metrics[name]
+            if bypass is not None and bypass():
+                metrics['bypass'] += 1
+                return view(*args, **kwargs)
+            
+            try:
+                key = request_cache_key(name)
+            except Exception as e:
+                print(f"Response cache key failed for {name}: {e}")
+                metrics['bypass'] += 1
+                return view(*args, **kwargs)
+            
+            with _lock:
+                entry = _local_cache.get(key)
+            outcome = 'hit'
+            
+            if entry is None:
+                entry = shared_get(key)
+                outcome = 'shared_hit'
+                if entry is not None:
+                    with _lock:
+                        _local_cache[key] = entry
+            
+            if entry is None:
+                outcome = 'miss'
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200 or response.is_streamed:
+                    metrics['uncacheable'] += 1
+                    return response
+                
+                body = response.get_data()
+                entry = {
+                    'body': body,
+                    'status': response.status_code,
+                    'mimetype': response.mimetype,
+                    'etag': hashlib.sha1(body).hexdigest(),
+                    'ttl': ttl
+                }
+                with _lock:
+                    _local_cache[key] = entry
+                shared_put(key, entry)
+            
+            response, outcome = build_response(entry, outcome)
+            metrics[outcome] += 1
+            return response
+        
+        return wrapper
+    return decorator
+
+def cache_metrics():
+    """Per-endpoint counters and hit ratio (304s count as hits)"""
+    with _lock:
+        size = len(_local_cache)
+    
+    endpoints = {}
+    for name, counts in _metrics.items():
+        hits = counts['hit'] + counts['shared_hit'] + counts['not_modified']
+        lookups = hits + counts['miss'] + counts['uncacheable']
+        endpoints[name] = dict(counts, hit_ratio=round(hits / lookups, 3) if lookups else None)
+    
+    return {
+        'entries': size,
+        'max_entries': RESPONSE_CACHE_SIZE,
+        'shared_store': RESPONSE_CACHE_DB,
+        'endpoints': endpoints
+    }
+
+def clear_response_cache():
+    with _lock:
+        _local_cache.clear()
+    try:
+        connection = shared_connection()
+        if connection is not None:
+            connection.execute("DELETE FROM response_cache")
+    except Exception as e:
+        print(f"Error clearing shared response cache: {e}")
+        traceback.print_exc()
@@ -0,0 +1,79 @@
+"""
+Server-side result sets for multi-turn refinement.
+
+Recommendation responses register the products they return under a short
+result-set ID, and /refine takes that ID plus a prompt instead of the whole
+product list. Each refinement registers its output as a new set, so a client
+can keep narrowing by passing the latest ID.
+
+IDs are a digest of the product payloads, so a response served from the
+response cache names the same set as the response that registered it, while
+a catalog change (new price or name) yields a new set rather than reusing
+the old products and their columnar copy.
+Sets outlive cached responses (RESULT_SET_TTL_SECONDS is longer than the
+response cache TTL), but are per process: a refine that misses gets a 410 and
+the client resends its products.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import Counter
+from cachetools import TTLCache
+
+RESULT_SET_TTL_SECONDS = 900
+RESULT_SET_STORE_SIZE = 2000
+
+_result_sets = TTLCache(maxsize=RESULT_SET_STORE_SIZE, ttl=RESULT_SET_TTL_SECONDS)
+_lock = threading.Lock()
+_metrics = Counter()
+
+class ResultSet:
+    """Products of one recommendation or refinement response"""
+
+    def __init__(self, result_set_id, products, parent_id=None, prompt=None):
+        self.id = result_set_id
+        self.products = products
+        self.parent_id = parent_id
+        self.prompt = prompt
+        self.created_at = time.time()
+        # Columnar copy for refinement, built on the first refine
+        self.columns = None
+
+def result_set_id_for(products):
+    """Short ID derived from the product payloads, in order"""
+    payload = json.dumps(products, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()[:20]
+
+def register_result_set(products, parent_id=None, prompt=None):
+    """
+    Store a list of product dicts for later refinement
+    
+    Args:
+        products: Product dicts as returned to the client
+        parent_id: Result set these products were refined from
+        prompt: Prompt that produced them
+    
+    Returns:
+        Result-set ID
+    """
+    result_set_id = result_set_id_for(products)
+    with _lock:
+        # Re-registering identical products refreshes the TTL and keeps the columnar copy
+        result_set = _result_sets.get(result_set_id) or ResultSet(result_set_id, products, parent_id, prompt)
+        _result_sets[result_set_id] = result_set
+        _metrics['registered'] += 1
+    return result_set_id
+
+def get_result_set(result_set_id):
+    """ResultSet for an ID, or None if it is unknown or expired"""
+    with _lock:
+        result_set = _result_sets.get(result_set_id)
+        _metrics['hit' if result_set is not None else 'miss'] += 1
+    return result_set
+
+def result_set_metrics():
+    with _lock:
+        live = len(_result_sets)
+        metrics = dict(_metrics)
+    return dict(metrics, live_sets=live, ttl_seconds=RESULT_SET_TTL_SECONDS)
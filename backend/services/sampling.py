@@ -0,0 +1,244 @@
+"""
+Random product sampling from precomputed candidate pools.
+
+Pools are arrays of product IDs selected by category, name keywords and
+gender, built from the facet index's column arrays and cached until the
+catalog version changes. Drawing k products is O(k): Floyd's algorithm for
+uniform samples, and Vose alias tables (weights from decayed popularity) for
+weighted ones. This replaces ORDER BY random(), which sorts the whole table
+on every call, and loading a result set just to shuffle it.
+"""
+import threading
+import time
+import numpy as np
+from services.facets import get_facet_index, contains_any
+from services.popularity import get_trending, POPULARITY_FLUSH_SECONDS
+
+WOMEN_TERMS = ['women', 'woman', 'female', 'ladies']
+MEN_TERMS = ['men', 'man', 'male', 'guys']
+
+# Excluded from catalog-wide fallbacks
+DEFAULT_EXCLUDED_TERMS = ('infant', 'baby')
+
+# The most popular product is drawn this many times as often as one with no interactions
+POPULARITY_BOOST = 10.0
+
+# Pool specs cached per catalog version before the cache is reset
+MAX_POOLS = 256
+
+_rng = np.random.default_rng()
+
+def pool_key(category=None, name_terms=None, gender=None, exclude_terms=DEFAULT_EXCLUDED_TERMS):
+    """
+    Normalized pool spec
+    
+    Args:
+        category: Substring of the category (case-insensitive)
+        name_terms: Keep names containing any of these
+        gender: 'men' or 'women' (by name keywords); anything else means no filter
+        exclude_terms: Drop names containing any of these
+    """
+    return (
+        category.lower() if category else None,
+        tuple(sorted(term.lower() for term in name_terms)) if name_terms else None,
+        gender if gender in ('men', 'women') else None,
+        tuple(sorted(term.lower() for term in exclude_terms)) if exclude_terms else None
+    )
+
+def floyd_sample(n, k, rng=_rng):
+    """k distinct positions from range(n) in O(k) (Floyd's algorithm), in random order"""
+    k = min(k, n)
+    selected = set()
+    for upper in range(n - k, n):
+        position = int(rng.integers(0, upper + 1))
+        selected.add(position if position not in selected else upper)
+    
+    positions = list(selected)
+    rng.shuffle(positions)
+    return positions
+
+class AliasTable:
+    """
+    Alias table: O(n) vectorized build, O(1) per weighted draw
+    
+    Built with a prefix-sum sweep rather than Vose's work lists. Columns with
+    less than their share (light) are topped up by the heavy whose excess their
+    deficit starts in. A light that runs past the end of a heavy's excess is
+    still charged to that heavy in full, and the heavy covers the overrun
+    from the next heavy's column, so every column still holds at most two
+    products.
+    """
+
+    def __init__(self, weights):
+        weights = np.asarray(weights, dtype=np.float64)
+        n = len(weights)
+        scaled = weights * n / weights.sum()
+        self.prob = np.ones(n)
+        self.alias = np.arange(n)
+        
+        light = np.flatnonzero(scaled < 1.0)
+        heavy = np.flatnonzero(scaled >= 1.0)
+        if len(light) and len(heavy):
+            deficit = 1.0 - scaled[light]
+            deficit_end = np.cumsum(deficit)
+            deficit_start = deficit_end - deficit
+            excess_end = np.cumsum(scaled[heavy] - 1.0)
+            
+            donor = np.searchsorted(excess_end, deficit_start, side='right')
+            self.prob[light] = scaled[light]
+            self.alias[light] = heavy[np.minimum(donor, len(heavy) - 1)]
+            
+            # Overrun past each heavy's excess, taken from the next heavy
+            boundaries = excess_end[:-1]
+            straddling = np.minimum(np.searchsorted(deficit_end, boundaries, side='right'), len(light) - 1)
+            overrun = np.where(deficit_start[straddling] < boundaries, deficit_end[straddling] - boundaries, 0.0)
+            self.prob[heavy[:-1]] = 1.0 - np.clip(overrun, 0.0, 1.0)
+            self.alias[heavy[:-1]] = heavy[1:]
+        
+        self.built_at = time.monotonic()
+    
+    def draw(self, size, rng=_rng):
+        columns = rng.integers(0, len(self.prob), size=size)
+        return np.where(rng.random(size) < self.prob[columns], columns, self.alias[columns])
+
+def popularity_weights(ids):
+    """Draw weights for pool IDs: 1 for no interactions up to POPULARITY_BOOST for the most popular"""
+    trending = get_trending('decayed')
+    weights = np.ones(len(ids))
+    if not trending or len(ids) == 0:
+        return weights
+    
+    scored_ids = np.fromiter((product_id for product_id, _ in trending), dtype=np.int64, count=len(trending))
+    scores = np.fromiter((score for _, score in trending), dtype=np.float64, count=len(trending))
+    top = scores.max()
+    if top <= 0:
+        return weights
+    
+    order = np.argsort(scored_ids)
+    scored_ids, scores = scored_ids[order], scores[order]
+    positions = np.minimum(np.searchsorted(scored_ids, ids), len(scored_ids) - 1)
+    popularity = np.where(scored_ids[positions] == ids, scores[positions], 0.0)
+    return weights + (POPULARITY_BOOST - 1.0) * popularity / top
+
+class SamplingPools:
+    """Candidate pools for one catalog version"""
+
+    def __init__(self, facet_index):
+        self.index = facet_index
+        self.catalog_version = facet_index.catalog_version
+        self.pools = {}
+        self.alias_tables = {}
+        self.rebuilding = set()
+        self.lock = threading.Lock()
+        
+        name = facet_index.name
+        self.women = contains_any(name, WOMEN_TERMS)
+        self.men = contains_any(name, MEN_TERMS) & ~self.women   # 'men' is inside 'women'
+    
+    def pool(self, key):
+        """int64 array of the product IDs matching a pool_key"""
+        with self.lock:
+            if key in self.pools:
+                return self.pools[key]
+        
+        index = self.index
+        mask = np.ones(len(index), dtype=bool)
+        if key[0]:
+            mask &= index.category_contains([key[0]])
+        if key[1]:
+            mask &= contains_any(index.name, key[1])
+        if key[2] == 'men':
+            mask &= self.men
+        elif key[2] == 'women':
+            mask &= self.women
+        if key[3]:
+            mask &= ~contains_any(index.name, key[3])
+        ids = index.ids[mask]
+        
+        with self.lock:
+            if len(self.pools) >= MAX_POOLS:
+                self.pools.clear()
+                self.alias_tables.clear()
+            self.pools[key] = ids
+        return ids
+    
+    def alias_table(self, key, ids):
+        """
+        Popularity-weighted alias table for a pool, rebuilt as popularity moves
+        
+        One caller rebuilds a stale table while the others keep drawing from
+        it; the new table replaces it in one assignment.
+        """
+        with self.lock:
+            table = self.alias_tables.get(key)
+            if table is not None and (
+                time.monotonic() - table.built_at < POPULARITY_FLUSH_SECONDS or key in self.rebuilding
+            ):
+                return table
+            self.rebuilding.add(key)
+        
+        try:
+            table = AliasTable(popularity_weights(ids))
+            with self.lock:
+                self.alias_tables[key] = table
+            return table
+        finally:
+            with self.lock:
+                self.rebuilding.discard(key)
+
+_pools = None
+_pools_lock = threading.Lock()
+
+def get_sampling_pools():
+    """Shared pools, rebuilt whenever the facet index moves to a new catalog version"""
+    global _pools
+    
+    index = get_facet_index()
+    pools = _pools
+    if pools is not None and pools.index is index:
+        return pools
+    
+    with _pools_lock:
+        if _pools is None or _pools.index is not index:
+            _pools = SamplingPools(index)
+        return _pools
+
+def sample_product_ids(k, category=None, name_terms=None, gender=None, exclude=None,
+                       exclude_terms=DEFAULT_EXCLUDED_TERMS, weighted=False):
+    """
+    Draw up to k distinct random product IDs from a pool
+    
+    Args:
+        k: Number of IDs
+        category, name_terms, gender, exclude_terms: Pool spec (see pool_key)
+        exclude: Product IDs never to return (e.g. the cart)
+        weighted: Favour popular products instead of sampling uniformly
+    
+    Returns:
+        List of product IDs in random order
+    """
+    pools = get_sampling_pools()
+    key = pool_key(category, name_terms, gender, exclude_terms)
+    ids = pools.pool(key)
+    excluded = {int(pid) for pid in exclude or [] if pid is not None}
+    if k <= 0 or len(ids) == 0:
+        return []
+    
+    if not weighted:
+        # Over-draw by the excluded count so removing them still leaves k
+        positions = floyd_sample(len(ids), k + len(excluded))
+        return [int(ids[p]) for p in positions if int(ids[p]) not in excluded][:k]
+    
+    table = pools.alias_table(key, ids)
+    chosen = []
+    seen = set(excluded)
+    # Duplicates are rejected; a bounded number of rounds keeps tiny pools from spinning
+    for _ in range(8):
+        for position in table.draw(2 * (k - len(chosen)) + 1):
+            product_id = int(ids[position])
+            if product_id not in seen:
+                seen.add(product_id)
+                chosen.append(product_id)
+                if len(chosen) == k:
+                    return chosen
+    return chosen
@@ -0,0 +1,169 @@
+import re
+from sqlalchemy import select, table, column, literal_column, func, text
+from database.models import db
+from database.fts import PRODUCT_FTS_TABLE, product_fts_exists
+
+# BM25 column weights: name, description, category, subcategory
+FTS_COLUMN_WEIGHTS = (10.0, 2.0, 4.0, 3.0)
+
+SEARCH_STOPWORDS = {'and', 'with', 'or', 'the', 'a', 'an', 'some', 'for', 'in', 'of'}
+
+# Common voice recognition mistakes, applied after punctuation is stripped
+VOICE_CORRECTIONS = {
+    'tshirts': 't-shirts',
+    'tshirt': 't-shirt',
+    'jense': 'jeans',
+    'red tshirts': 'red t-shirts',
+    'blue jense': 'blue jeans'
+}
+
+# One pass over the text for every correction, longest first (so 'tshirts' beats 'tshirt')
+VOICE_CORRECTION_PATTERN = re.compile('|'.join(
+    re.escape(incorrect) for incorrect in sorted(VOICE_CORRECTIONS, key=len, reverse=True)
+))
+
+# Punctuation except hyphens and decimal points inside numbers ("49.99" stays a price)
+PUNCTUATION_PATTERN = re.compile(r'(?!(?<=\d)\.\d)[^\w\s-]')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+# Clothing words that give a bare color term a clothing context in multi-item searches
+CLOTHING_CONTEXT_TERMS = ['shirt', 'top', 'pants', 'jeans', 'clothing', 'apparel']
+
+product_fts = table(PRODUCT_FTS_TABLE, column('rowid'))
+
+_fts_available = None
+
+def fts_available():
+    """Check (once per process) whether the FTS5 product index exists"""
+    global _fts_available
+    
+    if _fts_available is None:
+        try:
+            with db.engine.connect() as connection:
+                _fts_available = product_fts_exists(connection)
+        except Exception as e:
+            print(f"Error checking FTS index: {e}")
+            return False
+    
+    return _fts_available
+
+def normalize_search_text(value):
+    """Lowercase, strip punctuation (except hyphens and decimal points) and apply VOICE_CORRECTIONS"""
+    if not value:
+        return ""
+    
+    cleaned = PUNCTUATION_PATTERN.sub('', value.strip())  # Remove punctuation except hyphens and decimal points
+    cleaned = WHITESPACE_PATTERN.sub(' ', cleaned)  # Normalize whitespace
+    cleaned = cleaned.lower().strip()
+    
+    return VOICE_CORRECTION_PATTERN.sub(lambda match: VOICE_CORRECTIONS[match.group(0)], cleaned)
+
+def tokenize_query(query):
+    """Split a cleaned query into searchable terms, dropping stopwords"""
+    terms = re.findall(r'[\w-]+', query.lower())
+    return [term.strip('-') for term in terms if term.strip('-') and term not in SEARCH_STOPWORDS]
+
+def quote_fts_term(term, prefix=True):
+    """Quote a term as an FTS5 string so user input can never inject query syntax"""
+    quoted = '"' + term.replace('"', '""') + '"'
+    return quoted + '*' if prefix else quoted
+
+def build_match_expression(query, search_components):
+    """
+    Build an FTS5 MATCH expression for a product search
+    
+    Single-item queries require every term (implicit AND). Multi-item queries
+    ("red t-shirt with jeans") match any color+type pair, any clothing type,
+    or a color in a clothing context; BM25 then ranks rows that hit more of
+    them first.
+    
+    Returns:
+        MATCH expression string, or None if the query has no searchable terms
+    """
+    terms = tokenize_query(query)
+    if not terms:
+        return None
+    
+    if not search_components.get('is_multi_item'):
+        return ' '.join(quote_fts_term(term) for term in terms)
+    
+    colors = search_components.get('colors', [])
+    clothing_types = search_components.get('clothing_types', [])
+    groups = []
+    
+    for color in colors:
+        for clothing_type in clothing_types:
+            groups.append(f"({quote_fts_term(color)} AND {quote_fts_term(clothing_type)})")
+    
+    for clothing_type in clothing_types:
+        groups.append(quote_fts_term(clothing_type))
+    
+    context = ' OR '.join(quote_fts_term(term) for term in CLOTHING_CONTEXT_TERMS)
+    for color in colors:
+        groups.append(f"({quote_fts_term(color)} AND ({context}))")
+    
+    if not groups:
+        # Multi-item phrasing without known colors/types: match any term
+        groups = [quote_fts_term(term) for term in terms]
+    
+    return ' OR '.join(groups)
+
+def fts_rank_subquery(match_expression):
+    """
+    Subquery of (product_id, rank) rows matching an FTS5 expression
+    
+    rank is the weighted BM25 score; lower is more relevant.
+    """
+    fts_table = literal_column(PRODUCT_FTS_TABLE)
+    return (
+        select(
+            product_fts.c.rowid.label('product_id'),
+            func.bm25(fts_table, *FTS_COLUMN_WEIGHTS).label('rank')
+        )
+        .select_from(product_fts)
+        .where(fts_table.op('MATCH')(match_expression))
+        .subquery('fts_match')
+    )
+
+def fts_suggestions(query, column_name, limit=5, clothing_categories=None):
+    """
+    Prefix-match autocomplete suggestions from one FTS column
+    
+    Args:
+        query: Cleaned user query (last term is treated as a prefix)
+        column_name: 'name' or 'category'
+        limit: Maximum number of distinct values
+        clothing_categories: Optional category substrings to restrict results to
+    
+    Returns:
+        List of distinct column values ordered by BM25 rank
+    """
+    terms = tokenize_query(query)
+    if not terms or column_name not in ('name', 'category'):
+        return []
+    
+    match_expression = f"{column_name} : (" + ' '.join(quote_fts_term(term) for term in terms) + ")"
+    
+    # bm25() cannot be evaluated inside an aggregate, so rank in a materialized CTE first
+    sql = f"""
+        WITH fts_match AS MATERIALIZED (
+            SELECT rowid AS product_id, bm25({PRODUCT_FTS_TABLE}, {', '.join(str(w) for w in FTS_COLUMN_WEIGHTS)}) AS rank
+            FROM {PRODUCT_FTS_TABLE}
+            WHERE {PRODUCT_FTS_TABLE} MATCH :match
+        )
+        SELECT p.{column_name}, min(fts_match.rank) AS best_rank
+        FROM fts_match JOIN product p ON p.id = fts_match.product_id
+    """
+    params = {'match': match_expression, 'limit': limit}
+    
+    if clothing_categories:
+        category_conditions = []
+        for i, category in enumerate(clothing_categories):
+            category_conditions.append(f"p.category LIKE :cat{i}")
+            params[f'cat{i}'] = f'%{category}%'
+        sql += " WHERE " + ' OR '.join(category_conditions)
+    
+    sql += f" GROUP BY p.{column_name} ORDER BY best_rank LIMIT :limit"
+    
+    rows = db.session.execute(text(sql), params).fetchall()
+    return [row[0] for row in rows if row[0]]
@@ -4,40 +4,120 @@ import pickle
 import os
 import traceback
 from database.models import Product, db
-from services.clip_model import extract_features_as_embedding
+from services.clip_model import extract_features_as_embedding, extract_text_embedding
+from services.neighbors import get_neighbor_ids
+from services.sampling import sample_product_ids
+from services.db_service import get_products_by_ids
+from services.outfit_graph import get_outfit_graph
 from sqlalchemy import func, and_, or_, not_
-import random
 
 # Paths for storing embeddings and indices
 EMBEDDINGS_DIR = 'data/embeddings'
 IMAGE_INDEX_PATH = os.path.join(EMBEDDINGS_DIR, 'faiss_index.bin')
 PRODUCT_IDS_PATH = os.path.join(EMBEDDINGS_DIR, 'product_ids.npy')
+TEXT_INDEX_PATH = os.path.join(EMBEDDINGS_DIR, 'text_faiss_index.bin')
+TEXT_PRODUCT_IDS_PATH = os.path.join(EMBEDDINGS_DIR, 'text_product_ids.npy')
 
-# Global variables for loaded indices
-_image_index = None
-_image_product_ids = None
+INDEX_TYPES = ('image', 'text', 'fused')
+
+INDEX_PATHS = {
+    'image': (IMAGE_INDEX_PATH, PRODUCT_IDS_PATH),
+    'text': (TEXT_INDEX_PATH, TEXT_PRODUCT_IDS_PATH)
+}
+
+# IVF lists probed per query (the text index is IVF on large catalogs)
+FAISS_NPROBE = 10
+
+# Global variables for loaded indices: index_type -> (index, product_ids)
+_indices = {}
+
+class FusedIndex:
+    """
+    Image and text indices searched together and merged by reciprocal rank,
+    which is robust to the two spaces having different similarity scales.
+    Exposes the FAISS search() interface, with row positions into the union
+    of both product id arrays.
+    """
+    
+    def __init__(self, image_index, image_product_ids, text_index, text_product_ids):
+        self.parts = [(image_index, np.asarray(image_product_ids)), (text_index, np.asarray(text_product_ids))]
+        self.product_ids = np.union1d(image_product_ids, text_product_ids)
+        self.ntotal = len(self.product_ids)
+        self.d = image_index.d
+    
+    def search(self, queries, k):
+        from services.hybrid_search import reciprocal_rank_fusion
+        
+        all_scores = np.zeros((len(queries), k), dtype=np.float32)
+        all_rows = np.full((len(queries), k), -1, dtype=np.int64)
+        
+        ranked = [part_index.search(queries, min(k, part_index.ntotal))[1] for part_index, _ in self.parts]
+        for q in range(len(queries)):
+            lists = {
+                name: [int(part_ids[i]) for i in rows[q] if 0 <= i < len(part_ids)]
+                for name, rows, (_, part_ids) in zip(('image', 'text'), ranked, self.parts)
+            }
+            fused = reciprocal_rank_fusion(lists)[:k]
+            for rank, (product_id, score, _) in enumerate(fused):
+                all_rows[q, rank] = np.searchsorted(self.product_ids, product_id)
+                all_scores[q, rank] = score
+        
+        return all_scores, all_rows
 
 def load_faiss_index(index_type='image'):
-    """Load FAISS index and product IDs"""
-    global _image_index, _image_product_ids
+    """
+    Load FAISS index and product IDs
     
+    Args:
+        index_type: 'image' (CLIP image vectors), 'text' (CLIP product-text
+            vectors) or 'fused' (both, merged by rank)
+    
+    Returns:
+        (index, product_ids), or (None, None) if the index files are missing
+    """
     try:
-        if _image_index is None:
-            print(f"Loading FAISS index from {IMAGE_INDEX_PATH}")
-            if os.path.exists(IMAGE_INDEX_PATH) and os.path.exists(PRODUCT_IDS_PATH):
-                _image_index = faiss.read_index(IMAGE_INDEX_PATH)
-                _image_product_ids = np.load(PRODUCT_IDS_PATH)
-                print(f"FAISS index loaded successfully with {_image_index.ntotal} vectors of dimension {_image_index.d}")
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type '{index_type}'")
+        
+        if index_type not in _indices:
+            if index_type == 'fused':
+                image_index, image_product_ids = load_faiss_index('image')
+                text_index, text_product_ids = load_faiss_index('text')
+                if image_index is None or text_index is None:
+                    return None, None
+                fused = FusedIndex(image_index, image_product_ids, text_index, text_product_ids)
+                _indices['fused'] = (fused, fused.product_ids)
             else:
-                print("FAISS index files not found. Please run load_data.py first.")
-                return None, None
-        return _image_index, _image_product_ids
+                index_path, ids_path = INDEX_PATHS[index_type]
+                print(f"Loading {index_type} FAISS index from {index_path}")
+                if not (os.path.exists(index_path) and os.path.exists(ids_path)):
+                    print(f"{index_type.capitalize()} FAISS index files not found. Please run load_data.py first.")
+                    return None, None
+                
+                index = faiss.read_index(index_path)
+                if hasattr(index, 'nprobe'):
+                    index.nprobe = FAISS_NPROBE
+                _indices[index_type] = (index, np.load(ids_path))
+                print(f"FAISS index loaded successfully with {index.ntotal} vectors of dimension {index.d}")
+        
+        return _indices[index_type]
             
     except Exception as e:
         print(f"Error loading FAISS index ({index_type}): {e}")
         traceback.print_exc()
         return None, None
 
+def default_index_type(features_or_embeddings):
+    """
+    Index matching the query's modality: image files and raw vectors search
+    the image index, text and feature dicts the text index when it exists
+    """
+    if isinstance(features_or_embeddings, (list, np.ndarray)):
+        return 'image'
+    if isinstance(features_or_embeddings, str) and os.path.exists(features_or_embeddings):
+        return 'image'
+    return 'text' if os.path.exists(TEXT_INDEX_PATH) else 'image'
+
 def calculate_primary_color_similarity_score(target_features, product):
     """
     Advanced similarity calculation with PRIMARY COLOR INTELLIGENCE
@@ -342,9 +422,15 @@ def filter_products_by_primary_color_criteria(target_features, limit=50):
         traceback.print_exc()
         return []
 
-def search_similar_products(features_or_embeddings, limit=10, index_type='image'):
-    """Enhanced search with PRIMARY COLOR INTELLIGENCE"""
+def search_similar_products(features_or_embeddings, limit=10, index_type=None):
+    """
+    Enhanced search with PRIMARY COLOR INTELLIGENCE
+    
+    index_type is 'image', 'text' or 'fused'; None picks the index matching
+    the query's modality (see default_index_type).
+    """
     try:
+        index_type = index_type or default_index_type(features_or_embeddings)
         print(f"Primary color intelligent search using {index_type} index")
         
         # Priority 1: Primary color intelligent feature-based search
@@ -360,6 +446,9 @@ def search_similar_products(features_or_embeddings, limit=10, index_type='image'
         print("Using FAISS vector search with primary color post-filtering")
         
         index, product_ids = load_faiss_index(index_type)
+        if (index is None or product_ids is None) and index_type != 'image':
+            print(f"Could not load {index_type} FAISS index, using the image index")
+            index, product_ids = load_faiss_index('image')
         if index is None or product_ids is None:
             print(f"Could not load {index_type} FAISS index")
             return fallback_similarity_search(features_or_embeddings, limit)
@@ -367,6 +456,12 @@ def search_similar_products(features_or_embeddings, limit=10, index_type='image'
         # Generate query embedding
         if isinstance(features_or_embeddings, (list, np.ndarray)) and len(features_or_embeddings) == 512:
             query_embedding = np.array(features_or_embeddings, dtype=np.float32).reshape(1, -1)
+        elif isinstance(features_or_embeddings, str) and not os.path.exists(features_or_embeddings):
+            # Free text goes through the CLIP text tower
+            query_embedding = extract_text_embedding(features_or_embeddings)
+            if query_embedding is None:
+                return fallback_similarity_search(features_or_embeddings, limit)
+            query_embedding = np.array(query_embedding, dtype=np.float32).reshape(1, -1)
         else:
             query_embedding = extract_features_as_embedding(features_or_embeddings)
             query_embedding = query_embedding.reshape(1, -1)
@@ -417,15 +512,21 @@ def search_similar_products(features_or_embeddings, limit=10, index_type='image'
         traceback.print_exc()
         return fallback_similarity_search(features_or_embeddings, limit)
 
-def find_similar_products(features_or_embeddings, limit=10, index_type='image'):
+def find_similar_products(features_or_embeddings, limit=10, index_type=None):
     """Alias for search_similar_products"""
     return search_similar_products(features_or_embeddings, limit, index_type)
 
-def search_by_image_id(image_id, limit=10, index_type='image'):
+def search_by_image_id(image_id, limit=10, index_type=None):
     """Search for similar products using an existing product's image with color intelligence"""
     try:
         print(f"Searching by image ID with color intelligence: {image_id}")
         
+        # Precomputed visual neighbours answer this without touching the database
+        neighbor_ids = get_neighbor_ids(image_id, limit)
+        if len(neighbor_ids) >= limit:
+            print(f"Returning {len(neighbor_ids)} precomputed visual neighbours")
+            return neighbor_ids
+        
         product = Product.query.get(image_id)
         if not product:
             print(f"Product {image_id} not found")
@@ -513,272 +614,22 @@ def search_by_image_id(image_id, limit=10, index_type='image'):
         return []
 
 def get_complementary_products(product, limit=10):
-    """ENHANCED: True complementary products - items that go WITH the main product"""
+    """
+    True complementary products - items that go WITH the main product
+    
+    Looks the product up in the precompiled outfit graph (slots such as
+    bottoms / shoes / accessories, filtered by gender and ranked by color
+    compatibility), then loads the products with one query.
+    """
     try:
         if not product:
             return []
         
-        print(f"🛍️ Getting COMPLEMENTARY products for: {product.name}")
-        
-        product_name = product.name.lower() if product.name else ''
-        product_desc = product.description.lower() if product.description else ''
-        product_category = product.category.lower() if product.category else ''
+        ranked = get_outfit_graph().complementary_ids(product.id, limit)
+        complementary = get_products_by_ids([product_id for product_id, _ in ranked])
         
-        # Detect gender context
-        gender_context = 'unisex'
-        if any(term in product_name or term in product_desc for term in ['women', 'woman', 'female', 'ladies', 'girl']):
-            gender_context = 'women'
-        elif any(term in product_name or term in product_desc for term in ['men', 'man', 'male', 'guys']):
-            gender_context = 'men'
-        elif any(term in product_name or term in product_desc for term in ['kids', 'children', 'child', 'teen']):
-            gender_context = 'kids'
-        
-        # Detect product color for matching
-        detected_colors = []
-        colors_to_check = ['black', 'white', 'red', 'blue', 'green', 'yellow', 'pink', 'purple', 'brown', 'gray', 'grey', 'orange', 'navy']
-        for color in colors_to_check:
-            if color in product_name:
-                detected_colors.append(color)
-        
-        print(f"📊 Context: Gender={gender_context}, Colors={detected_colors}")
-        
-        # COMPLEMENTARY MAPPING LOGIC
-        complementary_categories = []
-        
-        # 👕 CLOTHING TOPS (t-shirts, shirts, tops, blouses, dresses)
-        if any(item in product_name for item in ['shirt', 't-shirt', 'top', 'blouse', 'polo', 'sweater', 'hoodie', 'jacket']):
-            print("🎯 Main product: CLOTHING TOP")
-            complementary_categories = [
-                # Bottoms
-                {'items': ['jeans', 'pants', 'trousers', 'shorts'], 'weight': 0.4, 'type': 'bottoms'},
-                # Shoes  
-                {'items': ['shoes', 'sneakers', 'boots', 'sandals'], 'weight': 0.3, 'type': 'shoes'},
-                # Accessories
-                {'items': ['bag', 'handbag', 'backpack', 'wallet', 'belt'], 'weight': 0.2, 'type': 'accessories'},
-                # Outerwear (if main is not outerwear)
-                {'items': ['jacket', 'coat', 'blazer'], 'weight': 0.1, 'type': 'outerwear'} if 'jacket' not in product_name else None
-            ]
-        
-        # 👖 CLOTHING BOTTOMS (jeans, pants, shorts, skirts)
-        elif any(item in product_name for item in ['jeans', 'pants', 'trousers', 'shorts', 'skirt']):
-            print("🎯 Main product: CLOTHING BOTTOM")
-            complementary_categories = [
-                # Tops
-                {'items': ['shirt', 't-shirt', 'top', 'blouse', 'polo'], 'weight': 0.4, 'type': 'tops'},
-                # Shoes
-                {'items': ['shoes', 'sneakers', 'boots', 'sandals'], 'weight': 0.3, 'type': 'shoes'},
-                # Accessories
-                {'items': ['belt', 'bag', 'handbag', 'wallet'], 'weight': 0.2, 'type': 'accessories'},
-                # Outerwear
-                {'items': ['jacket', 'coat', 'blazer'], 'weight': 0.1, 'type': 'outerwear'}
-            ]
-        
-        # 👗 DRESSES
-        elif 'dress' in product_name:
-            print("🎯 Main product: DRESS")
-            complementary_categories = [
-                # Shoes (most important for dresses)
-                {'items': ['shoes', 'heels', 'sandals', 'boots'], 'weight': 0.4, 'type': 'shoes'},
-                # Accessories
-                {'items': ['bag', 'handbag', 'purse', 'clutch'], 'weight': 0.3, 'type': 'accessories'},
-                # Jewelry & accessories
-                {'items': ['jewelry', 'necklace', 'earrings', 'bracelet'], 'weight': 0.2, 'type': 'jewelry'},
-                # Outerwear
-                {'items': ['jacket', 'cardigan', 'blazer'], 'weight': 0.1, 'type': 'outerwear'}
-            ]
-        
-        # 👟 SHOES
-        elif any(item in product_name for item in ['shoes', 'sneakers', 'boots', 'sandals', 'heels']):
-            print("🎯 Main product: SHOES")
-            complementary_categories = [
-                # Bottoms (shoes need something to go with)
-                {'items': ['jeans', 'pants', 'shorts'], 'weight': 0.3, 'type': 'bottoms'},
-                # Tops
-                {'items': ['shirt', 't-shirt', 'top'], 'weight': 0.3, 'type': 'tops'},
-                # Accessories
-                {'items': ['bag', 'backpack', 'belt'], 'weight': 0.2, 'type': 'accessories'},
-                # Socks (practical complementary)
-                {'items': ['socks', 'hosiery'], 'weight': 0.2, 'type': 'socks'}
-            ]
-        
-        # 👜 BAGS & ACCESSORIES
-        elif any(item in product_name for item in ['bag', 'handbag', 'backpack', 'purse', 'wallet', 'belt']):
-            print("🎯 Main product: ACCESSORY")
-            complementary_categories = [
-                # Clothing (accessories need clothing to complement)
-                {'items': ['shirt', 't-shirt', 'dress', 'top'], 'weight': 0.4, 'type': 'clothing'},
-                # Shoes
-                {'items': ['shoes', 'sneakers', 'boots'], 'weight': 0.3, 'type': 'shoes'},
-                # Other accessories
-                {'items': ['jewelry', 'watch', 'sunglasses'], 'weight': 0.2, 'type': 'accessories'},
-                # Bottoms
-                {'items': ['jeans', 'pants'], 'weight': 0.1, 'type': 'bottoms'}
-            ]
-        
-        # 💎 JEWELRY
-        elif any(item in product_name for item in ['jewelry', 'necklace', 'earrings', 'bracelet', 'ring', 'watch']):
-            print("🎯 Main product: JEWELRY")
-            complementary_categories = [
-                # Dresses (jewelry complements dresses well)
-                {'items': ['dress', 'gown'], 'weight': 0.3, 'type': 'dresses'},
-                # Tops
-                {'items': ['blouse', 'top', 'shirt'], 'weight': 0.3, 'type': 'tops'},
-                # Bags
-                {'items': ['handbag', 'purse', 'clutch'], 'weight': 0.2, 'type': 'bags'},
-                # Shoes
-                {'items': ['heels', 'sandals', 'shoes'], 'weight': 0.2, 'type': 'shoes'}
-            ]
-        
-        else:
-            # FALLBACK: General clothing
-            print("🎯 Main product: GENERAL ITEM")
-            complementary_categories = [
-                {'items': ['jeans', 'pants'], 'weight': 0.3, 'type': 'bottoms'},
-                {'items': ['shoes', 'sneakers'], 'weight': 0.3, 'type': 'shoes'},
-                {'items': ['bag', 'accessories'], 'weight': 0.2, 'type': 'accessories'},
-                {'items': ['jacket'], 'weight': 0.2, 'type': 'outerwear'}
-            ]
-        
-        # Remove None entries
-        complementary_categories = [cat for cat in complementary_categories if cat is not None]
-        
-        print(f"🎯 Complementary categories: {[cat['type'] for cat in complementary_categories]}")
-        
-        # BUILD QUERIES FOR EACH COMPLEMENTARY CATEGORY
-        complementary_products = []
-        
-        for category_info in complementary_categories:
-            try:
-                items = category_info['items']
-                weight = category_info['weight']
-                category_type = category_info['type']
-                
-                # Build query conditions
-                item_conditions = []
-                for item in items:
-                    item_conditions.append(Product.name.ilike(f'%{item}%'))
-                
-                if not item_conditions:
-                    continue
-                
-                # Base query
-                query = Product.query.filter(
-                    or_(*item_conditions),
-                    Product.id != product.id  # Exclude the main product
-                )
-                
-                # APPLY GENDER FILTERING (strict)
-                if gender_context != 'unisex':
-                    if gender_context == 'men':
-                        gender_include = [Product.name.ilike(f'%{term}%') for term in ['men', 'man', 'male', 'guys']]
-                        gender_exclude = [
-                            ~Product.name.ilike('%women%'),
-                            ~Product.name.ilike('%female%'),
-                            ~Product.name.ilike('%ladies%'),
-                            ~Product.name.ilike('%girl%')
-                        ]
-                        
-                        if gender_include:
-                            query = query.filter(or_(*gender_include))
-                        if gender_exclude:
-                            query = query.filter(and_(*gender_exclude))
-                    
-                    elif gender_context == 'women':
-                        gender_include = [Product.name.ilike(f'%{term}%') for term in ['women', 'woman', 'female', 'ladies']]
-                        gender_exclude = [
-                            ~Product.name.ilike('%men%'),
-                            ~Product.name.ilike('%male%'),
-                            ~Product.name.ilike('%guys%')
-                        ]
-                        
-                        if gender_include:
-                            query = query.filter(or_(*gender_include))
-                        if gender_exclude:
-                            query = query.filter(and_(*gender_exclude))
-                
-                # COLOR MATCHING BONUS (optional - find matching or neutral colors)
-                color_conditions = []
-                if detected_colors:
-                    # Look for same colors
-                    for color in detected_colors:
-                        color_conditions.append(Product.name.ilike(f'%{color}%'))
-                    
-                    # Add neutral colors that go with everything
-                    neutral_colors = ['black', 'white', 'gray', 'grey', 'navy']
-                    for neutral in neutral_colors:
-                        if neutral not in detected_colors:
-                            color_conditions.append(Product.name.ilike(f'%{neutral}%'))
-                
-                # Execute query
-                max_per_category = max(1, int(limit * weight))
-                category_products = query.limit(max_per_category * 2).all()
-                
-                # If we have color conditions, prefer color matches
-                if color_conditions and category_products:
-                    color_matched = []
-                    non_color_matched = []
-                    
-                    for p in category_products:
-                        p_name = p.name.lower()
-                        if any(color in p_name for color in detected_colors + ['black', 'white', 'gray', 'grey']):
-                            color_matched.append(p)
-                        else:
-                            non_color_matched.append(p)
-                    
-                    # Prefer color matches but include some variety
-                    final_category_products = color_matched[:max_per_category//2] + non_color_matched[:max_per_category//2]
-                    final_category_products = final_category_products[:max_per_category]
-                else:
-                    final_category_products = category_products[:max_per_category]
-                
-                complementary_products.extend(final_category_products)
-                
-                print(f"✅ Found {len(final_category_products)} products for {category_type}")
-                
-                if len(complementary_products) >= limit:
-                    break
-                
-            except Exception as e:
-                print(f"❌ Error in category {category_info.get('type', 'unknown')}: {e}")
-                continue
-        
-        # FALLBACK: If no complementary products found, get some general items
-        if not complementary_products:
-            print("🔄 No specific complementary products found, using fallback...")
-            
-            fallback_query = Product.query.filter(
-                Product.id != product.id,
-                ~Product.name.ilike('%infant%'),
-                ~Product.name.ilike('%baby%')
-            )
-            
-            if gender_context != 'unisex':
-                if gender_context == 'men':
-                    fallback_query = fallback_query.filter(
-                        or_(Product.name.ilike('%men%'), Product.name.ilike('%male%'))
-                    )
-                elif gender_context == 'women':
-                    fallback_query = fallback_query.filter(
-                        or_(Product.name.ilike('%women%'), Product.name.ilike('%female%'))
-                    )
-            
-            complementary_products = fallback_query.limit(limit).all()
-        
-        # Remove duplicates and limit
-        seen_ids = set()
-        unique_complementary = []
-        for p in complementary_products:
-            if p.id not in seen_ids:
-                unique_complementary.append(p)
-                seen_ids.add(p.id)
-                if len(unique_complementary) >= limit:
-                    break
-        
-        print(f"🎯 FINAL: {len(unique_complementary)} complementary products for {product.name}")
-        for p in unique_complementary[:3]:
-            print(f"   - {p.name}")
-        
-        return unique_complementary
+        print(f"🎯 {len(complementary)} complementary products for {product.name} (slots: {sorted({slot for _, slot in ranked})})")
+        return complementary
         
     except Exception as e:
         print(f"❌ Error getting complementary products: {e}")
@@ -814,31 +665,9 @@ def get_complementary_by_features(features, limit=8):
             # General complementary items
             complementary_items = ['shirt', 'jeans', 'shoes', 'bag']
         
-        # Build query
-        item_conditions = [Product.name.ilike(f'%{item}%') for item in complementary_items]
-        
-        query = Product.query.filter(or_(*item_conditions))
-        
-        # Apply gender filter
-        if gender != 'unisex':
-            if gender == 'men':
-                query = query.filter(
-                    or_(Product.name.ilike('%men%'), Product.name.ilike('%male%')),
-                    ~Product.name.ilike('%women%')
-                )
-            elif gender == 'women':
-                query = query.filter(
-                    or_(Product.name.ilike('%women%'), Product.name.ilike('%female%')),
-                    ~Product.name.ilike('%men%')
-                )
-        
-        # Get products
-        products = query.limit(limit * 2).all()
-        
-        # Shuffle for variety
-        random.shuffle(products)
-        
-        return products[:limit]
+        # Random picks (for variety) from the precomputed pool of matching names and gender
+        product_ids = sample_product_ids(limit, name_terms=complementary_items, gender=gender, exclude_terms=None)
+        return get_products_by_ids(product_ids)
         
     except Exception as e:
         print(f"❌ Error getting complementary by features: {e}")
@@ -853,17 +682,8 @@ def fallback_similarity_search(features_or_embeddings, limit=10):
         if isinstance(features_or_embeddings, dict):
             return [p['id'] for p in filter_products_by_primary_color_criteria(features_or_embeddings, limit)]
         
-        # Basic fallback with proper filtering
-        all_products = Product.query.filter(
-            not_(Product.name.ilike('%infant%')),
-            not_(Product.name.ilike('%baby%'))
-        ).limit(100).all()
-        
-        if not all_products:
-            return []
-        
-        random.shuffle(all_products)
-        return [p.id for p in all_products[:limit]]
+        # Basic fallback: random products, excluding infant / baby items
+        return sample_product_ids(limit)
         
     except Exception as e:
         print(f"Error in fallback search: {e}")
@@ -875,13 +695,15 @@ def get_index_stats():
     try:
         stats = {}
         
-        image_index, image_product_ids = load_faiss_index('image')
-        if image_index is not None:
-            stats['image_index'] = {
-                'total_vectors': image_index.ntotal,
-                'dimension': image_index.d,
-                'product_count': len(image_product_ids) if image_product_ids is not None else 0
-            }
+        for index_type in ('image', 'text'):
+            index, product_ids = load_faiss_index(index_type)
+            if index is not None:
+                stats[f'{index_type}_index'] = {
+                    'total_vectors': index.ntotal,
+                    'dimension': index.d,
+                    'product_count': len(product_ids) if product_ids is not None else 0
+                }
+        stats['index_types'] = [index_type for index_type in INDEX_TYPES if load_faiss_index(index_type)[0] is not None]
         
         stats['primary_color_intelligence'] = True
         stats['color_hierarchy_support'] = True
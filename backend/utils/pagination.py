@@ -0,0 +1,177 @@
+import base64
+import json
+from flask import Response, jsonify, stream_with_context
+from sqlalchemy import and_, or_
+
+# Rows fetched per round trip while streaming a page
+STREAM_BATCH_SIZE = 100
+
+class InvalidCursor(ValueError):
+    """Raised when a cursor is malformed or was issued for a different sort order"""
+
+def encode_cursor(sort_name, values):
+    """
+    Opaque cursor for the sort-key values of the last row on a page
+    
+    Args:
+        sort_name: Name of the sort order the values belong to
+        values: Sort-key values of the last row, in sort order
+    
+    Returns:
+        URL-safe string
+    """
+    payload = json.dumps({'s': sort_name, 'v': list(values)}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor, sort_name, key_count):
+    """
+    Decode a cursor issued by encode_cursor for the same sort order
+    
+    Returns:
+        List of sort-key values
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        values = payload['v']
+    except (ValueError, TypeError, KeyError) as e:
+        raise InvalidCursor(f"Malformed cursor: {e}")
+    
+    if payload.get('s') != sort_name or not isinstance(values, list) or len(values) != key_count:
+        raise InvalidCursor("Cursor does not belong to this sort order")
+    return values
+
+def keyset_condition(sort_keys, values):
+    """
+    WHERE clause selecting rows strictly after values in the given order
+    
+    (a, b) after (x, y) expands to a > x OR (a = x AND b > y), with < for
+    descending keys, so it works for mixed sort directions.
+    """
+    clauses = []
+    for i, (expression, direction) in enumerate(sort_keys):
+        value = values[i]
+        beyond = expression > value if direction == 'asc' else expression < value
+        equal_prefix = [sort_keys[j][0] == values[j] for j in range(i)]
+        clauses.append(and_(*equal_prefix, beyond) if equal_prefix else beyond)
+    return or_(*clauses)
+
+class KeysetPage:
+    """
+    One page of a query in a stable sort order, resumable by cursor
+    
+    The last sort key must be unique (normally the primary key) so every row
+    has exactly one position. Rows are fetched lazily in STREAM_BATCH_SIZE
+    batches; next_cursor is available once the page has been iterated.
+    """
+
+    def __init__(self, query, sort_keys, sort_name, cursor=None, limit=50):
+        self.sort_keys = sort_keys
+        self.sort_name = sort_name
+        self.limit = limit
+        self.next_cursor = None
+        
+        if cursor:
+            query = query.filter(keyset_condition(sort_keys, decode_cursor(cursor, sort_name, len(sort_keys))))
+        
+        order_by = [expression.asc() if direction == 'asc' else expression.desc() for expression, direction in sort_keys]
+        key_columns = [expression.label(f'sort_key_{i}') for i, (expression, _) in enumerate(sort_keys)]
+        
+        # One extra row tells us whether another page exists
+        self.query = query.add_columns(*key_columns).order_by(*order_by).limit(limit + 1)
+    
+    def __iter__(self):
+        last_values = None
+        for count, row in enumerate(self.query.yield_per(STREAM_BATCH_SIZE)):
+            if count == self.limit:
+                self.next_cursor = encode_cursor(self.sort_name, last_values)
+                break
+            last_values = list(row[1:])
+            yield row[0]
+    
+    def all(self):
+        return list(self)
+
+class Page:
+    """Already-materialized page with the same interface as KeysetPage"""
+
+    def __init__(self, items, next_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+    
+    def __iter__(self):
+        return iter(self.items)
+
+class SortedListPage(Page):
+    """
+    One page of an in-memory list in a stable sort order, resumable by cursor
+    
+    Uses the same cursor format as KeysetPage: the cursor holds the sort key
+    of the last item, so a later page starts strictly after it even if the
+    list has changed in between. sort_key must return a tuple of
+    JSON-serializable values that is unique per item.
+    """
+
+    def __init__(self, items, sort_key, sort_name, cursor=None, limit=50):
+        keyed = sorted(((tuple(sort_key(item)), item) for item in items), key=lambda pair: pair[0])
+        if cursor and keyed:
+            after = tuple(decode_cursor(cursor, sort_name, len(keyed[0][0])))
+            keyed = [(key, item) for key, item in keyed if key > after]
+        
+        next_cursor = encode_cursor(sort_name, keyed[limit - 1][0]) if len(keyed) > limit else None
+        super().__init__([item for _, item in keyed[:limit]], next_cursor)
+
+def stream_json_response(payload, items, items_key='products', trailer=None):
+    """
+    Stream a JSON object whose items list is written one element at a time
+    
+    Args:
+        payload: Dict of fields written before the items
+        items: Iterable of JSON-serializable items
+        items_key: Key the items are written under
+        trailer: Optional callable returning fields written after the items
+            (e.g. a next_cursor only known once the items have been consumed)
+    """
+    def generate():
+        head = json.dumps(payload)[:-1]
+        yield head + (', ' if payload else '') + json.dumps(items_key) + ': ['
+        
+        count = 0
+        for item in items:
+            yield (', ' if count else '') + json.dumps(item)
+            count += 1
+        
+        tail = {'total': count}
+        if trailer is not None:
+            tail.update(trailer())
+        yield '], ' + json.dumps(tail)[1:]
+    
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+def page_response(page, payload, serialize, stream=False, items_key='products'):
+    """
+    Respond with one page of items plus its next_cursor
+    
+    Args:
+        page: KeysetPage or Page
+        payload: Extra response fields
+        serialize: Callable turning an item into a JSON-serializable dict
+        stream: Write the items as chunked JSON instead of one jsonify blob
+    """
+    if stream:
+        return stream_json_response(
+            payload,
+            (serialize(item) for item in page),
+            items_key,
+            trailer=lambda: {'next_cursor': page.next_cursor, 'has_more': page.next_cursor is not None}
+        )
+    
+    items = [serialize(item) for item in page]
+    response = dict(payload)
+    response.update({
+        items_key: items,
+        'total': len(items),
+        'next_cursor': page.next_cursor,
+        'has_more': page.next_cursor is not None
+    })
+    return jsonify(response)
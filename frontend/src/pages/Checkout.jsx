@@ -169,12 +169,17 @@ const Checkout = () => {
         body: JSON.stringify({ 
           products, 
           user_id: userId,
-          cart_items: cart 
+          cart_items: cart,
+          quote_id: smartPricing?.quote_id
         }),
       });
       
       if (!response.ok) {
         const errorData = await response.json();
+        if (response.status === 409 && errorData.repriced) {
+          // The quote expired and the cart was re-priced to a different total; show it before charging
+          setSmartPricing(errorData.pricing);
+        }
         throw new Error(errorData.error || 'Failed to process checkout');
       }
       
@@ -13,6 +13,7 @@ const Results = () => {
   // Initialize all states with proper default values
   const [products, setProducts] = useState([]);
   const [originalProducts, setOriginalProducts] = useState([]); // NEW: Store original results
+  const [resultSetId, setResultSetId] = useState(null); // Server-side copy of the original results
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
   const [cart, setCart] = useState([]);
@@ -83,6 +84,7 @@ const Results = () => {
         if (Array.isArray(recommendations)) {
           setProducts(recommendations);
           setOriginalProducts(recommendations); // FIXED: Store original products
+          setResultSetId(data.result_set_id || null);
           console.log(`Set ${recommendations.length} products (original stored)`);
         } else {
           console.error('Recommendations is not an array:', recommendations);
@@ -237,18 +239,26 @@ const Results = () => {
       setChatLoading(true);
       console.log(`Refining from ${productsToRefine.length} original products with prompt:`, prompt);
 
-      const response = await fetch("/api/recommendations/refine", {
+      const refine = (body) => fetch("/api/recommendations/refine", {
         method: "POST",
         headers: {
           "Content-Type": "application/json",
         },
-        body: JSON.stringify({ 
-          products: productsToRefine, // FIXED: Always send original products
-          prompt,
-          original_count: productsToRefine.length
-        }),
+        body: JSON.stringify(body),
       });
 
+      // Refine the server's copy of the original results when it has one
+      const useResultSet = resultSetId && productsToRefine === originalProducts;
+      let response = await refine(useResultSet
+        ? { result_set_id: resultSetId, prompt }
+        : { products: productsToRefine, prompt, original_count: productsToRefine.length });
+
+      // The server copy expired: fall back to sending the original products
+      if (response.status === 410) {
+        setResultSetId(null);
+        response = await refine({ products: productsToRefine, prompt, original_count: productsToRefine.length });
+      }
+
       if (!response.ok) {
         throw new Error(`Failed to refine recommendations: ${response.status}`);
       }